@@ -49,15 +49,17 @@ import os.path
 import shutil
 import sys
 import tempfile
+import types
 
-# Modules included in our package.
-from pip_accel.bdist import BinaryDistributionManager
+# Modules included in our package. The modules that import pip (and pip
+# itself) are imported by the methods that need them, so that the command
+# line interface can check pip_accel.fingerprint before pip is imported.
 from pip_accel.compat import basestring
+from pip_accel.digests import DigestCache
 from pip_accel.exceptions import EnvironmentMismatchError, NothingToDoError
-from pip_accel.req import Requirement, TransactionalUpdate
+from pip_accel.fingerprint import InstallFingerprints
 from pip_accel.utils import (
     create_file_url,
-    hash_files,
     is_installed,
     makedirs,
     match_option,
@@ -69,12 +71,6 @@ from pip_accel.utils import (
 
 # External dependencies.
 from humanfriendly import concatenate, Timer, pluralize
-from pip import index as pip_index_module
-from pip import wheel as pip_wheel_module
-from pip.commands import install as pip_install_module
-from pip.commands.install import InstallCommand
-from pip.exceptions import DistributionNotFound
-from pip.req import InstallRequirement
 
 # Semi-standard module versioning.
 __version__ = '0.43'
@@ -104,8 +100,15 @@ class PipAccelerator(object):
         :param validate: :data:`True` to run :func:`validate_environment()`,
                          :data:`False` otherwise.
         """
+        from pip_accel.bdist import BinaryDistributionManager
+        from pip_accel.req import SourceIndex
+        from pip_accel.resolution import ResolutionCache
         self.config = config
         self.bdists = BinaryDistributionManager(self.config)
+        self.digest_cache = DigestCache(self.config)
+        self.source_index = SourceIndex(self.config)
+        self.resolution_cache = ResolutionCache(self.config, self.digest_cache, self.source_index)
+        self.install_fingerprints = InstallFingerprints(self.config, self.digest_cache)
         if validate:
             self.validate_environment()
         self.initialize_directories()
@@ -117,6 +120,9 @@ class PipAccelerator(object):
         self.reported_requirements = []
         # Keep a list of `.eggs' symbolic links created by pip-accel.
         self.eggs_links = []
+        # Map the source directories of requirements that pip didn't unpack
+        # to their archives and versions (see pip_accel.metadata).
+        self.deferred_archives = {}
 
     def validate_environment(self):
         """
@@ -201,10 +207,14 @@ class PipAccelerator(object):
         pip-accel and avoids trashing user's local source distribution indexes.
         The main disadvantage is that pip-accel is still required to clean up
         broken symbolic links...
+
+        The directory is scanned using :attr:`source_index` (a
+        :class:`.SourceIndex` object), which also finds the source
+        distribution archives of requirements, so the same scan is reused.
         """
         cleanup_timer = Timer()
         cleanup_counter = 0
-        for entry in os.listdir(self.config.source_index):
+        for entry in self.source_index.get_filenames():
             pathname = os.path.join(self.config.source_index, entry)
             if os.path.islink(pathname) and not os.path.exists(pathname):
                 logger.warn("Cleaning up broken symbolic link: %s", pathname)
@@ -222,6 +232,16 @@ class PipAccelerator(object):
         extending or embedding pip-accel you may want to call the underlying
         methods instead.
 
+        When :attr:`~.Config.pipeline` is enabled the work is delegated to a
+        :class:`~pip_accel.pipeline.Pipeline` instead.
+
+        When :attr:`~.Config.fingerprint_installs` is enabled and the same
+        installation succeeded before without the installed distributions
+        changing since, nothing is done (see :mod:`pip_accel.fingerprint`).
+
+        When :attr:`~.Config.lockfile` is set a lockfile is written after the
+        requirements have been installed (see :func:`create_lockfile()`).
+
         If the requirement set includes wheels and ``setuptools >= 0.8`` is not
         yet installed, it will be added to the requirement set and installed
         together with the other requirement(s) in order to enable the usage of
@@ -234,19 +254,124 @@ class PipAccelerator(object):
         :returns: The result of :func:`install_requirements()`.
         """
         try:
-            requirements = self.get_requirements(arguments, use_wheels=self.arguments_allow_wheels(arguments))
-            have_wheels = any(req.is_wheel for req in requirements)
-            if have_wheels and not self.setuptools_supports_wheels():
-                logger.info("Preparing to upgrade to setuptools >= 0.8 to enable wheel support ..")
-                requirements.extend(self.get_requirements(['setuptools >= 0.8']))
-            if requirements:
-                if '--user' in arguments:
-                    from site import USER_BASE
-                    kw.setdefault('prefix', USER_BASE)
-                return self.install_requirements(requirements, **kw)
+            # Installations into a custom prefix aren't fingerprinted because
+            # the fingerprint covers the directories on sys.path.
+            fingerprint = None
+            if self.config.fingerprint_installs and not self.config.lockfile and not kw:
+                fingerprint = self.install_fingerprints.get_key(arguments)
+                if fingerprint and self.install_fingerprints.is_satisfied(fingerprint):
+                    logger.info("Nothing to do! (requirements and installed distributions unchanged)")
+                    return 0
+            if '--user' in arguments:
+                from site import USER_BASE
+                kw.setdefault('prefix', USER_BASE)
+            if self.config.pipeline:
+                from pip_accel.pipeline import Pipeline
+                pipeline = Pipeline(self, **kw)
+                result = pipeline.run(arguments)
+                requirements = pipeline.installed
             else:
-                logger.info("Nothing to do! (requirements already installed)")
-                return 0
+                requirements = self.get_requirements(arguments, use_wheels=self.arguments_allow_wheels(arguments))
+                have_wheels = any(req.is_wheel for req in requirements)
+                if have_wheels and not self.setuptools_supports_wheels():
+                    logger.info("Preparing to upgrade to setuptools >= 0.8 to enable wheel support ..")
+                    requirements.extend(self.get_requirements(['setuptools >= 0.8']))
+                if requirements:
+                    result = self.install_requirements(requirements, **kw)
+                else:
+                    logger.info("Nothing to do! (requirements already installed)")
+                    result = 0
+            if self.config.lockfile:
+                if requirements:
+                    self.create_lockfile(requirements, self.config.lockfile)
+                else:
+                    logger.warning("Not writing lockfile %s because no requirements were installed.",
+                                   self.config.lockfile)
+            if fingerprint:
+                self.install_fingerprints.put(fingerprint)
+            return result
+        finally:
+            self.cleanup_temporary_directories()
+
+    def create_lockfile(self, requirements, filename):
+        """
+        Write a lockfile for the given requirements.
+
+        :param requirements: A list of :class:`pip_accel.req.Requirement` objects.
+        :param filename: The pathname of the lockfile (a string).
+
+        Editable requirements can't be locked so they're left out (refer to
+        :mod:`pip_accel.lockfile` for details).
+        """
+        from pip_accel.lockfile import create_entry, write_lockfile
+        entries = []
+        for requirement in requirements:
+            if requirement.is_editable:
+                logger.warning("Not adding editable requirement %s to lockfile!", requirement)
+                continue
+            cache_key = None if requirement.is_wheel else self.bdists.cache.generate_filename(requirement)
+            entries.append(create_entry(requirement, cache_key))
+        write_lockfile(filename, entries)
+        logger.info("Wrote lockfile with %s to %s.", pluralize(len(entries), "requirement"), filename)
+
+    def install_from_lockfile(self, filename, **kw):
+        """
+        Install the requirements pinned by a lockfile.
+
+        :param filename: The pathname of a lockfile written by
+                         :func:`create_lockfile()` (a string).
+        :param kw: Any keyword arguments are passed on to
+                   :func:`~pip_accel.bdist.BinaryDistributionManager.install_binary_dist()`.
+        :returns: The number of packages that were just installed (an integer).
+        :raises: :exc:`.InvalidLockfile` when the file isn't a lockfile.
+
+        Binary distributions are fetched using :func:`.CacheManager.get()`
+        and installed without running pip. Requirements that are already
+        installed are skipped. pip is only used for wheels and requirements
+        whose binary distribution is missing from all caches or was built from
+        a different source distribution than the one in the lockfile.
+        """
+        from pip_accel.lockfile import LockedRequirement, read_lockfile
+        from pip_accel.req import TransactionalUpdate
+        try:
+            install_timer = Timer()
+            kw.setdefault('track_installed_files', True)
+            num_installed = 0
+            missing = []
+            requirements = []
+            for entry in read_lockfile(filename):
+                requirement = LockedRequirement(self.config, entry, self.digest_cache, self.source_index)
+                requirement.pip_requirement.check_if_exists()
+                if requirement.pip_requirement.satisfied_by:
+                    logger.debug("Skipping %s (already installed).", requirement)
+                else:
+                    requirements.append(requirement)
+            self.bdists.cache.prefetch([r for r in requirements if not r.is_wheel])
+            for requirement in requirements:
+                cache_file = None if requirement.is_wheel else self.bdists.cache.get(requirement)
+                if cache_file and self.bdists.recall_checksum(cache_file) not in (None, requirement.checksum):
+                    logger.info("Not using cached %s binary (built from a different source distribution).",
+                                requirement)
+                    cache_file = None
+                if cache_file:
+                    logger.info("Installing %s binary distribution using pip-accel ..", requirement)
+                    with TransactionalUpdate(requirement):
+                        self.bdists.install_binary_dist(self.bdists.read_binary_dist(cache_file), **kw)
+                    num_installed += 1
+                else:
+                    missing.append(requirement)
+            if missing:
+                # The lockfile contains the complete requirement set, so pip
+                # doesn't need to resolve dependencies.
+                logger.info("Using pip to install %s missing from the cache ..",
+                            pluralize(len(missing), "requirement"))
+                arguments = ['--no-deps'] + ['%s==%s' % (r.name, r.version) for r in missing]
+                fallback = self.get_requirements(arguments, use_wheels=any(r.is_wheel for r in missing))
+                num_installed += self.install_requirements(fallback, **kw)
+            logger.info("Finished installing %s from lockfile in %s.",
+                        pluralize(num_installed, "requirement"),
+                        install_timer)
+            return num_installed
         finally:
             self.cleanup_temporary_directories()
 
@@ -278,6 +403,7 @@ class PipAccelerator(object):
                      in the result. If this breaks your use case consider using
                      pip's ``--ignore-installed`` option.
         """
+        from pip.exceptions import DistributionNotFound
         arguments = self.decorate_arguments(arguments)
         # Demote hash sum mismatch log messages from CRITICAL to DEBUG (hiding
         # implementation details from users unless they want to see them).
@@ -289,6 +415,15 @@ class PipAccelerator(object):
                 if any(match_option(a, '-U', '--upgrade') for a in arguments):
                     logger.info("Checking index(es) for new version (-U or --upgrade was given) ..")
                 else:
+                    # If -U or --upgrade wasn't given and the same requirement
+                    # set was resolved before (using the same source index) we
+                    # don't need pip at all (see pip_accel.resolution).
+                    if self.config.cache_resolutions:
+                        requirements = self.resolution_cache.get(arguments, use_wheels, self.build_directory)
+                        if requirements is not None:
+                            logger.info("Using cached resolution of %s.",
+                                        pluralize(len(requirements), "requirement"))
+                            return requirements
                     # If -U or --upgrade wasn't given and all requirements can be
                     # satisfied using the archives in pip-accel's local source
                     # index we don't need pip to connect to PyPI looking for new
@@ -355,11 +490,17 @@ class PipAccelerator(object):
         directory.
         """
         arguments = list(arguments)
+        local_files = []
         for i, value in enumerate(arguments):
             is_constraint_file = (i >= 1 and match_option(arguments[i - 1], '-c', '--constraint'))
             is_requirement_file = (i >= 1 and match_option(arguments[i - 1], '-r', '--requirement'))
             if not is_constraint_file and not is_requirement_file and os.path.isfile(value):
-                arguments[i] = '%s#md5=%s' % (create_file_url(value), hash_files('md5', value))
+                local_files.append(i)
+        # The digests of unchanged files are remembered between runs and the
+        # remaining files are hashed concurrently (see pip_accel.digests).
+        digests = self.digest_cache.get_digests('md5', [[arguments[i]] for i in local_files])
+        for i, digest in zip(local_files, digests):
+            arguments[i] = '%s#md5=%s' % (create_file_url(arguments[i]), digest)
         return arguments
 
     def unpack_source_dists(self, arguments, use_wheels=False):
@@ -387,6 +528,8 @@ class PipAccelerator(object):
         - Unpacking source distributions in multiple formats.
         - Finding the name & version of a given source distribution.
         """
+        from pip.commands import install as pip_install_module
+        from pip_accel.req import CustomPackageFinder
         unpack_timer = Timer()
         logger.info("Unpacking distribution(s) ..")
         with PatchedAttribute(pip_install_module, 'PackageFinder', CustomPackageFinder):
@@ -487,6 +630,8 @@ class PipAccelerator(object):
         # [2] https://pip.pypa.io/en/latest/reference/pip.html#exists-action-option
         os.environ.setdefault('PIP_EXISTS_ACTION', 'w')
         # Initialize and run the `pip install' command.
+        from pip.commands.install import InstallCommand
+        from pip_accel.metadata import LazyUnpackPatch
         command = InstallCommand()
         opts, args = command.parse_args(command_line)
         if not opts.ignore_installed:
@@ -494,7 +639,12 @@ class PipAccelerator(object):
             # will forcefully disable the option. Refer to the documentation of
             # the AttributeOverrides class for further details.
             opts = AttributeOverrides(opts, ignore_installed=False)
-        requirement_set = command.run(opts, args)
+        # Don't unpack source distributions whose binary distribution is
+        # already cached and don't run `setup.py egg_info' more than once
+        # for any given archive (see pip_accel.metadata).
+        self.deferred_archives.clear()
+        with LazyUnpackPatch(self, enabled=(self.config.lazy_unpacking or self.config.cache_metadata)):
+            requirement_set = command.run(opts, args)
         # Make sure the output of pip and pip-accel are not intermingled.
         sys.stdout.flush()
         if requirement_set is None:
@@ -502,8 +652,10 @@ class PipAccelerator(object):
                 pip didn't generate a requirement set, most likely you
                 specified an empty requirements file?
             """)
-        else:
-            return self.transform_pip_requirement_set(requirement_set)
+        requirements = self.transform_pip_requirement_set(requirement_set)
+        if self.config.cache_resolutions:
+            self.resolution_cache.put(arguments, use_wheels, requirement_set, requirements)
+        return requirements
 
     def transform_pip_requirement_set(self, requirement_set):
         """
@@ -535,8 +687,30 @@ class PipAccelerator(object):
             # All other requirements are reported to callers.
             filtered_requirements.append(requirement)
             self.reported_requirements.append(requirement)
-        return sorted([Requirement(self.config, r) for r in filtered_requirements],
-                      key=lambda r: r.name.lower())
+        requirements = sorted(map(self.create_requirement, filtered_requirements), key=lambda r: r.name.lower())
+        # Calculate the checksums used for cache invalidation up front, so
+        # that the archives that need hashing are hashed concurrently (the
+        # digests are remembered by the digest cache, see Requirement.checksum).
+        self.digest_cache.get_digests('sha1', [sorted(r.related_archives) for r in requirements
+                                               if not r.is_wheel])
+        return requirements
+
+    def create_requirement(self, pip_requirement):
+        """
+        Create a pip-accel requirement object for a requirement prepared by pip.
+
+        :param pip_requirement: A :class:`pip.req.InstallRequirement` object.
+        :returns: A :class:`.ResolvedRequirement` object when pip didn't
+                  unpack the archive (see :class:`.LazyUnpackPatch`), a
+                  :class:`.Requirement` object otherwise.
+        """
+        from pip_accel.req import Requirement, ResolvedRequirement
+        deferred = self.deferred_archives.get(pip_requirement.source_dir)
+        if deferred:
+            archive, version = deferred
+            return ResolvedRequirement(self.config, pip_requirement, archive, version, False,
+                                       self.build_directory, self.digest_cache, self.source_index)
+        return Requirement(self.config, pip_requirement, self.digest_cache, self.source_index)
 
     def install_requirements(self, requirements, **kw):
         """
@@ -553,41 +727,91 @@ class PipAccelerator(object):
             install_types.append('binary')
         if any(req.is_wheel for req in requirements):
             install_types.append('wheel')
+        # Download the binary distributions that are missing from the local
+        # cache concurrently instead of one at a time during installation.
+        self.bdists.cache.prefetch([r for r in requirements if not (r.is_editable or r.is_wheel)])
+        # Build missing binary distributions in parallel (when enabled) so
+        # that the installation loop below finds them in the cache.
+        if self.config.build_jobs > 1:
+            self.execute_build_plan(self.create_build_plan(requirements))
         logger.info("Installing from %s distributions ..", concatenate(install_types))
-        # Track installed files by default (unless the caller specifically opted out).
-        kw.setdefault('track_installed_files', True)
         num_installed = 0
         for requirement in requirements:
-            # When installing setuptools we need to uninstall distribute,
-            # otherwise distribute will shadow setuptools and all sorts of
-            # strange issues can occur (e.g. upgrading to the latest
-            # setuptools to gain wheel support and then having everything
-            # blow up because distribute doesn't know about wheels).
-            if requirement.name == 'setuptools' and is_installed('distribute'):
-                uninstall('distribute')
-            if requirement.is_editable:
-                logger.debug("Installing %s in editable form using pip.", requirement)
-                with TransactionalUpdate(requirement):
-                    command = InstallCommand()
-                    opts, args = command.parse_args(['--no-deps', '--editable', requirement.source_directory])
-                    command.run(opts, args)
-            elif requirement.is_wheel:
-                logger.info("Installing %s wheel distribution using pip ..", requirement)
-                with TransactionalUpdate(requirement):
-                    wheel_version = pip_wheel_module.wheel_version(requirement.source_directory)
-                    pip_wheel_module.check_compatibility(wheel_version, requirement.name)
-                    requirement.pip_requirement.move_wheel_files(requirement.source_directory)
-            else:
-                logger.info("Installing %s binary distribution using pip-accel ..", requirement)
-                with TransactionalUpdate(requirement):
-                    binary_distribution = self.bdists.get_binary_dist(requirement)
-                    self.bdists.install_binary_dist(binary_distribution, **kw)
+            self.install_requirement(requirement, **kw)
             num_installed += 1
         logger.info("Finished installing %s in %s.",
                     pluralize(num_installed, "requirement"),
                     install_timer)
         return num_installed
 
+    def install_requirement(self, requirement, **kw):
+        """
+        Manually install a single requirement from a binary or wheel distribution.
+
+        :param requirement: A :class:`pip_accel.req.Requirement` object.
+        :param kw: Any keyword arguments are passed on to
+                   :func:`~pip_accel.bdist.BinaryDistributionManager.install_binary_dist()`.
+        """
+        from pip import wheel as pip_wheel_module
+        from pip.commands.install import InstallCommand
+        from pip_accel.req import TransactionalUpdate
+        # Track installed files by default (unless the caller specifically opted out).
+        kw.setdefault('track_installed_files', True)
+        # When installing setuptools we need to uninstall distribute,
+        # otherwise distribute will shadow setuptools and all sorts of
+        # strange issues can occur (e.g. upgrading to the latest
+        # setuptools to gain wheel support and then having everything
+        # blow up because distribute doesn't know about wheels).
+        if requirement.name == 'setuptools' and is_installed('distribute'):
+            uninstall('distribute')
+        if requirement.is_editable:
+            logger.debug("Installing %s in editable form using pip.", requirement)
+            with TransactionalUpdate(requirement):
+                command = InstallCommand()
+                opts, args = command.parse_args(['--no-deps', '--editable', requirement.source_directory])
+                command.run(opts, args)
+        elif requirement.is_wheel:
+            logger.info("Installing %s wheel distribution using pip ..", requirement)
+            with TransactionalUpdate(requirement):
+                wheel_version = pip_wheel_module.wheel_version(requirement.source_directory)
+                pip_wheel_module.check_compatibility(wheel_version, requirement.name)
+                requirement.pip_requirement.move_wheel_files(requirement.source_directory)
+        else:
+            logger.info("Installing %s binary distribution using pip-accel ..", requirement)
+            with TransactionalUpdate(requirement):
+                binary_distribution = self.bdists.get_binary_dist(requirement)
+                self.bdists.install_binary_dist(binary_distribution, **kw)
+
+    def create_build_plan(self, requirements):
+        """
+        Create a plan to build missing binary distributions.
+
+        :param requirements: A list of :class:`pip_accel.req.Requirement` objects.
+        :returns: A :class:`~pip_accel.scheduler.BuildPlan` object.
+
+        The plan covers the source distributions in `requirements` whose
+        binary distributions are missing from the cache (editable requirements
+        and wheels are never built). Refer to the documentation of
+        :class:`~pip_accel.scheduler.BuildPlan` for details about inspecting
+        the plan before passing it to :func:`execute_build_plan()`.
+        """
+        return self.bdists.create_build_plan([r for r in requirements if not (r.is_editable or r.is_wheel)])
+
+    def execute_build_plan(self, plan, jobs=None):
+        """
+        Build the binary distributions in a build plan.
+
+        :param plan: A :class:`~pip_accel.scheduler.BuildPlan` object created
+                     by :func:`create_build_plan()`.
+        :param jobs: The maximum number of concurrent builds (an integer,
+                     defaults to :attr:`~.Config.build_jobs`).
+        :returns: The number of binary distributions that were built (an integer).
+
+        Afterwards the binary distributions are available in the cache, so
+        :func:`install_requirements()` won't have to build them anymore.
+        """
+        return self.bdists.execute_build_plan(plan, jobs=jobs)
+
     def arguments_allow_wheels(self, arguments):
         """
         Check whether the given command line arguments allow the use of wheels.
@@ -705,25 +929,14 @@ class SetupRequiresPatch(object):
 
     def __enter__(self):
         """Enable caching of setup requirements (by patching the ``run_egg_info()`` method)."""
+        from pip.req import InstallRequirement
         if self.patch is None:
-            created_links = self.created_links
+            create_link = self.create_link
             original_method = InstallRequirement.run_egg_info
-            shared_directory = self.config.eggs_cache
 
             def run_egg_info_wrapper(self, *args, **kw):
                 # Heads up: self is an `InstallRequirement' object here!
-                link_name = os.path.join(self.source_dir, '.eggs')
-                try:
-                    logger.debug("Creating symbolic link: %s -> %s", link_name, shared_directory)
-                    os.symlink(shared_directory, link_name)
-                    if created_links is not None:
-                        created_links.append(link_name)
-                except Exception as e:
-                    # Always log the failure, but only include a traceback if
-                    # it looks like symbolic links should be supported on the
-                    # current platform (os.symlink() is available).
-                    logger.debug("Failed to create symbolic link! (continuing without)",
-                                 exc_info=not isinstance(e, AttributeError))
+                create_link(self.source_dir)
                 # Execute the real run_egg_info() method.
                 return original_method(self, *args, **kw)
 
@@ -731,6 +944,26 @@ class SetupRequiresPatch(object):
             self.patch = PatchedAttribute(InstallRequirement, 'run_egg_info', run_egg_info_wrapper)
             self.patch.__enter__()
 
+    def create_link(self, source_directory):
+        """
+        Create the ``.eggs`` symbolic link in an unpacked source distribution.
+
+        :param source_directory: The pathname of the unpacked source
+                                 distribution (a string).
+        """
+        link_name = os.path.join(source_directory, '.eggs')
+        try:
+            logger.debug("Creating symbolic link: %s -> %s", link_name, self.config.eggs_cache)
+            os.symlink(self.config.eggs_cache, link_name)
+            if self.created_links is not None:
+                self.created_links.append(link_name)
+        except Exception as e:
+            # Always log the failure, but only include a traceback if
+            # it looks like symbolic links should be supported on the
+            # current platform (os.symlink() is available).
+            logger.debug("Failed to create symbolic link! (continuing without)",
+                         exc_info=not isinstance(e, AttributeError))
+
     def __exit__(self, exc_type=None, exc_value=None, traceback=None):
         """Undo the changes that enable caching of setup requirements."""
         if self.patch is not None:
@@ -738,39 +971,6 @@ class SetupRequiresPatch(object):
             self.patch = None
 
 
-class CustomPackageFinder(pip_index_module.PackageFinder):
-
-    """
-    Custom :class:`pip.index.PackageFinder` to keep pip off the internet.
-
-    This class customizes :class:`pip.index.PackageFinder` to enforce what
-    the ``--no-index`` option does for the default package index but doesn't do
-    for package indexes registered with the ``--index=`` option in requirements
-    files. Judging by pip's documentation the fact that this has to be monkey
-    patched seems like a bug / oversight in pip (IMHO).
-    """
-
-    @property
-    def index_urls(self):
-        """Dummy list of index URLs that is always empty."""
-        return []
-
-    @index_urls.setter
-    def index_urls(self, value):
-        """Dummy setter for index URLs that ignores the value set."""
-        pass
-
-    @property
-    def dependency_links(self):
-        """Dummy list of dependency links that is always empty."""
-        return []
-
-    @dependency_links.setter
-    def dependency_links(self, value):
-        """Dummy setter for dependency links that ignores the value set."""
-        pass
-
-
 class PatchedAttribute(object):
 
     """
@@ -871,3 +1071,29 @@ class AttributeOverrides(object):
         else:
             logger.debug("AttributeOverrides() setting %s=%r by deferring attribute access ..", name, value)
             setattr(self.opts, name, value)
+
+
+class LazyExports(types.ModuleType):
+
+    """
+    Module type that re-exports names from modules that import pip.
+
+    :class:`~pip_accel.req.CustomPackageFinder` used to be defined in this
+    module. It's re-exported lazily so that importing :mod:`pip_accel`
+    doesn't import pip (see :func:`pip_accel.cli.is_satisfied()`).
+    """
+
+    def __getattr__(self, name):
+        """Import :class:`~pip_accel.req.CustomPackageFinder` when it's first accessed."""
+        if name == 'CustomPackageFinder':
+            from pip_accel import req
+            return req.CustomPackageFinder
+        raise AttributeError("module %r has no attribute %r" % (self.__name__, name))
+
+
+if sys.version_info[:2] >= (3, 5):
+    # The class of a module object can be changed since Python 3.5.
+    sys.modules[__name__].__class__ = LazyExports
+else:
+    from pip_accel import req
+    CustomPackageFinder = req.CustomPackageFinder
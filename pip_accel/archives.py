@@ -0,0 +1,879 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Storage formats of cached binary distributions.
+
+Up to revision 7 of the binary cache format (see
+:attr:`.Config.cache_format_revision`) each binary distribution was stored in
+the local cache as a single ``*.tar.gz`` archive. Consecutive versions of the
+same package (and builds of the same version for different Python versions)
+contain mostly identical files, which were stored again and again.
+
+Starting from revision 8 the local cache stores binary distributions in a
+content addressed form instead:
+
+- The ``blobs`` subdirectory of :attr:`.Config.binary_cache` contains the
+  compressed contents of every file of every cached binary distribution,
+  stored once under the SHA1 digest of the uncompressed contents (see
+  :class:`BlobStore` and :attr:`.Config.cache_codec`).
+
+- Each cached binary distribution is represented by a small JSON manifest
+  that lists the relative pathnames, permissions, sizes and digests of the
+  files in the distribution (see :func:`write_manifest()`), together with
+  the facts that the installer would otherwise have to rediscover on every
+  installation (see :func:`add_install_facts()`).
+
+Binary distributions are transferred to cache backends (e.g. Amazon S3) as
+single file archives. Up to revision 8 these were ``*.tar.gz`` archives, which
+have to be decompressed and scanned completely before the first member can be
+located. Starting from revision 9 an "indexed archive" format is used instead
+(see :func:`write_indexed_archive()`):
+
+1. The magic string :data:`INDEXED_ARCHIVE_MAGIC`.
+2. The length of the index (a 32 bit unsigned big endian integer).
+3. The index: A UTF-8 encoded JSON document that names the compression codec
+   (see :mod:`pip_accel.compression`) and lists the pathname, permissions,
+   size, SHA1 digest, hashbang flag, offset and compressed length of every
+   member.
+4. The compressed members, each compressed independently (when the codec
+   matches the codec of the local cache, members are added to the local
+   cache without being recompressed).
+
+Readers can find any member using the index alone. :func:`read_archive()`
+accepts all of these formats.
+"""
+
+# Standard library modules.
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import struct
+import tarfile
+import tempfile
+from contextlib import closing
+
+# External dependencies.
+from cached_property import cached_property
+
+# Modules included in our package.
+from pip_accel.compression import get_codec, parse_codec
+from pip_accel.exceptions import CorruptArchiveError
+from pip_accel.utils import AtomicReplace, makedirs
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+TARBALL_SUFFIX = '.tar.gz'
+"""The filename extension of ``*.tar.gz`` archives (a string)."""
+
+INDEXED_ARCHIVE_SUFFIX = '.pia'
+"""The filename extension of indexed archives (a string)."""
+
+INDEXED_ARCHIVE_MAGIC = b'pip-accel indexed archive\n'
+"""The byte string that indexed archives start with."""
+
+INDEXED_ARCHIVE_REVISION = 9
+"""The first cache format revision that uses indexed archives (an integer)."""
+
+MANIFEST_SUFFIX = '.json'
+"""The filename extension of binary distribution manifests (a string)."""
+
+INDEX_LENGTH = struct.Struct('>I')
+
+PKG_INFO_PATTERN = '*.egg-info/PKG-INFO'
+"""The :mod:`fnmatch` pattern that matches the metadata file of a distribution (a string)."""
+
+BUFFER_SIZE = 1024 * 64
+"""The default size of the chunks in which the contents of members are copied (an integer)."""
+
+
+class BlobStore(object):
+
+    """Content addressed store of (compressed) file contents."""
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`BlobStore` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        """
+        self.config = config
+
+    @property
+    def directory(self):
+        """The pathname of the directory that contains the blobs (a string)."""
+        return os.path.join(self.config.binary_cache, 'blobs')
+
+    @cached_property
+    def codec(self):
+        """The codec used to compress new blobs (a :class:`.Codec` object, see :attr:`.Config.cache_codec`)."""
+        return parse_codec(self.config.cache_codec)
+
+    def get_path(self, digest, codec=None):
+        """
+        Get the pathname of a blob.
+
+        :param digest: The SHA1 digest of the uncompressed contents (a string).
+        :param codec: The codec of the blob (a :class:`.Codec` object,
+                      defaults to :attr:`codec`).
+        :returns: The pathname of the blob (a string).
+        """
+        return os.path.join(self.directory, digest[:2], digest[2:] + (codec or self.codec).suffix)
+
+    def store(self, handle, buffer_size=BUFFER_SIZE):
+        """
+        Store the contents of a file (unless they're already stored).
+
+        :param handle: A file-like object that provides the contents of the
+                       file (they're compressed in chunks, so this doesn't
+                       require much memory).
+        :param buffer_size: The size of the chunks (an integer).
+        :returns: A tuple with four values:
+
+                  1. The SHA1 digest of the contents (a string).
+                  2. The size of the contents (an integer).
+                  3. :data:`True` if the contents start with a hashbang,
+                     :data:`False` otherwise.
+                  4. The number of bytes added to the store (an integer, zero
+                     when the contents were already stored).
+
+        The digest is only known once all contents have been read, so the
+        contents are compressed to a temporary file which is then moved into
+        place (or discarded when the contents were already stored).
+        """
+        temporary_file = self.create_temporary_file()
+        try:
+            with open(temporary_file, 'wb') as to_handle:
+                digest, size, hashbang = copy_contents(handle, to_handle, buffer_size, self.codec)
+                num_bytes = to_handle.tell()
+        except Exception:
+            os.unlink(temporary_file)
+            raise
+        return digest, size, hashbang, self.commit(temporary_file, digest, num_bytes)
+
+    def store_compressed(self, digest, handle, buffer_size=BUFFER_SIZE):
+        """
+        Store already compressed contents (unless they're already stored).
+
+        :param digest: The SHA1 digest of the uncompressed contents claimed
+                       by the source of the contents (a string).
+        :param handle: A file-like object that provides the contents
+                       compressed using :attr:`codec` (they're copied in
+                       chunks, so this doesn't require much memory).
+        :param buffer_size: The size of the chunks (an integer).
+        :returns: A tuple with three values:
+
+                  1. The size of the uncompressed contents (an integer).
+                  2. :data:`True` if the contents start with a hashbang,
+                     :data:`False` otherwise.
+                  3. The number of bytes added to the store (an integer, zero
+                     when the contents were already stored).
+        :raises: :exc:`.CorruptArchiveError` when the digest of the
+                 decompressed contents doesn't match `digest`.
+
+        Blobs are shared by all cached distributions that contain the same
+        file, so the contents are decompressed and hashed while they're being
+        copied and a blob is only committed when its digest is verified. The
+        contents are verified even when the blob already exists, because the
+        size and hashbang are taken from the verified contents.
+        """
+        exists = os.path.isfile(self.get_path(digest))
+        temporary_file = None if exists else self.create_temporary_file()
+        try:
+            to_handle = open(temporary_file, 'wb') if temporary_file else None
+            try:
+                reader = self.codec.open_reader(CopyingReader(handle, to_handle))
+                actual_digest, size, hashbang = copy_contents(reader, None, buffer_size)
+                num_bytes = to_handle.tell() if to_handle else 0
+            finally:
+                if to_handle:
+                    to_handle.close()
+            if actual_digest != digest:
+                raise CorruptArchiveError("""
+                    The contents of a cached file should have SHA1 digest
+                    {expected} but have SHA1 digest {actual} instead!
+                """, expected=digest, actual=actual_digest)
+        except Exception:
+            if temporary_file and os.path.exists(temporary_file):
+                os.unlink(temporary_file)
+            raise
+        return size, hashbang, self.commit(temporary_file, digest, num_bytes) if temporary_file else 0
+
+    def create_temporary_file(self):
+        """
+        Create a temporary file in the blob store.
+
+        :returns: The pathname of the (empty) temporary file (a string).
+        """
+        makedirs(self.directory)
+        fd, temporary_file = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        os.close(fd)
+        return temporary_file
+
+    def commit(self, temporary_file, digest, num_bytes):
+        """
+        Move a temporary file into place as a blob.
+
+        :param temporary_file: The pathname of a temporary file created by
+                               :func:`create_temporary_file()` (a string).
+        :param digest: The SHA1 digest of the uncompressed contents (a string).
+        :param num_bytes: The size of the temporary file (an integer).
+        :returns: The number of bytes added to the store (an integer, zero
+                  when the blob already existed).
+        """
+        pathname = self.get_path(digest)
+        try:
+            if os.path.isfile(pathname):
+                os.unlink(temporary_file)
+                return 0
+            makedirs(os.path.dirname(pathname))
+            os.rename(temporary_file, pathname)
+        except Exception:
+            if os.path.exists(temporary_file):
+                os.unlink(temporary_file)
+            # Concurrent pip-accel processes may store the same blob (on
+            # Windows os.rename() fails when the target exists).
+            if not os.path.isfile(pathname):
+                raise
+            return 0
+        return num_bytes
+
+    def open(self, digest, hashbang, codec):
+        """
+        Get the contents of a blob.
+
+        :param digest: The SHA1 digest of the uncompressed contents (a string).
+        :param hashbang: Refer to :class:`MemberFile`.
+        :param codec: The codec of the blob (a :class:`.Codec` object).
+        :returns: A :class:`MemberFile` object.
+        """
+        return MemberFile(lambda: open(self.get_path(digest, codec), 'rb'), digest, hashbang, codec)
+
+
+class MemberFile(object):
+
+    """
+    File-like object that provides lazy access to a compressed file.
+
+    The contents are only opened when :func:`read()` is first called, so that
+    installers can decide to skip a file based on its :attr:`digest` without
+    touching its contents. The contents are decompressed incrementally, so
+    reading a large file in chunks requires a fixed amount of memory. The
+    members returned by :func:`read_archive()` can be read concurrently by
+    multiple threads (each member by one thread at a time).
+    """
+
+    def __init__(self, opener, digest, hashbang, codec):
+        """
+        Initialize a :class:`MemberFile` object.
+
+        :param opener: A callable that returns a file-like object which
+                       provides the compressed contents.
+        :param digest: The SHA1 digest of the uncompressed contents (a string).
+        :param hashbang: :data:`True` if the file starts with a hashbang,
+                         :data:`False` if it doesn't, :data:`None` when this
+                         isn't known.
+        :param codec: The codec of the compressed contents (a :class:`.Codec` object).
+        """
+        self.opener = opener
+        self.digest = digest
+        self.hashbang = hashbang
+        self.codec = codec
+        self.stream = None
+
+    def open_compressed(self):
+        """
+        Open the compressed contents of the file.
+
+        :returns: A file-like object (the caller is responsible for closing it).
+        """
+        return self.opener()
+
+    def read(self, size=-1):
+        """
+        Read (part of) the contents of the file.
+
+        :param size: The maximum number of bytes to return (an integer, a
+                     negative number reads the remaining contents).
+        :returns: A byte string (empty at the end of the file).
+        """
+        if self.stream is None:
+            self.stream = self.codec.open_reader(self.opener())
+        return self.stream.read(size)
+
+    def close(self):
+        """Close the file (it can be read again afterwards)."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class CopyingReader(object):
+
+    """File-like object that copies the data read from another file-like object to a third one."""
+
+    def __init__(self, handle, to_handle=None):
+        """
+        Initialize a :class:`CopyingReader` object.
+
+        :param handle: The file-like object to read from.
+        :param to_handle: The file-like object to which the data that's read
+                          is written (:data:`None` to only read the data).
+        """
+        self.handle = handle
+        self.to_handle = to_handle
+
+    def read(self, size=-1):
+        """
+        Read (and copy) data.
+
+        :param size: The maximum number of bytes to return (an integer, a
+                     negative number reads the remaining data).
+        :returns: A byte string (empty at the end of the file).
+        """
+        data = self.handle.read(size)
+        if data and self.to_handle is not None:
+            self.to_handle.write(data)
+        return data
+
+    def close(self):
+        """Do nothing (the caller is responsible for closing both file-like objects)."""
+
+
+class FileSlice(object):
+
+    """File-like object that provides access to a range of bytes of another file-like object."""
+
+    def __init__(self, handle, length, owned=True):
+        """
+        Initialize a :class:`FileSlice` object.
+
+        :param handle: A file-like object positioned at the start of the range.
+        :param length: The number of bytes in the range (an integer).
+        :param owned: :data:`True` if :func:`close()` should close `handle`,
+                      :data:`False` otherwise.
+        """
+        self.handle = handle
+        self.remaining = length
+        self.owned = owned
+
+    def read(self, size=-1):
+        """
+        Read (part of) the range.
+
+        :param size: The maximum number of bytes to return (an integer, a
+                     negative number reads the remainder of the range).
+        :returns: A byte string (empty at the end of the range).
+        """
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.handle.read(size) if size > 0 else b''
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        """Close the underlying file-like object (if it's owned by the slice)."""
+        if self.owned:
+            self.handle.close()
+
+
+def is_manifest(pathname):
+    """
+    Check whether a cached binary distribution is stored as a manifest.
+
+    :param pathname: The pathname of a cached binary distribution (a string).
+    :returns: :data:`True` for manifests, :data:`False` for archives.
+    """
+    return pathname.endswith(MANIFEST_SUFFIX)
+
+
+def get_archive_suffix(revision):
+    """
+    Get the filename extension of the archives of a cache format revision.
+
+    :param revision: The cache format revision (an integer).
+    :returns: :data:`INDEXED_ARCHIVE_SUFFIX` or :data:`TARBALL_SUFFIX`.
+    """
+    return INDEXED_ARCHIVE_SUFFIX if revision >= INDEXED_ARCHIVE_REVISION else TARBALL_SUFFIX
+
+
+def get_manifest_name(filename):
+    """
+    Translate the filename of an archive to the filename of a manifest.
+
+    :param filename: The filename of a binary distribution archive (a string).
+    :returns: The corresponding filename of a manifest (a string).
+    """
+    for suffix in TARBALL_SUFFIX, INDEXED_ARCHIVE_SUFFIX:
+        if filename.endswith(suffix):
+            filename = filename[:-len(suffix)]
+            break
+    return filename + MANIFEST_SUFFIX
+
+
+def get_buffer_size(config):
+    """
+    Get the size of the chunks in which the contents of members are copied.
+
+    :param config: The pip-accel configuration (a :class:`.Config` object).
+    :returns: :attr:`.Config.install_memory` divided between the threads
+              that copy files (see :attr:`.Config.install_jobs`), with a
+              minimum of 4 KiB per thread (an integer).
+    """
+    return max(1024 * 4, config.install_memory // config.install_jobs)
+
+
+def copy_contents(from_handle, to_handle, buffer_size=BUFFER_SIZE, codec=None):
+    """
+    Copy the contents of a member in chunks while calculating its SHA1 digest.
+
+    :param from_handle: A file-like object that supports reads of a given size.
+    :param to_handle: A file-like object opened in binary mode (:data:`None`
+                      to only calculate the digest).
+    :param buffer_size: The size of the chunks (an integer).
+    :param codec: A :class:`.Codec` object used to compress the contents
+                  written to `to_handle` (optional).
+    :returns: A tuple with three values: The SHA1 digest of the uncompressed
+              contents (a string), the size of the uncompressed contents (an
+              integer) and :data:`True` if the contents start with a
+              hashbang, :data:`False` otherwise.
+    """
+    context = hashlib.sha1()
+    compressor = codec.open_compressor() if codec is not None else None
+    head = b''
+    size = 0
+    for chunk in iter(lambda: from_handle.read(buffer_size), b''):
+        if len(head) < 3:
+            head += chunk[:3 - len(head)]
+        context.update(chunk)
+        size += len(chunk)
+        if to_handle is not None:
+            to_handle.write(compressor.compress(chunk) if compressor is not None else chunk)
+    if compressor is not None and to_handle is not None:
+        to_handle.write(compressor.flush())
+    return context.hexdigest(), size, head == b'#!/'
+
+
+def read_archive(pathname, config):
+    """
+    Get the members of a cached binary distribution.
+
+    :param pathname: The pathname of a binary distribution manifest or
+                     archive (a string).
+    :param config: The pip-accel configuration (a :class:`.Config` object).
+    :returns: An iterable of tuples with two values each: A
+              :class:`tarfile.TarInfo` object and a file-like object (a
+              :class:`MemberFile` object for manifests and indexed archives).
+    """
+    if is_manifest(pathname):
+        blob_store = BlobStore(config)
+        with open(pathname) as handle:
+            manifest = json.load(handle)
+        codec = get_codec(manifest.get('codec'))
+        for entry in manifest['members']:
+            yield create_member(entry), blob_store.open(entry['digest'], entry.get('hashbang'), codec)
+    else:
+        with open(pathname, 'rb') as handle:
+            index, data_offset = read_index(handle)
+        if index is not None:
+            # Each member opens the archive by itself, so that members
+            # can be read concurrently and after iteration has finished.
+            codec = get_codec(index.get('codec'))
+            for entry in index['members']:
+                opener = create_file_loader(pathname, data_offset + entry['offset'], entry['length'])
+                yield create_member(entry), MemberFile(opener, entry['digest'], entry['hashbang'], codec)
+        else:
+            with open(pathname, 'rb') as handle:
+                for member, from_handle in iter_archive_members(handle):
+                    yield member, from_handle
+
+
+def read_index(handle):
+    """
+    Read the index of an indexed archive.
+
+    :param handle: A file-like object positioned at the start of an archive.
+    :returns: A tuple with two values: The index (a dictionary) and the
+              offset of the first member (an integer), or two :data:`None`
+              values when the archive isn't an indexed archive.
+    """
+    if handle.read(len(INDEXED_ARCHIVE_MAGIC)) != INDEXED_ARCHIVE_MAGIC:
+        return None, None
+    length, = INDEX_LENGTH.unpack(handle.read(INDEX_LENGTH.size))
+    index = json.loads(handle.read(length).decode('UTF-8'))
+    return index, handle.tell()
+
+
+def iter_archive_members(handle):
+    """
+    Get the members of a binary distribution archive.
+
+    :param handle: A seekable file-like object that provides access to a
+                   ``*.tar.gz`` archive or an indexed archive.
+    :returns: An iterable of tuples with two values each: A
+              :class:`tarfile.TarInfo` object and a file-like object.
+
+    The members are only valid while `handle` remains open and they can't be
+    read concurrently (they share `handle`).
+    """
+    index, data_offset = read_index(handle)
+    if index is not None:
+        codec = get_codec(index.get('codec'))
+        for entry in index['members']:
+            opener = create_loader(handle, data_offset + entry['offset'], entry['length'])
+            yield create_member(entry), MemberFile(opener, entry['digest'], entry['hashbang'], codec)
+    else:
+        handle.seek(0)
+        archive = tarfile.open(fileobj=handle, mode='r:gz')
+        try:
+            for member, from_handle in iter_tar_members(archive):
+                yield member, from_handle
+        finally:
+            archive.close()
+
+
+def iter_tar_members(archive):
+    """
+    Get the members of a ``*.tar.gz`` archive.
+
+    :param archive: A :class:`tarfile.TarFile` object.
+    :returns: An iterable of tuples with two values each: A
+              :class:`tarfile.TarInfo` object and a file-like object.
+    """
+    for member in archive.getmembers():
+        handle = archive.extractfile(member.name)
+        if handle is not None:
+            yield member, handle
+
+
+def write_archive(handle, members, revision, codec=None, buffer_size=BUFFER_SIZE):
+    """
+    Write the archive format of a cache format revision.
+
+    :param handle: A file-like object opened in binary mode.
+    :param members: An iterable of tuples with two values each: A
+                    :class:`tarfile.TarInfo` object and a file-like object.
+    :param revision: The cache format revision (an integer).
+    :param codec: Refer to :func:`write_indexed_archive()` (``*.tar.gz``
+                  archives are always compressed using gzip).
+    :param buffer_size: The size of the chunks in which the members are
+                        copied (an integer).
+    """
+    writer = create_archive_writer(handle, revision, codec, buffer_size)
+    for member, from_handle in members:
+        writer.add(member, from_handle)
+    writer.close()
+
+
+def write_indexed_archive(handle, members, codec=None):
+    """
+    Write an indexed archive.
+
+    :param handle: A file-like object opened in binary mode.
+    :param members: An iterable of tuples with two values each: A
+                    :class:`tarfile.TarInfo` object and a file-like object.
+    :param codec: The codec used to compress the members (a :class:`.Codec`
+                  object, defaults to the default codec).
+    """
+    write_archive(handle, members, INDEXED_ARCHIVE_REVISION, codec)
+
+
+def create_archive_writer(handle, revision, codec=None, buffer_size=BUFFER_SIZE):
+    """
+    Create an object that writes the archive format of a cache format revision.
+
+    :param handle: A file-like object opened in binary mode.
+    :param revision: The cache format revision (an integer).
+    :param codec: Refer to :func:`write_indexed_archive()`.
+    :param buffer_size: Refer to :func:`write_archive()`.
+    :returns: An :class:`IndexedArchiveWriter` or :class:`TarballWriter` object.
+    """
+    if revision >= INDEXED_ARCHIVE_REVISION:
+        return IndexedArchiveWriter(handle, codec, buffer_size)
+    else:
+        return TarballWriter(handle, buffer_size)
+
+
+class IndexedArchiveWriter(object):
+
+    """
+    Incremental writer of indexed archives.
+
+    The index can only be written once all members have been compressed, so
+    the compressed members are spooled to a temporary file until
+    :func:`close()` is called. Members are compressed in chunks, so large
+    members don't need to fit in memory.
+    """
+
+    def __init__(self, handle, codec=None, buffer_size=BUFFER_SIZE):
+        """
+        Initialize an :class:`IndexedArchiveWriter` object.
+
+        :param handle: A file-like object opened in binary mode.
+        :param codec: The codec used to compress the members (a :class:`.Codec`
+                      object, defaults to the default codec).
+        :param buffer_size: The size of the chunks in which members are
+                            compressed (an integer).
+        """
+        self.handle = handle
+        self.codec = codec or parse_codec(None)
+        self.buffer_size = buffer_size
+        self.entries = []
+        self.spool = tempfile.TemporaryFile()
+
+    def add(self, member, from_handle):
+        """
+        Add a member to the archive.
+
+        :param member: A :class:`tarfile.TarInfo` object.
+        :param from_handle: A file-like object that provides the contents of
+                            the member.
+        """
+        offset = self.spool.tell()
+        digest, size, hashbang = copy_contents(from_handle, self.spool, self.buffer_size, self.codec)
+        self.add_entry(member, digest, size, hashbang, offset)
+
+    def add_compressed(self, member, compressed, digest, size, hashbang):
+        """
+        Add a member that's already compressed using :attr:`codec` to the archive.
+
+        :param member: A :class:`tarfile.TarInfo` object.
+        :param compressed: A file-like object that provides the compressed
+                           contents of the member.
+        :param digest: The SHA1 digest of the uncompressed contents (a string).
+        :param size: The size of the uncompressed contents (an integer).
+        :param hashbang: :data:`True` if the member starts with a hashbang,
+                         :data:`False` otherwise.
+        """
+        offset = self.spool.tell()
+        shutil.copyfileobj(compressed, self.spool, self.buffer_size)
+        self.add_entry(member, digest, size, hashbang, offset)
+
+    def add_entry(self, member, digest, size, hashbang, offset):
+        """Add a member that was just spooled to the index (see :func:`add()`)."""
+        self.entries.append(dict(
+            name=member.name,
+            mode=member.mode,
+            size=size,
+            digest=digest,
+            hashbang=hashbang,
+            offset=offset,
+            length=self.spool.tell() - offset,
+        ))
+
+    def close(self):
+        """Write the index followed by the spooled members."""
+        try:
+            index = json.dumps(dict(codec=self.codec.name, members=self.entries)).encode('UTF-8')
+            self.handle.write(INDEXED_ARCHIVE_MAGIC)
+            self.handle.write(INDEX_LENGTH.pack(len(index)))
+            self.handle.write(index)
+            self.spool.seek(0)
+            shutil.copyfileobj(self.spool, self.handle)
+        finally:
+            self.spool.close()
+
+
+class TarballWriter(object):
+
+    """Incremental writer of ``*.tar.gz`` archives (with the same interface as :class:`IndexedArchiveWriter`)."""
+
+    codec = None
+    """Always :data:`None` because ``*.tar.gz`` archives are compressed using gzip."""
+
+    def __init__(self, handle, buffer_size=BUFFER_SIZE):
+        """
+        Initialize a :class:`TarballWriter` object.
+
+        :param handle: A file-like object opened in binary mode.
+        :param buffer_size: The size of the chunks in which members are
+                            copied (an integer).
+        """
+        self.archive = tarfile.open(fileobj=handle, mode='w:gz')
+        self.buffer_size = buffer_size
+
+    def add(self, member, from_handle):
+        """
+        Add a member to the archive.
+
+        :param member: A :class:`tarfile.TarInfo` object.
+        :param from_handle: A file-like object that provides the contents of
+                            the member.
+
+        The size of a member has to be known before its contents can be
+        added, so the contents are spooled to a temporary file first.
+        """
+        with tempfile.TemporaryFile() as spool:
+            member.size = copy_contents(from_handle, spool, self.buffer_size)[1]
+            spool.seek(0)
+            self.archive.addfile(member, spool)
+
+    def close(self):
+        """Finish the archive."""
+        self.archive.close()
+
+
+def write_manifest(pathname, members, config, archive=None):
+    """
+    Store a binary distribution as a manifest and blobs.
+
+    :param pathname: The pathname of the manifest to create (a string).
+    :param members: An iterable of tuples with two values each: A
+                    :class:`tarfile.TarInfo` object and a file-like object
+                    (e.g. the result of :func:`iter_archive_members()`).
+    :param config: The pip-accel configuration (a :class:`.Config` object).
+    :param archive: An optional :class:`IndexedArchiveWriter` or
+                    :class:`TarballWriter` object to which the members are
+                    added as well (the caller is responsible for closing it).
+    :returns: The number of bytes added to the cache (an integer, this
+              includes the size of the manifest itself).
+
+    The manifest is written to a temporary file which is then moved into place
+    atomically. Blobs are written before the manifest so that concurrent
+    readers never see a manifest that refers to missing blobs. The members of
+    indexed archives that use the codec of the local cache are stored without
+    being recompressed (their digests are still verified, see
+    :func:`BlobStore.store_compressed()`). Members are copied in chunks (see
+    :func:`get_buffer_size()`), so large members don't need to fit in memory;
+    members are added to `archive` from the blob store (when `archive` uses
+    the codec of the local cache each member is compressed only once). The
+    facts needed to install the members are recorded as well (see
+    :func:`add_install_facts()`).
+    """
+    blob_store = BlobStore(config)
+    buffer_size = get_buffer_size(config)
+    share_compressed = archive is not None and archive.codec is not None and \
+        archive.codec.name == blob_store.codec.name
+    entries = []
+    num_bytes = 0
+    for member, handle in members:
+        if isinstance(handle, MemberFile) and handle.codec.name == blob_store.codec.name:
+            digest = handle.digest
+            with closing(handle.open_compressed()) as compressed:
+                size, hashbang, added = blob_store.store_compressed(digest, compressed, buffer_size)
+            num_bytes += added
+        else:
+            with closing(handle):
+                digest, size, hashbang, added = blob_store.store(handle, buffer_size)
+            num_bytes += added
+        if share_compressed:
+            with open(blob_store.get_path(digest), 'rb') as compressed:
+                archive.add_compressed(member, compressed, digest, size, hashbang)
+        elif archive is not None:
+            with closing(blob_store.open(digest, hashbang, blob_store.codec)) as contents:
+                archive.add(member, contents)
+        entries.append(dict(name=member.name, mode=member.mode, size=size, digest=digest, hashbang=hashbang))
+    add_install_facts(entries)
+    makedirs(os.path.dirname(pathname))
+    with AtomicReplace(pathname) as temporary_file:
+        with open(temporary_file, 'w') as handle:
+            json.dump(dict(codec=blob_store.codec.name, members=entries), handle)
+        num_bytes += os.path.getsize(temporary_file)
+    logger.debug("Stored %i file(s) in %s (%i new bytes).", len(entries), pathname, num_bytes)
+    return num_bytes
+
+
+class CachedMember(tarfile.TarInfo):
+
+    """A :class:`tarfile.TarInfo` object with the install facts recorded in a manifest."""
+
+    install = None
+    """
+    The install facts of the member (a dictionary, see
+    :func:`get_install_facts()`) or :data:`None` when they weren't recorded.
+    """
+
+
+def get_install_facts(name):
+    """
+    Get the facts about a member of a binary distribution that installers need.
+
+    :param name: The relative pathname of the member (a string).
+    :returns: A dictionary with the following keys:
+
+              - ``include``: :data:`True` when the member is a C header file
+                in the ``include/`` directory, :data:`False` otherwise.
+              - ``site_packages``: The relative pathname of the
+                ``site-packages`` directory that contains the member (a
+                string) or :data:`None`.
+              - ``pkg_info``: :data:`None` (this depends on the other members,
+                see :func:`add_install_facts()`).
+    """
+    match = re.match('^(.+?)/site-packages/', name)
+    return dict(include=name.startswith('include/'),
+                site_packages=match.group(0).rstrip('/') if match else None,
+                pkg_info=None)
+
+
+def add_install_facts(entries):
+    """
+    Record the install facts of the members of a binary distribution.
+
+    :param entries: A list of dictionaries with (at least) a ``name`` key.
+                    An ``install`` key is added to each dictionary (see
+                    :func:`get_install_facts()`).
+
+    The ``pkg_info`` fact is :data:`True` for the member that matches
+    :data:`PKG_INFO_PATTERN` (when exactly one member matches) so that
+    installers know where to create ``installed-files.txt`` without scanning
+    the pathnames of all members.
+    """
+    pkg_info = [e for e in entries if fnmatch.fnmatch(e['name'], PKG_INFO_PATTERN)]
+    for entry in entries:
+        entry['install'] = get_install_facts(entry['name'])
+        entry['install']['pkg_info'] = len(pkg_info) == 1 and entry is pkg_info[0]
+
+
+def create_member(entry):
+    """
+    Create a :class:`tarfile.TarInfo` object for an entry in an index or manifest.
+
+    :param entry: A dictionary with (at least) ``name``, ``mode`` and ``size``
+                  keys and optionally an ``install`` key.
+    :returns: A :class:`CachedMember` object.
+    """
+    member = CachedMember(entry['name'])
+    member.mode = entry['mode']
+    member.size = entry['size']
+    member.install = entry.get('install')
+    return member
+
+
+def create_loader(handle, offset, length):
+    """
+    Create a callable that opens a compressed member of an indexed archive.
+
+    :param handle: The file-like object of the indexed archive.
+    :param offset: The absolute offset of the member (an integer).
+    :param length: The compressed length of the member (an integer).
+    :returns: A callable that returns a :class:`FileSlice` object (which
+              shares `handle`).
+    """
+    def opener():
+        handle.seek(offset)
+        return FileSlice(handle, length, owned=False)
+    return opener
+
+
+def create_file_loader(pathname, offset, length):
+    """
+    Create a callable that opens a compressed member of an indexed archive file.
+
+    :param pathname: The pathname of the indexed archive (a string).
+    :param offset: The absolute offset of the member (an integer).
+    :param length: The compressed length of the member (an integer).
+    :returns: A callable that returns a :class:`FileSlice` object (with its
+              own file handle).
+    """
+    def opener():
+        handle = open(pathname, 'rb')
+        handle.seek(offset)
+        return FileSlice(handle, length)
+    return opener
@@ -1,7 +1,7 @@
 # Accelerator for pip, the Python package manager.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: November 7, 2015
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """
@@ -15,6 +15,7 @@ easy_install and pip).
 # Standard library modules.
 import errno
 import fnmatch
+import hashlib
 import logging
 import os
 import os.path
@@ -26,15 +27,22 @@ import subprocess
 import sys
 import tarfile
 import tempfile
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 
 # External dependencies.
-from humanfriendly import Spinner, Timer, concatenate
+from humanfriendly import Spinner, Timer, concatenate, format_timespan, pluralize
 
 # Modules included in our package.
+from pip_accel.archives import PKG_INFO_PATTERN, MemberFile, get_buffer_size, get_install_facts, read_archive
 from pip_accel.caches import CacheManager
+from pip_accel.compression import parse_codec
+from pip_accel.compat import queue
 from pip_accel.deps import SystemPackageManager
 from pip_accel.exceptions import BuildFailed, InvalidSourceDistribution, NoBuildOutput
+from pip_accel.scheduler import BuildPlan, BuildTimes
+from pip_accel.seed import SeedFile, SeedStore
 from pip_accel.utils import AtomicReplace, compact, makedirs
 
 # Initialize a logger for this module.
@@ -55,6 +63,8 @@ class BinaryDistributionManager(object):
         self.config = config
         self.cache = CacheManager(config)
         self.system_package_manager = SystemPackageManager(config)
+        self.build_times = BuildTimes(config)
+        self.seed_store = SeedStore(config)
 
     def get_binary_dist(self, requirement):
         """
@@ -68,12 +78,73 @@ class BinaryDistributionManager(object):
         given requirement. If no binary distribution has been cached yet, a new
         binary distribution is built and added to the cache.
 
+        Uses :func:`get_or_build_binary_dist()` to find or create the cached
+        binary distribution archive and :func:`read_binary_dist()` to read it.
+        """
+        cache_file = self.get_or_build_binary_dist(requirement)
+        for member, handle in self.read_binary_dist(cache_file):
+            yield member, handle
+
+    def read_binary_dist(self, cache_file):
+        """
+        Read a cached binary distribution archive.
+
+        :param cache_file: The pathname of the cached binary distribution
+                           archive (a string).
+        :returns: An iterable of tuples with two values each: A
+                  :class:`tarfile.TarInfo` object and a file-like object.
+
+        When :attr:`.Config.link_installs` is enabled the members are provided
+        by the :class:`.SeedStore`, otherwise they're read using
+        :func:`.read_archive()`.
+        """
+        if self.config.link_installs:
+            for member, handle in self.seed_store.get_members(cache_file):
+                yield member, handle
+            return
+        for member, handle in read_archive(cache_file, self.config):
+            yield member, handle
+
+    def get_or_build_binary_dist(self, requirement, interactive=True):
+        """
+        Get or create a cached binary distribution archive.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param interactive: Refer to :func:`build_binary_dist()`.
+        :returns: The pathname of the cached binary distribution archive (a
+                  string).
+
+        When the binary distribution hasn't been cached yet the cache is
+        locked (see :func:`.CacheManager.lock()`) and checked again before
+        the binary distribution is built, so that concurrent pip-accel
+        processes build any given binary distribution only once.
+
         Uses :func:`build_binary_dist()` to build binary distribution
-        archives. If this fails with a build error :func:`get_binary_dist()`
+        archives. If this fails with a build error :func:`build_with_dependencies()`
         will use :class:`.SystemPackageManager` to check for and install
         missing system packages and retry the build when missing system
         packages were installed.
         """
+        cache_file = self.get_cached_binary_dist(requirement)
+        if not cache_file:
+            with self.cache.lock(requirement):
+                # Another process may have published the binary distribution
+                # while we were waiting for the lock.
+                cache_file = self.get_cached_binary_dist(requirement)
+                if not cache_file:
+                    raw_file = self.build_with_dependencies(requirement, interactive)
+                    cache_file = self.cache_binary_dist(requirement, raw_file)
+        return cache_file
+
+    def get_cached_binary_dist(self, requirement):
+        """
+        Find a valid cached binary distribution archive.
+
+        :param requirement: A :class:`.Requirement` object.
+        :returns: The pathname of the cached binary distribution archive (a
+                  string) or :data:`None` when the archive hasn't been cached
+                  yet or needs to be invalidated.
+        """
         cache_file = self.cache.get(requirement)
         if cache_file:
             if self.needs_invalidation(requirement, cache_file):
@@ -81,45 +152,167 @@ class BinaryDistributionManager(object):
                 cache_file = None
         else:
             logger.debug("%s hasn't been cached yet, doing so now.", requirement)
-        if not cache_file:
-            # Build the binary distribution.
+        return cache_file
+
+    def create_build_plan(self, requirements):
+        """
+        Create a plan to build the binary distributions that are missing from the cache.
+
+        :param requirements: A list of :class:`.Requirement` objects (source
+                             distributions).
+        :returns: A :class:`.BuildPlan` object.
+        """
+        missing = [r for r in requirements if not self.get_cached_binary_dist(r)]
+        return BuildPlan(missing, self.build_times)
+
+    def execute_build_plan(self, plan, jobs=None):
+        """
+        Build the binary distributions in a build plan concurrently.
+
+        :param plan: A :class:`.BuildPlan` object.
+        :param jobs: The maximum number of concurrent builds (an integer,
+                     defaults to :attr:`.Config.build_jobs`).
+        :returns: The number of binary distributions that were built (an integer).
+
+        The actual builds are performed by ``setup.py`` subprocesses so a pool
+        of threads is enough to keep multiple CPU cores busy. The output of
+        each build is captured separately (see :func:`build_binary_dist_helper()`)
+        so concurrent builds don't garble each other's output.
+
+        Builds are started in the order given by :attr:`.BuildPlan.order`,
+        skipping over builds whose build dependencies haven't finished yet.
+        Transformation and caching of the resulting archives happens in the
+        calling thread as builds finish. When a build fails
+        :func:`retry_failed_build()` is used to retry the build (this can
+        prompt the user and so it's never done concurrently).
+
+        Each build holds the cache lock of its binary distribution (see
+        :func:`.CacheManager.lock()`) until the binary distribution has been
+        cached, so builds that another pip-accel process is already running
+        are waited for instead of duplicated. The locks are acquired (and the
+        cache is checked again) by the build's thread, so waiting for one
+        contended lock doesn't keep the calling thread from starting other
+        builds.
+        """
+        if not plan.requirements:
+            return 0
+        jobs = min(jobs or self.config.build_jobs, len(plan))
+        build_timer = Timer()
+        logger.info("Building %s using %s ..",
+                    pluralize(len(plan), "binary distribution"),
+                    pluralize(jobs, "concurrent job"))
+        results = queue.Queue()
+
+        def build_in_thread(requirement):
+            # The cache lock is released by the calling thread after the
+            # binary distribution has been cached.
+            lock = self.cache.lock(requirement)
             try:
-                raw_file = self.build_binary_dist(requirement)
-            except BuildFailed:
-                logger.warning("Build of %s failed, checking for missing dependencies ..", requirement)
-                if self.system_package_manager.install_dependencies(requirement):
-                    raw_file = self.build_binary_dist(requirement)
+                lock.acquire()
+                if self.get_cached_binary_dist(requirement):
+                    # Another process built it while we were waiting for the lock.
+                    results.put((requirement, lock, None, None))
                 else:
-                    raise
-            # Transform the binary distribution archive into a form that we can re-use.
-            fd, transformed_file = tempfile.mkstemp(prefix='pip-accel-bdist-', suffix='.tar.gz')
-            try:
-                archive = tarfile.open(transformed_file, 'w:gz')
+                    results.put((requirement, lock, self.build_binary_dist(requirement, interactive=False), None))
+            except Exception as e:
+                results.put((requirement, lock, None, e))
+
+        pending = plan.order
+        finished = set()
+        running = 0
+        num_built = 0
+        pool = ThreadPool(jobs)
+        try:
+            while pending or running:
+                # Start as many builds as we're allowed to.
+                for requirement in list(pending):
+                    if running < jobs and plan.is_ready(requirement, finished):
+                        pending.remove(requirement)
+                        logger.debug("Scheduling build of %s (expected to take %s) ..",
+                                     requirement, format_timespan(plan.expected_build_times[requirement]))
+                        pool.apply_async(build_in_thread, (requirement,))
+                        running += 1
+                # Wait for the next build to finish.
+                requirement, lock, raw_file, exception = results.get()
+                running -= 1
                 try:
-                    for member, from_handle in self.transform_binary_dist(raw_file):
-                        archive.addfile(member, from_handle)
+                    if isinstance(exception, BuildFailed):
+                        raw_file = self.retry_failed_build(requirement, exception)
+                    elif exception is not None:
+                        raise exception
+                    if raw_file:
+                        self.cache_binary_dist(requirement, raw_file)
+                        num_built += 1
                 finally:
-                    archive.close()
-                # Push the binary distribution archive to all available backends.
-                with open(transformed_file, 'rb') as handle:
-                    self.cache.put(requirement, handle)
-            finally:
-                # Close file descriptor before removing the temporary file.
-                # Without closing Windows is complaining that the file cannot
-                # be removed because it is used by another process.
-                os.close(fd)
-                # Cleanup the temporary file.
-                os.remove(transformed_file)
+                    lock.release()
+                finished.add(requirement)
+        finally:
+            # Wait for builds that are still running so that we don't pull
+            # the rug out from under them (e.g. by removing build directories).
+            pool.close()
+            pool.join()
+            # Release the locks held for builds whose results we didn't process.
+            while not results.empty():
+                results.get()[1].release()
+        logger.info("Finished building %s in %s.", pluralize(num_built, "binary distribution"), build_timer)
+        return num_built
+
+    def build_with_dependencies(self, requirement, interactive=True):
+        """
+        Build a binary distribution, installing missing system packages when needed.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param interactive: Refer to :func:`build_binary_dist()`.
+        :returns: The pathname of a binary distribution archive (a string).
+        :raises: Refer to :func:`retry_failed_build()`.
+        """
+        try:
+            return self.build_binary_dist(requirement, interactive)
+        except BuildFailed as e:
+            return self.retry_failed_build(requirement, e)
+
+    def retry_failed_build(self, requirement, exception):
+        """
+        Retry a failed build after installing missing system packages.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param exception: The :exc:`.BuildFailed` exception raised by the
+                          failed build.
+        :returns: The pathname of a binary distribution archive (a string).
+        :raises: The given `exception` when :class:`.SystemPackageManager`
+                 didn't install any missing system packages.
+        """
+        logger.warning("Build of %s failed, checking for missing dependencies ..", requirement)
+        if self.system_package_manager.install_dependencies(requirement):
+            return self.build_binary_dist(requirement)
+        else:
+            raise exception
+
+    def cache_binary_dist(self, requirement, raw_file):
+        """
+        Transform a freshly built binary distribution and add it to the cache.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param raw_file: The pathname of the binary distribution archive
+                         created by :func:`build_binary_dist()` (a string).
+        :returns: The pathname of the cached binary distribution archive (a
+                  string).
+
+        The transformed members are written straight into the local cache
+        (and teed to an archive for the other cache backends, see
+        :func:`.CacheManager.put_members()`) so that the binary distribution
+        is read and compressed only once.
+        """
+        # Transform the binary distribution archive into a form that we can
+        # re-use and push it to all available backends.
+        codec = parse_codec(self.config.s3_cache_codec or self.config.cache_codec)
+        cache_file = self.cache.put_members(requirement, self.transform_binary_dist(raw_file), codec)
+        if not cache_file:
             # Get the absolute pathname of the file in the local cache.
             cache_file = self.cache.get(requirement)
-            # Enable checksum based cache invalidation.
-            self.persist_checksum(requirement, cache_file)
-        archive = tarfile.open(cache_file, 'r:gz')
-        try:
-            for member in archive.getmembers():
-                yield member, archive.extractfile(member.name)
-        finally:
-            archive.close()
+        # Enable checksum based cache invalidation.
+        self.persist_checksum(requirement, cache_file)
+        return cache_file
 
     def needs_invalidation(self, requirement, cache_file):
         """
@@ -174,11 +367,14 @@ class BinaryDistributionManager(object):
                 with open(temporary_file, 'w') as handle:
                     handle.write('%s\n' % requirement.checksum)
 
-    def build_binary_dist(self, requirement):
+    def build_binary_dist(self, requirement, interactive=True):
         """
         Build a binary distribution archive from an unpacked source distribution.
 
         :param requirement: A :class:`.Requirement` object.
+        :param interactive: :data:`True` to render a spinner on the terminal
+                            while the build is running, :data:`False` to
+                            omit the spinner (used for concurrent builds).
         :returns: The pathname of a binary distribution archive (a string).
         :raises: :exc:`.BinaryDistributionError` when the original command
                 and the fall back both fail to produce a binary distribution
@@ -211,18 +407,19 @@ class BinaryDistributionManager(object):
         .. _issue 37: https://github.com/paylogic/pip-accel/issues/37
         """
         try:
-            return self.build_binary_dist_helper(requirement, ['bdist_dumb', '--format=tar'])
+            return self.build_binary_dist_helper(requirement, ['bdist_dumb', '--format=tar'], interactive)
         except (BuildFailed, NoBuildOutput):
             logger.warning("Build of %s failed, falling back to alternative method ..", requirement)
-            return self.build_binary_dist_helper(requirement, ['bdist', '--formats=gztar'])
+            return self.build_binary_dist_helper(requirement, ['bdist', '--formats=gztar'], interactive)
 
-    def build_binary_dist_helper(self, requirement, setup_command):
+    def build_binary_dist_helper(self, requirement, setup_command, interactive=True):
         """
         Convert an unpacked source distribution to a binary distribution.
 
         :param requirement: A :class:`.Requirement` object.
         :param setup_command: A list of strings with the arguments to
                               ``setup.py``.
+        :param interactive: Refer to :func:`build_binary_dist()`.
         :returns: The pathname of the resulting binary distribution (a string).
         :raises: :exc:`.BuildFailed` when the build reports an error (e.g.
                  because of missing binary dependencies like system
@@ -231,6 +428,7 @@ class BinaryDistributionManager(object):
                  expected binary distribution archive.
         """
         build_timer = Timer()
+        started = time.time()
         # Make sure the source distribution contains a setup script.
         setup_script = os.path.join(requirement.source_directory, 'setup.py')
         if not os.path.isfile(setup_script):
@@ -267,12 +465,14 @@ class BinaryDistributionManager(object):
             # Start the build.
             build = subprocess.Popen(command_line, cwd=requirement.source_directory, stdout=fd, stderr=fd)
             # Wait for the build to finish and provide feedback to the user in the mean time.
-            spinner = Spinner(label=build_text, timer=build_timer)
+            spinner = Spinner(label=build_text, timer=build_timer) if interactive else None
             while build.poll() is None:
-                spinner.step()
+                if spinner:
+                    spinner.step()
                 # Don't tax the CPU too much.
                 time.sleep(0.2)
-            spinner.clear()
+            if spinner:
+                spinner.clear()
             # Make sure the build succeeded and produced a binary distribution archive.
             try:
                 # If the build reported an error we'll try to provide the user with
@@ -311,7 +511,8 @@ class BinaryDistributionManager(object):
                 """, message=e.args[0], output=build_output.strip())
                 e.args = (enhanced_message,)
                 raise
-            logger.info("Finished building %s in %s.", requirement.name, build_timer)
+            logger.info("Finished building %s in %s.", requirement, build_timer)
+            self.build_times.record(requirement, time.time() - started)
             return os.path.join(dist_directory, filenames[0])
         finally:
             # Close file descriptor before removing the temporary file.
@@ -422,21 +623,48 @@ class BinaryDistributionManager(object):
 
         This method installs a binary distribution created by
         :class:`build_binary_dist()` into the given prefix (a directory like
-        ``/usr``, ``/usr/local`` or a virtual environment).
-        """
-        # TODO This is quite slow for modules like Django. Speed it up! Two choices:
-        #  1. Run the external tar program to unpack the archive. This will
-        #     slightly complicate the fixing up of hashbangs.
-        #  2. Using links? The plan: We can maintain a "seed" environment under
-        #     $PIP_ACCEL_CACHE and use symbolic and/or hard links to populate other
-        #     places based on the "seed" environment.
+        ``/usr``, ``/usr/local`` or a virtual environment). Members provided
+        by the :class:`.SeedStore` (except scripts with a hashbang) are
+        linked into place instead of being copied. Members whose digest is
+        known (see :class:`.MemberFile`) are skipped when an identical file
+        is already installed (see :func:`is_unchanged()`).
+
+        The installation happens in two phases: First the pathnames of all
+        members are determined and the directories they need are created
+        (once per directory). Then the files are written by
+        :func:`install_files()`, concurrently when :attr:`.Config.install_jobs`
+        is greater than one. Members that can only be read while iterating
+        over `members` (e.g. members of ``*.tar.gz`` archives) are written
+        during the first phase. Either way files are copied in chunks (see
+        :func:`copy_file()`) so that :attr:`.Config.install_memory` bounds
+        the memory used during installation.
+        """
+        # Extracting every file is quite slow for modules like Django, which
+        # is why members provided by the seed store (see pip_accel.seed) are
+        # linked into place instead.
+        install_timer = Timer()
+        seed_stats = dict(self.seed_store.stats)
         module_search_path = set(map(os.path.normpath, sys.path))
         prefix = os.path.normpath(prefix or self.config.install_prefix)
         python = os.path.normpath(python or self.config.python_executable)
         installed_files = []
+        pkg_info_file = None
+        facts_recorded = True
+        use_dist_packages = {}
+        deferred_files = []
+        directories = set()
+        num_files = 0
         for member, from_handle in members:
             pathname = member.name
-            if virtualenv_compatible:
+            # The facts we need about each member are recorded in the manifest
+            # when the binary distribution is cached (see pip_accel.archives),
+            # but members of archives written by older versions of pip-accel
+            # need to be inspected here.
+            facts = getattr(member, 'install', None)
+            if facts is None:
+                facts = get_install_facts(pathname)
+                facts_recorded = False
+            if virtualenv_compatible and facts['include']:
                 # Some binary distributions include C header files (see for example
                 # the greenlet package) however the subdirectory of include/ in a
                 # virtual environment is a symbolic link to a subdirectory of
@@ -444,34 +672,209 @@ class BinaryDistributionManager(object):
                 # inside the directory pointed to by the symbolic link. Instead we
                 # implement the same workaround that pip uses to avoid this
                 # problem.
-                pathname = re.sub('^include/', 'include/site/', pathname)
-            if self.config.on_debian and '/site-packages/' in pathname:
+                pathname = 'include/site/' + pathname[len('include/'):]
+            if self.config.on_debian and facts['site_packages']:
                 # On Debian based system wide Python installs the /site-packages/
                 # directory is not in Python's module search path while
-                # /dist-packages/ is. We try to be compatible with this.
-                match = re.match('^(.+?)/site-packages', pathname)
-                if match:
-                    site_packages = os.path.normpath(os.path.join(prefix, match.group(0)))
-                    dist_packages = os.path.normpath(os.path.join(prefix, match.group(1), 'dist-packages'))
-                    if dist_packages in module_search_path and site_packages not in module_search_path:
-                        pathname = pathname.replace('/site-packages/', '/dist-packages/')
+                # /dist-packages/ is. We try to be compatible with this (the
+                # decision is made once per site-packages directory).
+                site_packages = facts['site_packages']
+                if site_packages not in use_dist_packages:
+                    dist_packages = os.path.join(os.path.dirname(site_packages), 'dist-packages')
+                    use_dist_packages[site_packages] = (
+                        os.path.normpath(os.path.join(prefix, dist_packages)) in module_search_path and
+                        os.path.normpath(os.path.join(prefix, site_packages)) not in module_search_path
+                    )
+                if use_dist_packages[site_packages]:
+                    pathname = pathname.replace('/site-packages/', '/dist-packages/')
             pathname = os.path.join(prefix, pathname)
             if track_installed_files:
                 # Track the installed file's absolute pathname.
                 installed_files.append(pathname)
-            directory = os.path.dirname(pathname)
+                if facts['pkg_info']:
+                    pkg_info_file = pathname
+            num_files += 1
+            if isinstance(from_handle, (MemberFile, SeedFile)):
+                directories.add(os.path.dirname(pathname))
+                deferred_files.append((member, from_handle, pathname))
+            else:
+                self.create_directories([os.path.dirname(pathname)])
+                self.install_file(member, from_handle, pathname, python)
+        self.create_directories(directories)
+        self.install_files(deferred_files, python)
+        logger.debug("Installed %i files in %s (%.0f files per second).",
+                     num_files, install_timer, num_files / max(install_timer.elapsed_time, 0.001))
+        seed_stats = dict((k, v - seed_stats[k]) for k, v in self.seed_store.stats.items())
+        if any(seed_stats.values()):
+            logger.debug("Installed %s from seed store (%i cloned, %i hard linked, %i copied).",
+                         pluralize(sum(seed_stats.values()), "file"),
+                         seed_stats['clone'], seed_stats['link'], seed_stats['copy'])
+        if track_installed_files:
+            if facts_recorded:
+                self.update_installed_files(installed_files, pkg_info_file)
+            else:
+                self.update_installed_files(installed_files)
+
+    def create_directories(self, directories):
+        """
+        Create the directories needed to install a binary distribution.
+
+        :param directories: An iterable of directory pathnames (strings).
+        """
+        for directory in sorted(directories):
             if not os.path.isdir(directory):
                 logger.debug("Creating directory: %s ..", directory)
                 makedirs(directory)
-            logger.debug("Creating file: %s ..", pathname)
+
+    def install_files(self, files, python):
+        """
+        Write the files of a binary distribution (concurrently if possible).
+
+        :param files: A list of tuples with three values each: A
+                      :class:`tarfile.TarInfo` object, a file-like object
+                      that can be read from any thread and the pathname of
+                      the file to create.
+        :param python: Refer to :func:`install_binary_dist()`.
+        :raises: The first exception raised while writing a file. Files that
+                 weren't written yet are skipped, but the exception is only
+                 raised after all threads have finished so that callers (e.g.
+                 :class:`.TransactionalUpdate`) can safely roll back.
+        """
+        jobs = min(self.config.install_jobs, len(files))
+        if jobs <= 1:
+            for member, from_handle, pathname in files:
+                self.install_file(member, from_handle, pathname, python)
+            return
+        failed = threading.Event()
+        errors = []
+        errors_lock = threading.Lock()
+
+        def install_in_thread(member, from_handle, pathname):
+            if not failed.is_set():
+                try:
+                    self.install_file(member, from_handle, pathname, python)
+                except Exception as e:
+                    # Remember the first exception (files installed after it
+                    # are skipped, so later failures are only side effects).
+                    with errors_lock:
+                        if not errors:
+                            errors.append(e)
+                    failed.set()
+
+        pool = ThreadPool(jobs)
+        try:
+            for args in files:
+                pool.apply_async(install_in_thread, args)
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            raise errors[0]
+
+    def install_file(self, member, from_handle, pathname, python):
+        """
+        Install a single file of a binary distribution.
+
+        :param member: A :class:`tarfile.TarInfo` object.
+        :param from_handle: A file-like object.
+        :param pathname: The pathname of the file to create (a string).
+        :param python: Refer to :func:`install_binary_dist()`.
+        """
+        if isinstance(from_handle, MemberFile) and from_handle.hashbang is False \
+                and self.is_unchanged(pathname, member, from_handle.digest):
+            logger.debug("Skipping unchanged file: %s", pathname)
+            return
+        logger.debug("Creating file: %s ..", pathname)
+        if isinstance(from_handle, SeedFile) and not from_handle.hashbang:
+            self.seed_store.install_file(from_handle, pathname, member.mode)
+            return
+        if os.path.isfile(pathname) and os.stat(pathname).st_nlink > 1:
+            # Don't write through a hard link into the seed store.
+            os.unlink(pathname)
+        try:
             with open(pathname, 'wb') as to_handle:
-                contents = from_handle.read()
-                if contents.startswith(b'#!/'):
-                    contents = self.fix_hashbang(contents, python)
-                to_handle.write(contents)
-            os.chmod(pathname, member.mode)
-        if track_installed_files:
-            self.update_installed_files(installed_files)
+                self.copy_file(from_handle, to_handle, python, getattr(from_handle, 'hashbang', None))
+        finally:
+            if isinstance(from_handle, (MemberFile, SeedFile)):
+                from_handle.close()
+        os.chmod(pathname, member.mode)
+
+    @property
+    def buffer_size(self):
+        """
+        The size of the chunks used to copy files during installation (an integer).
+
+        This is :attr:`.Config.install_memory` divided between the threads
+        that write files (see :attr:`.Config.install_jobs`), with a minimum of
+        4 KiB per thread.
+        """
+        return get_buffer_size(self.config)
+
+    def copy_file(self, from_handle, to_handle, python, hashbang=None):
+        """
+        Copy the contents of a file in chunks, rewriting its hashbang if needed.
+
+        :param from_handle: A file-like object that supports reads of a given size.
+        :param to_handle: A file-like object opened in binary mode.
+        :param python: Refer to :func:`install_binary_dist()`.
+        :param hashbang: :data:`True` if the file is known to start with a
+                         hashbang, :data:`False` if it's known not to,
+                         :data:`None` (the default) to check the first chunk.
+
+        When a hashbang is found the first line is passed to
+        :func:`fix_hashbang()`, otherwise (and for the remainder of scripts)
+        the chunks are written unchanged, so large files are copied using a
+        fixed amount of memory (see :attr:`buffer_size`).
+        """
+        buffer_size = self.buffer_size
+        chunk = from_handle.read(buffer_size)
+        if hashbang is None:
+            # Short reads are allowed, so make sure we can see the `#!/' prefix.
+            while 0 < len(chunk) < 3:
+                data = from_handle.read(buffer_size)
+                if not data:
+                    break
+                chunk += data
+            hashbang = chunk.startswith(b'#!/')
+        if hashbang:
+            # Make sure the complete hashbang line is available.
+            while b'\n' not in chunk:
+                data = from_handle.read(buffer_size)
+                if not data:
+                    break
+                chunk += data
+            first_line, newline, remainder = chunk.partition(b'\n')
+            chunk = self.fix_hashbang(first_line, python) + newline + remainder
+        while chunk:
+            to_handle.write(chunk)
+            chunk = from_handle.read(buffer_size)
+
+    def is_unchanged(self, pathname, member, digest):
+        """
+        Check whether an installed file is identical to a member of a binary distribution.
+
+        :param pathname: The pathname of the installed file (a string).
+        :param member: A :class:`tarfile.TarInfo` object.
+        :param digest: The SHA1 digest of the member's contents (a string).
+        :returns: :data:`True` if the file exists with the same size,
+                  permissions and contents, :data:`False` otherwise.
+
+        The contents are only compared when the size and permissions match,
+        so in the common case of installing into a fresh environment this
+        costs a single :func:`os.stat()` call per file.
+        """
+        try:
+            info = os.stat(pathname)
+        except OSError:
+            return False
+        if not (stat.S_ISREG(info.st_mode) and info.st_size == member.size and
+                stat.S_IMODE(info.st_mode) == member.mode):
+            return False
+        context = hashlib.sha1()
+        with open(pathname, 'rb') as handle:
+            for chunk in iter(lambda: handle.read(1024 * 64), b''):
+                context.update(chunk)
+        return context.hexdigest() == digest
 
     def fix_hashbang(self, contents, python):
         """
@@ -499,7 +902,7 @@ class BinaryDistributionManager(object):
                 contents = b'\n'.join(lines)
         return contents
 
-    def update_installed_files(self, installed_files):
+    def update_installed_files(self, installed_files, pkg_info_file=None):
         """
         Track the files installed by a package so pip knows how to remove the package.
 
@@ -508,9 +911,15 @@ class BinaryDistributionManager(object):
 
         :param installed_files: A list of absolute pathnames (strings) with the
                                 files that were just installed.
+        :param pkg_info_file: The absolute pathname of the package's
+                              ``*.egg-info/PKG-INFO`` file (a string). When
+                              this isn't given `installed_files` is searched.
         """
-        # Find the *.egg-info directory where installed-files.txt should be created.
-        pkg_info_files = [fn for fn in installed_files if fnmatch.fnmatch(fn, '*.egg-info/PKG-INFO')]
+        if pkg_info_file:
+            pkg_info_files = [pkg_info_file]
+        else:
+            # Find the *.egg-info directory where installed-files.txt should be created.
+            pkg_info_files = [fn for fn in installed_files if fnmatch.fnmatch(fn, PKG_INFO_PATTERN)]
         # I'm not (yet) sure how reliable the above logic is, so for now
         # I'll err on the side of caution and only act when the results
         # seem to be reliable.
@@ -1,7 +1,7 @@
 # Accelerator for pip, the Python package manager.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: October 31, 2015
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """
@@ -15,12 +15,30 @@ same mechanism.
 Additionally this module defines :class:`CacheManager` which makes it
 possible to merge the available cache backends into a single logical cache
 which automatically disables backends that report errors.
+
+The filenames of distribution archives include the cache format revision (see
+:attr:`.Config.cache_format_revision`). When a distribution archive is missing
+under the current revision the :class:`CacheManager` falls back to the older
+revisions listed in :data:`READABLE_REVISIONS`, whose archive formats can
+still be read (see :mod:`pip_accel.archives`). This avoids rebuilding every
+cached binary distribution when the archive format changes.
+
+Uploads to remote cache backends (see :attr:`AbstractCacheBackend.REMOTE`)
+are handed to an :class:`.UploadQueue` so that they can happen in the
+background (see :mod:`pip_accel.caches.uploads`). Distribution archives that
+are missing from remote cache backends are remembered for a while, so they
+aren't looked up again and again (see :mod:`pip_accel.caches.misses`).
 """
 
 # Standard library modules.
 import logging
+import tempfile
+import threading
 
 # Modules included in our package.
+from pip_accel.archives import create_archive_writer, get_archive_suffix, get_buffer_size
+from pip_accel.caches.misses import MissCache
+from pip_accel.caches.uploads import UploadQueue
 from pip_accel.compat import WINDOWS
 from pip_accel.exceptions import CacheBackendDisabledError
 from pip_accel.utils import get_python_version
@@ -36,7 +54,10 @@ logger = logging.getLogger(__name__)
 registered_backends = set()
 
 # On Windows it is not allowed to have colons in filenames so we use a dollar sign instead.
-FILENAME_PATTERN = 'v%i\\%s$%s$%s.tar.gz' if WINDOWS else 'v%i/%s:%s:%s.tar.gz'
+FILENAME_PATTERN = 'v%i\\%s$%s$%s%s' if WINDOWS else 'v%i/%s:%s:%s%s'
+
+READABLE_REVISIONS = (9, 8, 7)
+"""The cache format revisions whose distribution archives can be read (a tuple of integers)."""
 
 
 class CacheBackendMeta(type):
@@ -73,6 +94,15 @@ class AbstractCacheBackend(object):
 
     PRIORITY = 0
 
+    REMOTE = False
+    """
+    :data:`True` for cache backends that store distribution archives on another system.
+
+    The :func:`put()` calls of remote cache backends are made by an
+    :class:`.UploadQueue` (in the background when :attr:`.Config.async_uploads`
+    is enabled) and failed uploads are retried by later runs.
+    """
+
     def __init__(self, config):
         """
         Initialize a cache backend.
@@ -110,6 +140,60 @@ class AbstractCacheBackend(object):
         """
         raise NotImplementedError()
 
+    def prefetch(self, filenames):
+        """
+        Make distribution archives available on the local file system ahead of time.
+
+        :param filenames: The filenames of the distribution archives (a list
+                          of strings).
+        :returns: A set with the filenames of the distribution archives that
+                  are available on the local file system afterwards.
+
+        This method is called by `pip-accel` before it starts installing a
+        requirement set, so that cache backends that store distribution
+        archives remotely can download them concurrently instead of one at a
+        time from :func:`get()`. The default implementation simply calls
+        :func:`get()` for each filename.
+        """
+        return set(fn for fn in filenames if self.get(fn) is not None)
+
+    def is_indexed(self, filename):
+        """
+        Check whether the index of the cache backend lists a distribution archive.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: :data:`True` if the cache backend maintains an index of its
+                  distribution archives and the index lists the given
+                  distribution archive, :data:`False` otherwise (the default).
+
+        This method is called by `pip-accel` before it skips the lookup of a
+        distribution archive that was missing from a remote cache backend
+        (see :mod:`pip_accel.caches.misses`), so that distribution archives
+        uploaded by other systems are found without waiting for the recorded
+        miss to expire.
+        """
+        return False
+
+    def lock(self, filename):
+        """
+        Get a lock that serializes the building of a distribution archive.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: An object with ``acquire()`` and ``release()`` methods or
+                  :data:`None` when the cache backend doesn't support locking
+                  (the default). The ``acquire()`` method takes an optional
+                  `blocking` argument and returns :data:`False` when
+                  `blocking` is :data:`False` and the lock is held by someone
+                  else (:data:`True` otherwise).
+
+        This method is called by `pip-accel` after a cache miss, before it
+        starts building the distribution archive. While the lock is held other
+        pip-accel processes that miss the same distribution archive will wait
+        for the lock and then find the archive in the cache instead of
+        building it again.
+        """
+        return None
+
     def __repr__(self):
         """Generate a textual representation of the cache backend."""
         return self.__class__.__name__
@@ -129,7 +213,14 @@ class CacheManager(object):
     Interface to treat multiple cache backends as a single one.
 
     The cache manager automatically disables cache backends that raise
-    exceptions on ``get()`` and ``put()`` operations.
+    exceptions on ``get()`` and ``put()`` operations (except for uploads to
+    remote cache backends, which are retried instead).
+
+    A cache manager can be used from multiple threads (the builder and
+    installer threads of a :class:`.Pipeline` share one). Its own state is
+    guarded by :attr:`mutex` and the cache backends are responsible for their
+    own thread safety (e.g. the Amazon S3 cache backend uses a connection per
+    thread).
     """
 
     def __init__(self, config):
@@ -155,6 +246,11 @@ class CacheManager(object):
         logger.debug("Initialized %s: %s",
                      pluralize(len(self.backends), "cache backend"),
                      concatenate(map(repr, self.backends)))
+        self.held_locks = {}
+        self.mutex = threading.Lock()
+        self.misses = MissCache(self.config)
+        self.uploads = UploadQueue(self.config, self.backends)
+        self.uploads.recover()
 
     def get(self, requirement):
         """
@@ -163,19 +259,68 @@ class CacheManager(object):
         :param requirement: A :class:`.Requirement` object.
         :returns: The absolute pathname of a local file or :data:`None` when the
                   distribution archive is missing from all available caches.
+
+        The current cache format revision is tried first, followed by the
+        older revisions in :data:`READABLE_REVISIONS`. Distribution archives
+        that are known to be missing from remote cache backends are skipped
+        (see :func:`is_known_miss()`) and new misses are recorded.
         """
-        filename = self.generate_filename(requirement)
+        current_revision = self.config.cache_format_revision
+        revisions = [current_revision] + [r for r in READABLE_REVISIONS if r < current_revision]
+        for revision in revisions:
+            filename = self.generate_filename(requirement, revision)
+            for backend in list(self.backends):
+                try:
+                    if self.is_known_miss(backend, filename):
+                        continue
+                    pathname = backend.get(filename)
+                    if pathname is not None:
+                        if revision != current_revision:
+                            logger.debug("Using distribution archive of cache format revision %i (%s).",
+                                         revision, pathname)
+                        return pathname
+                    if getattr(backend, 'REMOTE', False):
+                        self.misses.record(backend, filename)
+                except CacheBackendDisabledError as e:
+                    logger.debug("Disabling %s because it requires configuration: %s", backend, e)
+                    self.disable(backend)
+                except Exception as e:
+                    logger.exception("Disabling %s because it failed: %s", backend, e)
+                    self.disable(backend)
+
+    def prefetch(self, requirements):
+        """
+        Make the distribution archives of requirements available on the local file system.
+
+        :param requirements: A list of :class:`.Requirement` objects.
+
+        The backends are asked to prefetch the distribution archives (see
+        :func:`AbstractCacheBackend.prefetch()`) in order of priority, so
+        archives that are already cached locally are never downloaded. Only
+        the current cache format revision is considered, archives missing
+        from all caches are left for :func:`get()` to handle (which also
+        records the misses, prefetching can fail for other reasons).
+        Distribution archives that are known to be missing from a cache
+        backend (see :func:`is_known_miss()`) aren't prefetched from it.
+        """
+        pending = []
+        for requirement in requirements:
+            filename = self.generate_filename(requirement)
+            if filename not in pending:
+                pending.append(filename)
         for backend in list(self.backends):
+            if not pending:
+                break
             try:
-                pathname = backend.get(filename)
-                if pathname is not None:
-                    return pathname
+                candidates = [fn for fn in pending if not self.is_known_miss(backend, fn)]
+                available = backend.prefetch(candidates) if candidates else set()
+                pending = [fn for fn in pending if fn not in available]
             except CacheBackendDisabledError as e:
                 logger.debug("Disabling %s because it requires configuration: %s", backend, e)
-                self.backends.remove(backend)
+                self.disable(backend)
             except Exception as e:
                 logger.exception("Disabling %s because it failed: %s", backend, e)
-                self.backends.remove(backend)
+                self.disable(backend)
 
     def put(self, requirement, handle):
         """
@@ -187,25 +332,301 @@ class CacheManager(object):
         """
         filename = self.generate_filename(requirement)
         for backend in list(self.backends):
-            handle.seek(0)
+            self.put_backend(backend, filename, handle)
+
+    def put_backend(self, backend, filename, handle):
+        """
+        Store a distribution archive in a single cache backend.
+
+        :param backend: An :class:`AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+
+        Remote cache backends (see :attr:`AbstractCacheBackend.REMOTE`) are
+        given to :func:`.UploadQueue.submit()` together with the lock of the
+        distribution archive (see :func:`lock()`) and a recorded miss of the
+        distribution archive is forgotten. Other cache backends are disabled
+        when they fail.
+        """
+        handle.seek(0)
+        if getattr(backend, 'REMOTE', False):
+            self.misses.forget(backend, filename)
+            with self.mutex:
+                lock = self.held_locks.get(filename)
+            self.uploads.submit(backend, filename, handle, lock=lock)
+            return
+        try:
+            backend.put(filename, handle)
+        except CacheBackendDisabledError as e:
+            logger.debug("Disabling %s because it requires configuration: %s", backend, e)
+            self.disable(backend)
+        except Exception as e:
+            logger.exception("Disabling %s because it failed: %s", backend, e)
+            self.disable(backend)
+
+    def put_members(self, requirement, members, codec=None):
+        """
+        Store a newly built distribution in all of the available caches in a single pass.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param members: An iterable of tuples with two values each: A
+                        :class:`tarfile.TarInfo` object and a file-like object.
+        :param codec: The codec used to compress the members of the
+                      distribution archive that's passed to other cache
+                      backends (a :class:`.Codec` object).
+        :returns: The pathname of the distribution in the local cache (a
+                  string) or :data:`None` when no cache backend supports
+                  writing members directly.
+
+        Cache backends that implement a ``put_members()`` method (like
+        :func:`.LocalCacheBackend.put_members()`) receive the members
+        directly, so no intermediate distribution archive has to be written
+        and read back. When other cache backends are available the members
+        are also written to a distribution archive (while they're being
+        stored by the first backend) which is then passed to the ``put()``
+        methods of those backends.
+        """
+        filename = self.generate_filename(requirement)
+        direct_backends = [b for b in self.backends if hasattr(b, 'put_members')]
+        other_backends = [b for b in self.backends if not hasattr(b, 'put_members')]
+        pathname = None
+        revision = self.config.cache_format_revision
+        # Boto uses the filename to guess the content type, so the archive
+        # needs a name (with the right filename extension).
+        with tempfile.NamedTemporaryFile(prefix='pip-accel-bdist-', suffix=get_archive_suffix(revision)) as handle:
+            archive = None
+            if other_backends:
+                archive = create_archive_writer(handle, revision, codec, get_buffer_size(self.config))
+            if direct_backends:
+                backend = direct_backends[0]
+                try:
+                    pathname = backend.put_members(filename, members, archive)
+                except Exception as e:
+                    # The members can only be read once, so there's no
+                    # point in disabling the backend and carrying on.
+                    logger.exception("Disabling %s because it failed: %s", backend, e)
+                    self.disable(backend)
+                    raise
+            elif archive is not None:
+                for member, from_handle in members:
+                    archive.add(member, from_handle)
+            if archive is not None:
+                archive.close()
+                for backend in other_backends:
+                    self.put_backend(backend, filename, handle)
+        return pathname
+
+    def disable(self, backend):
+        """
+        Stop using a cache backend (for the rest of the run).
+
+        :param backend: An :class:`AbstractCacheBackend` object.
+
+        Multiple threads can run into the same failing cache backend, so the
+        cache backend is only removed by the first of them.
+        """
+        with self.mutex:
+            if backend in self.backends:
+                self.backends.remove(backend)
+
+    def forget_misses(self, filename):
+        """
+        Forget the recorded misses of a distribution archive.
+
+        :param filename: The filename of the distribution archive (a string).
+
+        This is called when the lock of the distribution archive has been
+        acquired after waiting for another holder (see :func:`lock()`). While
+        waiting for the lock another process may have uploaded the
+        distribution archive, so the lookup that follows must ask the remote
+        cache backends again instead of trusting a miss that was recorded
+        before the wait.
+        """
+        for backend in list(self.backends):
+            if getattr(backend, 'REMOTE', False):
+                self.misses.forget(backend, filename)
+
+    def is_known_miss(self, backend, filename):
+        """
+        Check whether a distribution archive is known to be missing from a remote cache backend.
+
+        :param backend: An :class:`AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        :returns: :data:`True` if the :class:`.MissCache` has a recent miss of
+                  the distribution archive that isn't contradicted by the
+                  index of the cache backend (see
+                  :func:`AbstractCacheBackend.is_indexed()`), :data:`False`
+                  otherwise.
+        """
+        if getattr(backend, 'REMOTE', False) and self.misses.is_missing(backend, filename):
+            if not backend.is_indexed(filename):
+                logger.debug("Skipping lookup of %s in %s (recently missing).", filename, backend)
+                return True
+            self.misses.forget(backend, filename)
+        return False
+
+    def lock(self, requirement):
+        """
+        Get a lock that serializes the building of a distribution archive.
+
+        :param requirement: A :class:`.Requirement` object.
+        :returns: A :class:`CacheLock` object that combines the locks provided
+                  by the available cache backends (it doesn't lock anything
+                  when none of the cache backends support locking).
+        """
+        filename = self.generate_filename(requirement)
+        locks = []
+        for backend in list(self.backends):
             try:
-                backend.put(filename, handle)
+                lock = backend.lock(filename)
+                if lock is not None:
+                    locks.append(lock)
             except CacheBackendDisabledError as e:
                 logger.debug("Disabling %s because it requires configuration: %s", backend, e)
-                self.backends.remove(backend)
+                self.disable(backend)
             except Exception as e:
                 logger.exception("Disabling %s because it failed: %s", backend, e)
-                self.backends.remove(backend)
+                self.disable(backend)
+        cache_lock = CacheLock(locks,
+                               on_acquire=lambda: self.lock_acquired(filename, cache_lock),
+                               on_release=lambda: self.lock_released(filename, cache_lock))
+        return cache_lock
+
+    def lock_acquired(self, filename, lock):
+        """
+        Keep track of a lock that has been acquired.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param lock: The :class:`CacheLock` object.
 
-    def generate_filename(self, requirement):
+        Locks are remembered while they're held so that background uploads
+        can keep holding them (see :func:`put_backend()`). When acquiring the
+        lock had to wait for another holder the recorded misses of the
+        distribution archive are forgotten (see :func:`forget_misses()`).
+        """
+        if lock.locks:
+            with self.mutex:
+                self.held_locks[filename] = lock
+        if lock.waited:
+            self.forget_misses(filename)
+
+    def lock_released(self, filename, lock):
+        """
+        Forget about a lock that has been released.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param lock: The :class:`CacheLock` object.
+        """
+        with self.mutex:
+            if self.held_locks.get(filename) is lock:
+                self.held_locks.pop(filename, None)
+
+    def generate_filename(self, requirement, revision=None):
         """
         Generate a distribution archive filename for a package.
 
         :param requirement: A :class:`.Requirement` object.
+        :param revision: The cache format revision (an integer, defaults to
+                         :attr:`.Config.cache_format_revision`).
         :returns: The filename of the distribution archive (a string)
                   including a single leading directory component to indicate
                   the cache format revision.
         """
-        return FILENAME_PATTERN % (self.config.cache_format_revision,
-                                   requirement.name, requirement.version,
-                                   get_python_version())
+        if revision is None:
+            revision = self.config.cache_format_revision
+        return FILENAME_PATTERN % (revision, requirement.name, requirement.version,
+                                   get_python_version(), get_archive_suffix(revision))
+
+
+class CacheLock(object):
+
+    """
+    Context manager that holds the locks of multiple cache backends.
+
+    The locks are acquired in the order of the cache backends' priorities and
+    released in the opposite order. Because locks are released explicitly
+    (instead of being tied to a thread) a lock acquired in one thread can be
+    released in another thread. This is used by the :class:`.UploadQueue` to
+    keep the locks held until the background upload of the distribution
+    archive has finished (see :func:`hold()`), so that other processes waiting
+    for the lock find the distribution archive instead of building it.
+    """
+
+    def __init__(self, locks, on_acquire=None, on_release=None):
+        """
+        Initialize a :class:`CacheLock` object.
+
+        :param locks: A list of lock objects returned by
+                      :func:`AbstractCacheBackend.lock()`.
+        :param on_acquire: A callable that's called (without arguments) after
+                           the locks have been acquired (optional).
+        :param on_release: A callable that's called (without arguments) after
+                           the locks have been released (optional).
+        """
+        self.locks = locks
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.acquired = []
+        self.holds = 0
+        self.deferred = False
+        self.waited = False
+        self.mutex = threading.Lock()
+
+    def acquire(self):
+        """
+        Acquire all locks (blocks until they are available).
+
+        Each lock is first acquired without blocking, so that ``waited``
+        tells whether another holder had to be waited for. When acquiring one
+        of the locks fails the locks that were already acquired are released
+        (in the opposite order) before the exception is propagated.
+        """
+        self.waited = False
+        try:
+            for lock in self.locks:
+                if not lock.acquire(blocking=False):
+                    lock.acquire()
+                    self.waited = True
+                self.acquired.append(lock)
+        except Exception:
+            while self.acquired:
+                self.acquired.pop().release()
+            raise
+        if self.on_acquire is not None:
+            self.on_acquire()
+
+    def release(self):
+        """Release the locks that were acquired (deferred while the locks are held by :func:`hold()`)."""
+        with self.mutex:
+            if self.holds:
+                self.deferred = True
+                return
+            released = bool(self.acquired)
+            while self.acquired:
+                self.acquired.pop().release()
+        if released and self.on_release is not None:
+            self.on_release()
+
+    def hold(self):
+        """Keep the locks from being released until :func:`unhold()` is called."""
+        with self.mutex:
+            self.holds += 1
+
+    def unhold(self):
+        """Undo a call to :func:`hold()`, performing a deferred :func:`release()`."""
+        with self.mutex:
+            self.holds -= 1
+            release = self.deferred and not self.holds
+        if release:
+            self.deferred = False
+            self.release()
+
+    def __enter__(self):
+        """Acquire all locks when entering the context."""
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Release the locks when leaving the context."""
+        self.release()
@@ -1,7 +1,7 @@
 # Accelerator for pip, the Python package manager.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: October 31, 2015
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """
@@ -15,17 +15,45 @@ then moved into place atomically using :func:`os.rename()` to avoid partial
 reads caused by running multiple invocations of pip-accel at the same time
 (which happened in `issue 25`_).
 
+Since revision 8 of the binary cache format the local cache backend doesn't
+store the distribution archives it receives as is. Instead the files in each
+archive are stored once in a content addressed blob store, together with a
+small manifest per distribution (see :mod:`pip_accel.archives`). Archives
+of existing revision 7 caches are migrated when they're first used (see
+:func:`LocalCacheBackend.get()`) or all at once using
+:func:`LocalCacheBackend.repack()`.
+
+Atomic renames prevent corruption but they don't prevent duplicate work: When
+several pip-accel processes on the same host miss the same distribution
+archive at the same time they would all build it. To avoid this the local
+cache backend provides per archive advisory file locks (see
+:class:`FileLock`) so that the first process builds the archive while the
+other processes wait for it to be published.
+
 .. _issue 25: https://github.com/paylogic/pip-accel/issues/25
 """
 
 # Standard library modules.
+import errno
+import glob
 import logging
 import os
 import shutil
+import socket
+
+# Advisory file locking isn't available on all platforms (e.g. Windows).
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# External dependencies.
+from humanfriendly import format_size, pluralize
 
 # Modules included in our package.
+from pip_accel.archives import TARBALL_SUFFIX, get_manifest_name, iter_archive_members, write_manifest
 from pip_accel.caches import AbstractCacheBackend
-from pip_accel.utils import AtomicReplace, makedirs
+from pip_accel.utils import makedirs
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -42,10 +70,28 @@ class LocalCacheBackend(AbstractCacheBackend):
         Check if a distribution archive exists in the local cache.
 
         :param filename: The filename of the distribution archive (a string).
-        :returns: The pathname of a distribution archive on the local file
+        :returns: The pathname of a distribution manifest on the local file
                   system or :data:`None`.
+
+        When `filename` refers to a ``*.tar.gz`` archive that exists in the
+        local cache (written by a cache format revision that stored complete
+        archives) the archive is migrated to the current cache format revision
+        (see :func:`migrate()`) and the pathname of the new manifest is
+        returned, so that existing caches don't have to be repacked first.
         """
-        pathname = os.path.join(self.config.binary_cache, filename)
+        pathname = self.get_manifest_path(filename)
+        archive_file = os.path.join(self.config.binary_cache, filename)
+        if not os.path.isfile(pathname) and filename.endswith(TARBALL_SUFFIX) and os.path.isfile(archive_file):
+            new_filename = os.path.join('v%i' % self.config.cache_format_revision, os.path.basename(filename))
+            pathname = self.get_manifest_path(new_filename)
+            if not os.path.isfile(pathname):
+                logger.info("Migrating %s to cache format revision %i ..",
+                            filename, self.config.cache_format_revision)
+                try:
+                    self.migrate(archive_file, pathname)
+                except EnvironmentError as e:
+                    # The archive may have been repacked by another process.
+                    logger.warning("Failed to migrate %s! (%s)", archive_file, e)
         if os.path.isfile(pathname):
             logger.debug("Distribution archive exists in local cache (%s).", pathname)
             return pathname
@@ -61,13 +107,171 @@ class LocalCacheBackend(AbstractCacheBackend):
         :param handle: A file-like object that provides access to the
                        distribution archive.
         """
-        file_in_cache = os.path.join(self.config.binary_cache, filename)
-        logger.debug("Storing distribution archive in local cache: %s", file_in_cache)
-        makedirs(os.path.dirname(file_in_cache))
-        # Stream the contents of the distribution archive to a temporary file
-        # to avoid race conditions (e.g. partial reads) between multiple
-        # processes that are using the local cache at the same time.
-        with AtomicReplace(file_in_cache) as temporary_file:
-            with open(temporary_file, 'wb') as temporary_file_handle:
-                shutil.copyfileobj(handle, temporary_file_handle)
+        manifest_file = self.get_manifest_path(filename)
+        logger.debug("Storing distribution archive in local cache: %s", manifest_file)
+        # The manifest is written to a temporary file and moved into place
+        # atomically to avoid race conditions (e.g. partial reads) between
+        # multiple processes that are using the local cache at the same time.
+        write_manifest(manifest_file, iter_archive_members(handle), self.config)
         logger.debug("Finished caching distribution archive in local cache.")
+
+    def put_members(self, filename, members, archive=None):
+        """
+        Store a newly built distribution in the local cache without an intermediate archive.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param members: An iterable of tuples with two values each: A
+                        :class:`tarfile.TarInfo` object and a file-like object.
+        :param archive: Refer to :func:`.write_manifest()`.
+        :returns: The pathname of the distribution manifest (a string).
+
+        This is used by :func:`.CacheManager.put_members()` to write freshly
+        built distributions straight into the local cache.
+        """
+        manifest_file = self.get_manifest_path(filename)
+        logger.debug("Storing distribution in local cache: %s", manifest_file)
+        write_manifest(manifest_file, members, self.config, archive)
+        return manifest_file
+
+    def get_manifest_path(self, filename):
+        """
+        Get the pathname of the manifest of a distribution archive.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: The pathname of the manifest in the local cache (a string).
+        """
+        return os.path.join(self.config.binary_cache, get_manifest_name(filename))
+
+    def repack(self, revision=7):
+        """
+        Migrate the distribution archives of an older cache format revision.
+
+        :param revision: The cache format revision to migrate (an integer,
+                         defaults to 7, the last revision that stored complete
+                         ``*.tar.gz`` archives).
+        :returns: A dictionary with the number of migrated archives (the
+                  ``archives`` key) and the disk space used before and after
+                  the migration (the ``before`` and ``after`` keys, in bytes).
+
+        Each archive is stored as a manifest and blobs under the current cache
+        format revision (keeping its checksum file and last modified time, so
+        that cache invalidation keeps working) and is then removed. Archives
+        that were already migrated are simply removed.
+        """
+        old_directory = os.path.join(self.config.binary_cache, 'v%i' % revision)
+        new_directory = 'v%i' % self.config.cache_format_revision
+        stats = dict(archives=0, before=0, after=0)
+        for archive_file in sorted(glob.glob(os.path.join(old_directory, '*%s' % TARBALL_SUFFIX))):
+            filename = os.path.basename(archive_file)
+            manifest_file = self.get_manifest_path(os.path.join(new_directory, filename))
+            logger.info("Repacking %s ..", filename)
+            stats['before'] += os.path.getsize(archive_file)
+            if not os.path.isfile(manifest_file):
+                stats['after'] += self.migrate(archive_file, manifest_file)
+            for pathname in archive_file, '%s.txt' % archive_file:
+                if os.path.isfile(pathname):
+                    os.unlink(pathname)
+            stats['archives'] += 1
+        logger.info("Repacked %s: %s before, %s after (saved %s).",
+                    pluralize(stats['archives'], "distribution archive"),
+                    format_size(stats['before']), format_size(stats['after']),
+                    format_size(stats['before'] - stats['after']))
+        return stats
+
+    def migrate(self, archive_file, manifest_file):
+        """
+        Store a ``*.tar.gz`` archive of an older cache format revision as a manifest and blobs.
+
+        :param archive_file: The pathname of the archive (a string).
+        :param manifest_file: The pathname of the manifest to create (a string).
+        :returns: The number of bytes added to the cache (an integer).
+
+        The checksum file and last modified time of the archive are kept, so
+        that cache invalidation keeps working. The archive itself is left
+        alone (:func:`repack()` removes it).
+        """
+        with open(archive_file, 'rb') as handle:
+            num_bytes = write_manifest(manifest_file, iter_archive_members(handle), self.config)
+        checksum_file = '%s.txt' % archive_file
+        if os.path.isfile(checksum_file):
+            shutil.copy(checksum_file, '%s.txt' % manifest_file)
+        info = os.stat(archive_file)
+        os.utime(manifest_file, (info.st_atime, info.st_mtime))
+        return num_bytes
+
+    def lock(self, filename):
+        """
+        Get an advisory file lock for a distribution archive in the local cache.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`FileLock` object or :data:`None` on platforms
+                  without support for advisory file locking.
+        """
+        if fcntl is not None:
+            return FileLock(os.path.join(self.config.binary_cache, '%s.lock' % filename))
+
+
+class FileLock(object):
+
+    """
+    Advisory file lock based on :func:`fcntl.flock()`.
+
+    The lock is tied to an open file descriptor, which means the operating
+    system releases the lock when the process holding it dies. This makes
+    stale locks left behind by crashed or killed builds a non-issue. The lock
+    file itself is never removed (removing it could enable two processes to
+    hold "the same" lock at the same time) but it's truncated on release. While
+    the lock is held the lock file contains the process ID and host name of
+    the holder, to help operators figure out who everyone is waiting for.
+    """
+
+    def __init__(self, pathname):
+        """
+        Initialize a :class:`FileLock` object.
+
+        :param pathname: The pathname of the lock file (a string).
+        """
+        self.pathname = pathname
+        self.handle = None
+
+    def acquire(self, blocking=True):
+        """
+        Acquire the lock.
+
+        :param blocking: :data:`True` to wait until the lock is available,
+                         :data:`False` to give up when another process holds
+                         the lock.
+        :returns: :data:`True` when the lock was acquired, :data:`False` when
+                  `blocking` is :data:`False` and another process holds the
+                  lock.
+        """
+        makedirs(os.path.dirname(self.pathname))
+        self.handle = open(self.pathname, 'a+')
+        try:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                raise
+            if not blocking:
+                self.handle.close()
+                self.handle = None
+                return False
+            self.handle.seek(0)
+            holder = self.handle.read().strip() or "another process"
+            logger.info("Waiting for %s to finish building %s ..", holder, os.path.basename(self.pathname)[:-5])
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+        self.handle.seek(0)
+        self.handle.truncate()
+        self.handle.write("process %i on %s" % (os.getpid(), socket.gethostname()))
+        self.handle.flush()
+        return True
+
+    def release(self):
+        """Release the lock."""
+        if self.handle is not None:
+            self.handle.seek(0)
+            self.handle.truncate()
+            self.handle.flush()
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
@@ -0,0 +1,170 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Negative lookup cache for remote cache backends.
+
+Distribution archives that are missing from a remote cache backend (see
+:attr:`.AbstractCacheBackend.REMOTE`) tend to stay missing, for example
+because a package can't be built on this platform or because the Amazon S3
+cache backend is used in read only mode. Without a record of these misses
+every run asks the remote cache backend about the same distribution archives
+(once for every cache format revision that can be read).
+
+The :class:`.CacheManager` records the misses of remote cache backends in a
+:class:`MissCache` and skips the lookups of distribution archives that were
+missing less than :attr:`.Config.cache_miss_ttl` seconds ago. A recorded miss
+is forgotten before it expires when:
+
+- This host uploads the distribution archive to the cache backend (see
+  :func:`.CacheManager.put_backend()`).
+
+- The index of the cache backend lists the distribution archive (see
+  :func:`.AbstractCacheBackend.is_indexed()`).
+
+- The lock of the distribution archive is acquired after waiting for another
+  holder (see :func:`.CacheManager.forget_misses()`), because while waiting
+  for the lock another process may have uploaded the distribution archive.
+
+The misses are stored as a small JSON document in the data directory (see
+:attr:`.Config.data_directory`).
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+import threading
+import time
+
+# Modules included in our package.
+from pip_accel.utils import AtomicReplace, makedirs
+
+# External dependencies.
+from cached_property import cached_property
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 1000
+"""The maximum number of misses remembered per cache backend (an integer, the oldest misses are forgotten first)."""
+
+
+class MissCache(object):
+
+    """Persistent record of distribution archives that are missing from remote cache backends."""
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`MissCache` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        self.config = config
+        self.lock = threading.Lock()
+
+    @cached_property
+    def filename(self):
+        """The pathname of the JSON document that stores the misses (a string)."""
+        return os.path.join(self.config.data_directory, 'cache-misses.json')
+
+    @cached_property
+    def entries(self):
+        """
+        The recorded misses (a dictionary).
+
+        The keys are the class names of cache backends and the values are
+        dictionaries that map the filenames of distribution archives to the
+        times the misses were recorded. Loaded on first use.
+        """
+        return self.load()
+
+    def is_missing(self, backend, filename):
+        """
+        Check whether a distribution archive is known to be missing from a cache backend.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        :returns: :data:`True` if a miss was recorded less than
+                  :attr:`.Config.cache_miss_ttl` seconds ago, :data:`False`
+                  otherwise.
+        """
+        if self.config.cache_miss_ttl > 0:
+            with self.lock:
+                timestamp = self.entries.get(backend.__class__.__name__, {}).get(filename)
+            return timestamp is not None and time.time() - timestamp < self.config.cache_miss_ttl
+        return False
+
+    def record(self, backend, filename):
+        """
+        Remember that a distribution archive is missing from a cache backend.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        """
+        if self.config.cache_miss_ttl > 0:
+            self.update(backend, filename, time.time())
+
+    def forget(self, backend, filename):
+        """
+        Forget that a distribution archive was missing from a cache backend.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        """
+        if self.config.cache_miss_ttl > 0:
+            self.update(backend, filename, None)
+
+    def update(self, backend, filename, timestamp):
+        """
+        Update the record of a miss and store the record in the data directory.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        :param timestamp: The time of the miss (a number) or :data:`None` to
+                          forget the miss.
+
+        The record is reloaded before it's updated so that the misses recorded
+        by other pip-accel processes aren't lost. Expired misses are removed.
+        """
+        with self.lock:
+            entries = self.load()
+            misses = entries.setdefault(backend.__class__.__name__, {})
+            if timestamp is not None:
+                misses[filename] = timestamp
+            elif misses.pop(filename, None) is None:
+                self.entries = entries
+                return
+            cutoff = time.time() - self.config.cache_miss_ttl
+            for name in list(entries):
+                newest = sorted((fn for fn, ts in entries[name].items() if ts > cutoff),
+                                key=lambda fn: entries[name][fn], reverse=True)
+                entries[name] = dict((fn, entries[name][fn]) for fn in newest[:MAX_ENTRIES])
+            self.entries = entries
+            try:
+                makedirs(os.path.dirname(self.filename))
+                with AtomicReplace(self.filename) as temporary_file:
+                    with open(temporary_file, 'w') as handle:
+                        json.dump(entries, handle)
+            except (IOError, OSError) as e:
+                logger.debug("Failed to save cache misses to %s! (%s)", self.filename, e)
+
+    def load(self):
+        """
+        Load the misses stored in the data directory.
+
+        :returns: A dictionary like :attr:`entries` (empty when the misses
+                  can't be loaded).
+        """
+        try:
+            with open(self.filename) as handle:
+                entries = json.load(handle)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
@@ -3,7 +3,7 @@
 # Authors:
 #  - Adam Feuer <adam@adamfeuer.com>
 #  - Peter Odding <peter.odding@paylogic.com>
-# Last Change: March 4, 2016
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 #
 # A word of warning: Do *not* use the cached_property decorator here, because
@@ -83,6 +83,93 @@ Optionally if you are using read only credentials you can disable
 :class:`~S3CacheBackend.put()` operations by setting the configuration
 option :attr:`~.Config.s3_cache_readonly`.
 
+Uploads happen in the background (see :mod:`pip_accel.caches.uploads`) so
+installation doesn't have to wait for them. When an upload fails the S3 cache
+backend falls back to read only mode for the rest of the run and the upload
+is retried by the next run.
+
+Prefetching
+-----------
+
+Before pip-accel installs a requirement set it asks the cache backends to
+prefetch the binary distributions that aren't cached locally yet (see
+:func:`.CacheManager.prefetch()`). The S3 cache backend looks up and downloads
+these archives concurrently using a bounded pool of threads (see
+:attr:`~.Config.s3_cache_prefetch_threads`) where each thread uses its own
+connection to S3, so a fresh container doesn't have to make two sequential
+requests for every package.
+
+Cache index
+-----------
+
+Without an index every cache lookup costs a request to S3, even when the
+distribution archive isn't there. When :attr:`~.Config.s3_cache_index` is
+enabled (the default) the S3 cache backend maintains an index object in the
+bucket (see :class:`S3CacheIndex`) that lists the available distribution
+archives with their size, SHA1 digest and the time they were uploaded:
+
+- The index is fetched once per run. The last version that was fetched is
+  kept in :attr:`~.Config.data_directory`, so the index is only downloaded
+  again when its ETag has changed (using a conditional ``GET`` request).
+
+- Cache hits and misses for the whole requirement set are answered from the
+  index. Cache hits are downloaded without checking for their existence first.
+
+- After an upload the index is updated using compare-and-swap: The index is
+  written using a conditional ``PUT`` request (which fails when another
+  process changed the index in the meantime) and read back to check that
+  the update wasn't lost (because not all S3 compatible services support
+  conditional ``PUT`` requests). Conflicting updates are retried.
+
+When the index doesn't exist yet it's created by listing the distribution
+archives in the bucket, this is also how you can rebuild the index (just
+delete it). Distribution archives that are missing from the index (e.g.
+because they were uploaded by older versions of pip-accel) are considered
+cache misses: They're rebuilt once and then added to the index.
+
+In read only mode (see :attr:`~.Config.s3_cache_readonly`) a missing index
+can't be created. The listing of the bucket is kept in
+:attr:`~.Config.data_directory` instead and reused for
+:attr:`~.Config.s3_cache_listing_ttl` seconds. Such a listing only answers
+cache hits: Distribution archives that it doesn't list (e.g. because they were
+uploaded after the bucket was listed) are looked up using a ``HEAD`` request.
+
+Large archives
+--------------
+
+Distribution archives of at least :attr:`~.Config.s3_cache_multipart_threshold`
+bytes are transferred in parts of :attr:`~.Config.s3_cache_part_size` bytes
+using :attr:`~.Config.s3_cache_transfer_threads` threads (each with its own
+connection to S3): Uploads use the S3 multipart upload API and downloads use
+ranged ``GET`` requests whose responses are written to their offsets in the
+temporary file, so the parts end up in order regardless of which part
+finishes first.
+
+Build leases
+------------
+
+When a fleet of build agents shares an S3 bucket they will often miss the same
+new binary distribution at the same moment, and without coordination each of
+them would build it. When :attr:`~.Config.s3_cache_lease_ttl` is set the S3
+cache backend provides build leases (see :class:`S3Lease`) that work as
+follows:
+
+1. An agent that misses a binary distribution checks for a lease object (the
+   cache key of the distribution archive with the suffix ``.lease``).
+
+2. When there's no lease or the lease has expired the agent writes its own
+   lease, waits a moment and reads the lease back. If the lease still belongs
+   to the agent it builds the binary distribution, renewing the lease while
+   the build runs and deleting it when the archive has been uploaded.
+
+3. When another agent holds a live lease the agent polls for the distribution
+   archive instead of building it.
+
+S3 doesn't offer atomic "create if not exists" operations so two agents can
+still (rarely) end up building the same binary distribution, which is no worse
+than not using leases at all. Only plain ``GET``, ``PUT`` and ``DELETE``
+requests are used, so this works with S3 compatible services like FakeS3_.
+
 ----
 
 .. _FakeS3: https://github.com/jubos/fake-s3
@@ -90,17 +177,30 @@ option :attr:`~.Config.s3_cache_readonly`.
 """
 
 # Standard library modules.
+import calendar
+import hashlib
+import json
 import logging
 import os
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 
 # External dependencies.
-from humanfriendly import coerce_boolean, Timer
+from humanfriendly import coerce_boolean, format_size, format_timespan, pluralize, Timer
 
 # Modules included in our package.
 from pip_accel import PatchedAttribute
 from pip_accel.caches import AbstractCacheBackend
+from pip_accel.caches.local import LocalCacheBackend
 from pip_accel.compat import PY3, urlparse
-from pip_accel.exceptions import CacheBackendDisabledError, CacheBackendError
+from pip_accel.exceptions import CacheBackendDisabledError, CacheBackendError, CorruptArchiveError
 from pip_accel.utils import AtomicReplace, makedirs
 
 # Initialize a logger for this module.
@@ -116,6 +216,12 @@ BOTO_CONFIG_NUM_RETRIES_OPTION = 'num_retries'
 # The name of the boto.config option that controls the HTTP socket timeout.
 BOTO_CONFIG_SOCKET_TIMEOUT_OPTION = 'http_socket_timeout'
 
+# The filename of the cache index object (see S3CacheIndex).
+INDEX_FILENAME = 'index.json'
+
+# The number of attempts to update the cache index when updates conflict.
+INDEX_UPDATE_ATTEMPTS = 5
+
 # The `coloredlogs' package installs a logging handler on the root logger which
 # means all loggers automatically write their log messages to the standard
 # error stream. In the case of Boto this is a bit confusing because Boto logs
@@ -140,6 +246,19 @@ class S3CacheBackend(AbstractCacheBackend):
 
     PRIORITY = 20
 
+    REMOTE = True
+
+    def __init__(self, config):
+        """
+        Initialize an :class:`S3CacheBackend` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        """
+        super(S3CacheBackend, self).__init__(config)
+        self.connections = threading.local()
+        self.workers = threading.local()
+
     def get(self, filename):
         """
         Download a distribution archive from the configured Amazon S3 bucket.
@@ -152,30 +271,288 @@ class S3CacheBackend(AbstractCacheBackend):
         timer = Timer()
         self.check_prerequisites()
         with PatchedBotoConfig():
+            from boto.exception import S3ResponseError
             # Check if the distribution archive is available.
             raw_key = self.get_cache_key(filename)
             logger.info("Checking if distribution archive is available in S3 bucket: %s", raw_key)
-            key = self.s3_bucket.get_key(raw_key)
+            key = self.find_key(filename)
             if key is None:
                 logger.debug("Distribution archive is not available in S3 bucket.")
             else:
-                # Download the distribution archive to the local binary index.
-                # TODO Shouldn't this use LocalCacheBackend.put() instead of
-                #      implementing the same steps manually?!
                 logger.info("Downloading distribution archive from S3 bucket ..")
-                file_in_cache = os.path.join(self.config.binary_cache, filename)
-                makedirs(os.path.dirname(file_in_cache))
-                with AtomicReplace(file_in_cache) as temporary_file:
-                    key.get_contents_to_filename(temporary_file)
+                try:
+                    pathname = self.download(key, filename)
+                except S3ResponseError as e:
+                    if e.status != 404:
+                        raise
+                    logger.warning("Distribution archive listed in S3 cache index is missing from bucket: %s",
+                                   raw_key)
+                    return None
+                except CorruptArchiveError as e:
+                    # The archive will be built and uploaded again.
+                    logger.warning("Ignoring corrupt distribution archive in S3 bucket: %s (%s)", raw_key, e)
+                    return None
                 logger.debug("Finished downloading distribution archive from S3 bucket in %s.", timer)
-                return file_in_cache
+                return pathname
+
+    def prefetch(self, filenames):
+        """
+        Download distribution archives from the configured Amazon S3 bucket concurrently.
+
+        :param filenames: The filenames of the distribution archives (a list
+                          of strings).
+        :returns: A set with the filenames of the distribution archives that
+                  were downloaded to the local cache.
+        :raises: :exc:`.CacheBackendDisabledError` when the Amazon S3 cache
+                 backend isn't configured.
+
+        Each thread uses its own connection (see :attr:`worker`). Failures to
+        download individual archives are logged and otherwise ignored,
+        :func:`get()` will try again later.
+        """
+        self.check_prerequisites()
+        if not (filenames and self.config.s3_cache_prefetch_threads > 0):
+            return set()
+        timer = Timer()
+        # Answer the cache misses for all of the archives using the cache
+        # index (before the worker threads start using it).
+        if self.index.entries is not None and self.index.complete:
+            filenames = [fn for fn in filenames if fn in self.index.entries]
+            if not filenames:
+                return set()
+
+        def fetch(filename):
+            try:
+                with PatchedBotoConfig():
+                    key = self.worker.find_key(filename)
+                    if key is not None:
+                        self.worker.download(key, filename)
+                        return key.size or 0
+            except Exception as e:
+                logger.warning("Failed to prefetch %s from S3 bucket! (%s)", filename, e)
+
+        logger.info("Checking S3 bucket for %s ..", pluralize(len(filenames), "distribution archive"))
+        pool = ThreadPool(min(len(filenames), self.config.s3_cache_prefetch_threads))
+        try:
+            sizes = pool.map(fetch, filenames)
+        finally:
+            pool.close()
+            pool.join()
+        downloaded = set(fn for fn, size in zip(filenames, sizes) if size is not None)
+        if downloaded:
+            total_size = sum(size for size in sizes if size is not None)
+            logger.info("Prefetched %s (%s) from S3 bucket in %s (%s per second).",
+                        pluralize(len(downloaded), "distribution archive"),
+                        format_size(total_size), timer,
+                        format_size(total_size / max(timer.elapsed_time, 0.001)))
+        return downloaded
+
+    def find_key(self, filename):
+        """
+        Find a distribution archive in the Amazon S3 bucket.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`boto.s3.key.Key` object or :data:`None` when the
+                  distribution archive isn't available.
+
+        When the cache index is available (see :attr:`index`) it's used to
+        answer the question without talking to S3, otherwise the existence
+        of the distribution archive is checked using a ``HEAD`` request. A
+        listing of the bucket (see :attr:`S3CacheIndex.complete`) only
+        answers cache hits, archives that it doesn't list are also checked
+        using a ``HEAD`` request.
+        """
+        raw_key = self.get_cache_key(filename)
+        entries = self.index.entries
+        entry = entries.get(filename) if entries is not None else None
+        if entry is not None:
+            from boto.s3.key import Key
+            key = Key(self.s3_bucket, raw_key)
+            key.size = entry['size']
+            return key
+        if entries is None or not self.index.complete:
+            return self.s3_bucket.get_key(raw_key)
+
+    def is_indexed(self, filename):
+        """
+        Check whether the cache index lists a distribution archive.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: :data:`True` if the cache index (see :attr:`index`) lists
+                  the distribution archive, :data:`False` otherwise.
+        """
+        entries = self.index.entries
+        return entries is not None and filename in entries
+
+    @property
+    def index(self):
+        """
+        The cache index of the Amazon S3 bucket (a :class:`S3CacheIndex` object).
+
+        Worker threads (see :attr:`worker`) share the cache index of the
+        backend that created them, so the index is fetched only once.
+        """
+        if not hasattr(self, 'cached_index'):
+            self.cached_index = S3CacheIndex(self)
+        return self.cached_index
+
+    def download(self, key, filename):
+        """
+        Download a distribution archive from the Amazon S3 bucket to the local cache.
+
+        :param key: The :class:`boto.s3.key.Key` of the distribution archive.
+        :param filename: The filename of the distribution archive (a string).
+        :returns: The pathname of the distribution archive in the local cache
+                  (a string).
+        """
+        # Download the distribution archive to a temporary file and add it
+        # to the local cache (which may store it in a different format, see
+        # pip_accel.archives).
+        local_cache = LocalCacheBackend(self.config)
+        fd, temporary_file = tempfile.mkstemp(prefix='pip-accel-s3-')
+        try:
+            self.download_to_file(key, temporary_file)
+            with open(temporary_file, 'rb') as handle:
+                local_cache.put(filename, handle)
+        finally:
+            os.close(fd)
+            os.unlink(temporary_file)
+        return local_cache.get(filename)
+
+    def download_to_file(self, key, pathname):
+        """
+        Download an object from the Amazon S3 bucket to a file.
+
+        :param key: The :class:`boto.s3.key.Key` of the object.
+        :param pathname: The pathname of the file to write (a string).
+        :raises: :exc:`.CacheBackendError` when a ranged download returns
+                 the wrong number of bytes.
+
+        Large objects (see :func:`use_parts()`) are downloaded using
+        concurrent ranged ``GET`` requests, each part is written to its own
+        offset in the file.
+        """
+        size = key.size or 0
+        if not self.use_parts(size):
+            key.get_contents_to_filename(pathname)
+            return
+        from boto.s3.key import Key
+        with open(pathname, 'wb') as handle:
+            handle.truncate(size)
+        part_size = self.config.s3_cache_part_size
+
+        def download_part(offset):
+            end = min(offset + part_size, size) - 1
+            with PatchedBotoConfig():
+                part_key = Key(self.worker.s3_bucket, key.name)
+                data = part_key.get_contents_as_string(headers=dict(Range='bytes=%i-%i' % (offset, end)))
+            if len(data) != end - offset + 1:
+                raise CacheBackendError("""
+                    Ranged download of {key} returned {actual} bytes instead
+                    of {expected} bytes!
+                """, key=key.name, actual=len(data), expected=end - offset + 1)
+            with open(pathname, 'r+b') as handle:
+                handle.seek(offset)
+                handle.write(data)
+
+        self.run_parts(download_part, list(range(0, size, part_size)))
+
+    def upload(self, raw_key, handle):
+        """
+        Upload a file-like object to the Amazon S3 bucket.
+
+        :param raw_key: The key of the object in the bucket (a string).
+        :param handle: A seekable file-like object.
+
+        Large objects (see :func:`use_parts()`) are uploaded using the S3
+        multipart upload API, the parts are uploaded concurrently. When a
+        part fails the multipart upload is cancelled.
+        """
+        from boto.s3.key import Key
+        from boto.s3.multipart import MultiPartUpload
+        handle.seek(0, os.SEEK_END)
+        size = handle.tell()
+        handle.seek(0)
+        if not self.use_parts(size):
+            key = Key(self.s3_bucket)
+            key.key = raw_key
+            key.set_contents_from_file(handle)
+            return
+        part_size = self.config.s3_cache_part_size
+        upload = self.s3_bucket.initiate_multipart_upload(raw_key)
+        lock = threading.Lock()
+
+        def upload_part(offset):
+            with lock:
+                handle.seek(offset)
+                data = handle.read(part_size)
+            with PatchedBotoConfig():
+                part_upload = MultiPartUpload(self.worker.s3_bucket)
+                part_upload.key_name = upload.key_name
+                part_upload.id = upload.id
+                part_upload.upload_part_from_file(BytesIO(data), offset // part_size + 1, size=len(data))
+
+        try:
+            self.run_parts(upload_part, list(range(0, size, part_size)))
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+
+    def use_parts(self, size):
+        """
+        Check whether an object should be transferred in parts.
+
+        :param size: The size of the object in bytes (an integer).
+        :returns: :data:`True` if the object is at least
+                  :attr:`~.Config.s3_cache_multipart_threshold` bytes and
+                  larger than a single part, :data:`False` otherwise.
+        """
+        threshold = self.config.s3_cache_multipart_threshold
+        return threshold > 0 and size >= threshold and size > self.config.s3_cache_part_size
+
+    def run_parts(self, function, offsets):
+        """
+        Transfer the parts of an object concurrently.
+
+        :param function: A callable that transfers the part at the given
+                         offset (runs in a worker thread).
+        :param offsets: The offsets of the parts (a list of integers).
+        :raises: The first exception raised by `function`.
+        """
+        timer = Timer()
+        pool = ThreadPool(min(len(offsets), self.config.s3_cache_transfer_threads))
+        try:
+            pool.map(function, offsets)
+        finally:
+            pool.close()
+            pool.join()
+        logger.debug("Transferred %s in %s.", pluralize(len(offsets), "part"), timer)
+
+    @property
+    def worker(self):
+        """
+        The :class:`S3CacheBackend` object of the current thread.
+
+        Boto connections can't be shared between threads, so the threads that
+        prefetch distribution archives and transfer parts of large archives
+        each get their own :class:`S3CacheBackend` object (with its own
+        connection), which is created on first use.
+        """
+        if not hasattr(self.workers, 'backend'):
+            self.workers.backend = S3CacheBackend(self.config)
+            self.workers.backend.cached_index = self.index
+        return self.workers.backend
 
     def put(self, filename, handle):
         """
         Upload a distribution archive to the configured Amazon S3 bucket.
 
         If the :attr:`~.Config.s3_cache_readonly` configuration option is
-        enabled this method does nothing.
+        enabled this method does nothing. When the upload fails the S3 cache
+        backend falls back to read only mode (for the rest of the run) and
+        the exception is propagated so that the :class:`.UploadQueue` can
+        retry the upload later.
 
         :param filename: The filename of the distribution archive (a string).
         :param handle: A file-like object that provides access to the
@@ -188,19 +565,34 @@ class S3CacheBackend(AbstractCacheBackend):
             timer = Timer()
             self.check_prerequisites()
             with PatchedBotoConfig():
-                from boto.s3.key import Key
                 raw_key = self.get_cache_key(filename)
                 logger.info("Uploading distribution archive to S3 bucket: %s", raw_key)
-                key = Key(self.s3_bucket)
-                key.key = raw_key
                 try:
-                    key.set_contents_from_file(handle)
+                    self.upload(raw_key, handle)
                 except Exception as e:
                     logger.info("Encountered error writing to S3 bucket, "
                                 "falling back to read only mode (exception: %s)", e)
                     self.config.s3_cache_readonly = True
+                    raise
                 else:
                     logger.info("Finished uploading distribution archive to S3 bucket in %s.", timer)
+                if self.config.s3_cache_index:
+                    self.index.add(filename, handle)
+
+    def lock(self, filename):
+        """
+        Get a build lease for a distribution archive in the Amazon S3 bucket.
+
+        :param filename: The filename of the distribution archive (a string).
+        :returns: A :class:`S3Lease` object or :data:`None` when build leases
+                  are disabled (see :attr:`~.Config.s3_cache_lease_ttl`) or
+                  the S3 bucket is read only.
+        :raises: :exc:`.CacheBackendDisabledError` when the Amazon S3 cache
+                 backend isn't configured.
+        """
+        if self.config.s3_cache_lease_ttl > 0 and not self.config.s3_cache_readonly:
+            self.check_prerequisites()
+            return S3Lease(self, filename)
 
     @property
     def s3_bucket(self):
@@ -208,7 +600,9 @@ class S3CacheBackend(AbstractCacheBackend):
         Connect to the user defined Amazon S3 bucket.
 
         Called on demand by :func:`get()` and :func:`put()`. Caches its
-        return value so that only a single connection is created.
+        return value per thread, because the builder and installer threads of
+        a :class:`.Pipeline` share the cache backend and Boto connections
+        can't be shared between threads.
 
         :returns: A :class:`boto.s3.bucket.Bucket` object.
         :raises: :exc:`.CacheBackendDisabledError` when the user hasn't
@@ -216,7 +610,7 @@ class S3CacheBackend(AbstractCacheBackend):
         :raises: :exc:`.CacheBackendError` when the connection to the Amazon
                  S3 bucket fails.
         """
-        if not hasattr(self, 'cached_bucket'):
+        if not hasattr(self.connections, 'bucket'):
             self.check_prerequisites()
             with PatchedBotoConfig():
                 from boto.exception import BotoClientError, BotoServerError, S3ResponseError
@@ -227,13 +621,13 @@ class S3CacheBackend(AbstractCacheBackend):
                     # raised by Boto when an Amazon S3 bucket does not exist.
                     try:
                         logger.debug("Connecting to Amazon S3 bucket: %s", self.config.s3_cache_bucket)
-                        self.cached_bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
+                        self.connections.bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
                     except S3ResponseError as e:
                         if e.status == 404 and self.config.s3_cache_create_bucket:
                             logger.info("Amazon S3 bucket doesn't exist yet, creating it now: %s",
                                         self.config.s3_cache_bucket)
                             self.s3_connection.create_bucket(self.config.s3_cache_bucket)
-                            self.cached_bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
+                            self.connections.bucket = self.s3_connection.get_bucket(self.config.s3_cache_bucket)
                         else:
                             # Don't swallow exceptions we can't handle.
                             raise
@@ -244,7 +638,7 @@ class S3CacheBackend(AbstractCacheBackend):
                         using the provided credentials? The Amazon S3 cache backend
                         will be disabled for now.
                     """, bucket=repr(self.config.s3_cache_bucket))
-        return self.cached_bucket
+        return self.connections.bucket
 
     @property
     def s3_connection(self):
@@ -254,13 +648,13 @@ class S3CacheBackend(AbstractCacheBackend):
         If the connection attempt fails because Boto can't find credentials the
         attempt is retried once with an anonymous connection.
 
-        Called on demand by :attr:`s3_bucket`.
+        Called on demand by :attr:`s3_bucket` (once per thread).
 
         :returns: A :class:`boto.s3.connection.S3Connection` object.
         :raises: :exc:`.CacheBackendError` when the connection to the Amazon
                  S3 API fails.
         """
-        if not hasattr(self, 'cached_connection'):
+        if not hasattr(self.connections, 'connection'):
             self.check_prerequisites()
             with PatchedBotoConfig():
                 import boto
@@ -289,17 +683,17 @@ class S3CacheBackend(AbstractCacheBackend):
                                         else OrdinaryCallingFormat()),
                     )
                     try:
-                        self.cached_connection = S3Connection(**kw)
+                        self.connections.connection = S3Connection(**kw)
                     except NoAuthHandlerFound:
                         logger.debug("Amazon S3 API credentials missing, retrying with anonymous connection ..")
-                        self.cached_connection = S3Connection(anon=True, **kw)
+                        self.connections.connection = S3Connection(anon=True, **kw)
                 except (BotoClientError, BotoServerError):
                     raise CacheBackendError("""
                         Failed to connect to the Amazon S3 API! Most likely your
                         credentials are not correctly configured. The Amazon S3
                         cache backend will be disabled for now.
                     """)
-        return self.cached_connection
+        return self.connections.connection
 
     def get_cache_key(self, filename):
         """
@@ -337,6 +731,448 @@ class S3CacheBackend(AbstractCacheBackend):
             """)
 
 
+class S3Lease(object):
+
+    """
+    Short lived lease on building a distribution archive, stored in Amazon S3.
+
+    Refer to the section on build leases in the documentation of the
+    :mod:`pip_accel.caches.s3` module for an overview. Problems talking to S3
+    never prevent a build, they just result in the build running without a
+    lease.
+    """
+
+    def __init__(self, backend, filename):
+        """
+        Initialize an :class:`S3Lease` object.
+
+        :param backend: The :class:`S3CacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        """
+        self.backend = backend
+        self.config = backend.config
+        self.filename = filename
+        self.archive_key = backend.get_cache_key(filename)
+        self.lease_key = '%s.lease' % self.archive_key
+        self.holder = "process %i on %s" % (os.getpid(), socket.gethostname())
+        self.token = uuid.uuid4().hex
+        self.stopped = threading.Event()
+        self.renewer = None
+
+    @property
+    def s3_bucket(self):
+        """
+        The Amazon S3 bucket for the calling thread (a :class:`boto.s3.bucket.Bucket` object).
+
+        Leases are renewed by a separate thread and Boto connections aren't
+        thread safe, so each thread talks to S3 using its own connection (see
+        :attr:`S3CacheBackend.worker`).
+        """
+        return self.backend.worker.s3_bucket
+
+    @property
+    def poll_interval(self):
+        """The number of seconds between polls for the lease and the archive (a number)."""
+        return min(5.0, max(0.5, self.config.s3_cache_lease_ttl / 10.0))
+
+    def acquire(self, blocking=True):
+        """
+        Acquire the lease or wait for the distribution archive to be uploaded.
+
+        :param blocking: :data:`True` to wait while another process holds the
+                         lease, :data:`False` to give up instead.
+        :returns: :data:`False` when `blocking` is :data:`False` and another
+                  process holds the lease, :data:`True` otherwise.
+
+        This method returns when the lease is held by the caller or when the
+        distribution archive is available in the S3 bucket (in which case the
+        caller won't need to build it).
+        """
+        try:
+            waiting = False
+            while not self.archive_exists():
+                lease = self.read_lease()
+                if lease and lease.get('token') != self.token and lease.get('expires', 0) > time.time():
+                    if not blocking:
+                        return False
+                    if not waiting:
+                        logger.info("Waiting for %s to finish building %s (found S3 build lease) ..",
+                                    lease.get('holder', "another process"), self.filename)
+                        waiting = True
+                    time.sleep(self.poll_interval)
+                    continue
+                # Claim the lease, then make sure no one else claimed it at
+                # the same time (the last writer wins).
+                self.write_lease()
+                time.sleep(min(2.0, self.poll_interval))
+                lease = self.read_lease()
+                if lease and lease.get('token') == self.token:
+                    logger.debug("Acquired S3 build lease %s.", self.lease_key)
+                    self.renewer = threading.Thread(target=self.renew_lease, name='pip-accel-s3-lease')
+                    self.renewer.daemon = True
+                    self.renewer.start()
+                    return True
+        except Exception as e:
+            logger.warning("Failed to acquire S3 build lease for %s, building without it! (%s)", self.filename, e)
+        return True
+
+    def release(self):
+        """Release the lease (if it's held by the caller)."""
+        if self.renewer is not None:
+            self.stopped.set()
+            self.renewer.join()
+            self.renewer = None
+            try:
+                lease = self.read_lease()
+                if lease and lease.get('token') == self.token:
+                    with PatchedBotoConfig():
+                        self.s3_bucket.delete_key(self.lease_key)
+                    logger.debug("Released S3 build lease %s.", self.lease_key)
+            except Exception as e:
+                logger.warning("Failed to release S3 build lease %s! (%s)", self.lease_key, e)
+
+    def renew_lease(self):
+        """Renew the lease until it's released (runs in a separate thread)."""
+        while True:
+            self.stopped.wait(self.config.s3_cache_lease_ttl / 3.0)
+            if self.stopped.is_set():
+                break
+            try:
+                self.write_lease()
+            except Exception as e:
+                logger.warning("Failed to renew S3 build lease %s! (%s)", self.lease_key, e)
+
+    def archive_exists(self):
+        """Check whether the distribution archive is available in the S3 bucket."""
+        with PatchedBotoConfig():
+            key = self.s3_bucket.get_key(self.archive_key)
+        if key is not None:
+            # The cache index may have been fetched before the archive was
+            # uploaded by another process.
+            self.backend.index.remember(self.filename, dict(built=int(time.time()), digest=None, size=key.size))
+        return key is not None
+
+    def read_lease(self):
+        """
+        Read the current lease from the S3 bucket.
+
+        :returns: A dictionary with the lease details or :data:`None` when
+                  there's no (valid) lease.
+        """
+        with PatchedBotoConfig():
+            key = self.s3_bucket.get_key(self.lease_key)
+            if key is not None:
+                try:
+                    lease = json.loads(key.get_contents_as_string().decode('UTF-8'))
+                    if isinstance(lease, dict):
+                        return lease
+                except ValueError:
+                    pass
+
+    def write_lease(self):
+        """Write (or renew) the caller's lease in the S3 bucket."""
+        with PatchedBotoConfig():
+            from boto.s3.key import Key
+            key = Key(self.s3_bucket)
+            key.key = self.lease_key
+            key.set_contents_from_string(json.dumps(dict(
+                expires=time.time() + self.config.s3_cache_lease_ttl,
+                holder=self.holder,
+                token=self.token,
+            )))
+
+
+class S3CacheIndex(object):
+
+    """
+    Index of the distribution archives in the Amazon S3 bucket.
+
+    Refer to the section on the cache index in the documentation of the
+    :mod:`pip_accel.caches.s3` module for an overview. Problems talking to S3
+    never prevent the S3 cache backend from working, they just result in
+    lookups of individual distribution archives (when the index can't be
+    loaded) or in missing index entries (when the index can't be updated).
+    """
+
+    # Serializes writes to the local copy of the index, which are done by
+    # the upload thread as well as the main thread (AtomicReplace uses the
+    # process id to name its temporary file).
+    local_copy_lock = threading.Lock()
+
+    def __init__(self, backend):
+        """
+        Initialize an :class:`S3CacheIndex` object.
+
+        :param backend: The :class:`S3CacheBackend` object.
+        """
+        self.backend = backend
+        self.config = backend.config
+        self.index_key = backend.get_cache_key(INDEX_FILENAME)
+        self.lock = threading.Lock()
+        self.authoritative = False
+
+    @property
+    def entries(self):
+        """
+        The distribution archives listed in the cache index (a dictionary or :data:`None`).
+
+        The keys of the dictionary are the filenames of the distribution
+        archives and the values are dictionaries with the keys ``built`` (the
+        time of the upload, a Unix timestamp), ``digest`` (the SHA1 digest
+        of the archive, :data:`None` for archives that were found by listing
+        the bucket) and ``size`` (the size of the archive in bytes). The index
+        is fetched on first use (see :func:`load()`). The value is
+        :data:`None` when :attr:`~.Config.s3_cache_index` is disabled or the
+        index couldn't be loaded.
+        """
+        with self.lock:
+            if not hasattr(self, 'cached_entries'):
+                self.cached_entries = self.load() if self.config.s3_cache_index else None
+            return self.cached_entries
+
+    @property
+    def complete(self):
+        """
+        :data:`True` if :attr:`entries` lists all distribution archives, :data:`False` otherwise.
+
+        This is :data:`False` when :attr:`entries` is a (possibly outdated)
+        listing of the bucket because the index object doesn't exist and
+        couldn't be created (see :func:`load()`). Distribution archives that
+        aren't listed are then looked up individually (see
+        :func:`S3CacheBackend.find_key()`).
+        """
+        return self.entries is not None and self.authoritative
+
+    @property
+    def location(self):
+        """The bucket and key of the cache index (a string)."""
+        return '%s/%s' % (self.config.s3_cache_bucket, self.index_key)
+
+    @property
+    def local_copy(self):
+        """The pathname of the local copy of the cache index (a string)."""
+        return os.path.join(self.config.data_directory, 's3-index.json')
+
+    def load(self):
+        """
+        Load the cache index (creating it when it doesn't exist yet).
+
+        :returns: A dictionary like :attr:`entries` or :data:`None` when the
+                  cache index couldn't be loaded.
+
+        When the index object doesn't exist and can't be created (because
+        :attr:`~.Config.s3_cache_readonly` is set or another process created
+        it at the same time) a listing of the bucket is returned and
+        :attr:`complete` is :data:`False`. In read only mode the listing is
+        reused for :attr:`~.Config.s3_cache_listing_ttl` seconds (see
+        :func:`read_listing()`).
+        """
+        timer = Timer()
+        try:
+            entries, etag = self.fetch(revalidate=True)
+            self.authoritative = etag is not None
+            if etag is None:
+                entries = self.read_listing() if self.config.s3_cache_readonly else None
+                if entries is None:
+                    logger.info("S3 cache index doesn't exist yet, listing distribution archives in S3 bucket ..")
+                    entries = self.list_archives()
+                    if self.config.s3_cache_readonly:
+                        self.write_local_copy(entries, None)
+                    else:
+                        try:
+                            self.write(entries, None)
+                            self.authoritative = True
+                        except Exception as e:
+                            logger.debug("Failed to create S3 cache index (another process may have beaten us): %s",
+                                         e)
+            logger.debug("Loaded S3 cache index of %s in %s.",
+                         pluralize(len(entries), "distribution archive"), timer)
+            return entries
+        except Exception as e:
+            logger.warning("Failed to load S3 cache index, checking distribution archives one by one! (%s)", e)
+            return None
+
+    def add(self, filename, handle):
+        """
+        Add a distribution archive to the cache index (using compare-and-swap).
+
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+
+        Failures are logged and otherwise ignored, the distribution archive
+        simply isn't listed in the index (so it will be rebuilt and uploaded
+        again by a later run).
+        """
+        digest = hashlib.sha1()
+        handle.seek(0)
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(chunk)
+        entry = dict(built=int(time.time()), digest=digest.hexdigest(), size=handle.tell())
+        try:
+            from boto.exception import S3ResponseError
+            for attempt in range(1, INDEX_UPDATE_ATTEMPTS + 1):
+                try:
+                    entries, etag = self.fetch()
+                    if etag is None:
+                        entries = self.list_archives()
+                    entries[filename] = entry
+                    self.write(entries, etag)
+                    # Make sure the update wasn't overwritten by another
+                    # process (in case the conditional PUT was ignored).
+                    entries, etag = self.fetch()
+                    if entries.get(filename) == entry:
+                        logger.debug("Added %s to S3 cache index.", filename)
+                        self.remember(filename, entry)
+                        return
+                    logger.debug("Update of S3 cache index was lost, retrying ..")
+                except S3ResponseError as e:
+                    if e.status not in (409, 412):
+                        raise
+                    logger.debug("Update of S3 cache index conflicted with another process, retrying ..")
+                time.sleep(random.uniform(0.1, 1.0) * attempt)
+            logger.warning("Failed to add %s to S3 cache index after %s!",
+                           filename, pluralize(INDEX_UPDATE_ATTEMPTS, "attempt"))
+        except Exception as e:
+            logger.warning("Failed to add %s to S3 cache index! (%s)", filename, e)
+
+    def remember(self, filename, entry):
+        """
+        Add a distribution archive to the cache index in memory.
+
+        :param filename: The filename of the distribution archive (a string).
+        :param entry: A dictionary like the values of :attr:`entries`.
+        """
+        with self.lock:
+            if getattr(self, 'cached_entries', None) is not None:
+                self.cached_entries[filename] = entry
+
+    def fetch(self, revalidate=False):
+        """
+        Fetch the cache index from the Amazon S3 bucket.
+
+        :param revalidate: :data:`True` to revalidate the local copy of the
+                           index using a conditional ``GET`` request,
+                           :data:`False` to always download the index.
+        :returns: A tuple with two values: A dictionary like :attr:`entries`
+                  and the ETag of the index (a string or :data:`None` when
+                  the index doesn't exist).
+        """
+        from boto.exception import S3ResponseError
+        from boto.s3.key import Key
+        local_copy = self.read_local_copy() if revalidate else None
+        headers = {}
+        if local_copy:
+            headers['If-None-Match'] = local_copy['etag']
+        with PatchedBotoConfig():
+            key = Key(self.backend.s3_bucket, self.index_key)
+            try:
+                data = key.get_contents_as_string(headers=headers)
+            except S3ResponseError as e:
+                if e.status == 304 and local_copy:
+                    logger.debug("S3 cache index hasn't changed since it was last fetched.")
+                    return local_copy['archives'], local_copy['etag']
+                elif e.status == 404:
+                    return {}, None
+                raise
+        entries = json.loads(data.decode('UTF-8'))['archives']
+        self.write_local_copy(entries, key.etag)
+        return entries, key.etag
+
+    def write(self, entries, etag):
+        """
+        Write the cache index to the Amazon S3 bucket using a conditional ``PUT`` request.
+
+        :param entries: A dictionary like :attr:`entries`.
+        :param etag: The ETag of the index that was updated (a string) or
+                     :data:`None` when a new index is created.
+        :raises: :exc:`boto.exception.S3ResponseError` when the index was
+                 changed by another process (on S3 compatible services that
+                 support conditional ``PUT`` requests).
+        """
+        from boto.s3.key import Key
+        headers = {'Content-Type': 'application/json'}
+        if etag:
+            headers['If-Match'] = etag
+        else:
+            headers['If-None-Match'] = '*'
+        with PatchedBotoConfig():
+            key = Key(self.backend.s3_bucket)
+            key.key = self.index_key
+            key.set_contents_from_string(json.dumps(dict(archives=entries), sort_keys=True), headers=headers)
+        self.write_local_copy(entries, key.etag)
+
+    def list_archives(self):
+        """
+        List the distribution archives in the Amazon S3 bucket.
+
+        :returns: A dictionary like :attr:`entries` (without digests).
+        """
+        prefix = '%s/' % self.config.s3_cache_prefix if self.config.s3_cache_prefix else ''
+        entries = {}
+        with PatchedBotoConfig():
+            for key in self.backend.s3_bucket.list(prefix=prefix):
+                filename = key.name[len(prefix):]
+                if re.match(r'^v\d+[/\\]', filename) and not filename.endswith('.lease'):
+                    try:
+                        built = calendar.timegm(time.strptime(key.last_modified[:19], '%Y-%m-%dT%H:%M:%S'))
+                    except (TypeError, ValueError):
+                        built = None
+                    entries[filename] = dict(built=built, digest=None, size=key.size)
+        return entries
+
+    def read_listing(self):
+        """
+        Read a recent listing of the bucket from the local copy of the cache index.
+
+        :returns: A dictionary like :attr:`entries` or :data:`None` when the
+                  local copy isn't a listing of the bucket or the listing is
+                  older than :attr:`~.Config.s3_cache_listing_ttl` seconds.
+        """
+        local_copy = self.read_local_copy(etag_required=False)
+        if local_copy and not local_copy.get('etag'):
+            age = time.time() - local_copy.get('listed', 0)
+            if 0 <= age < self.config.s3_cache_listing_ttl:
+                logger.debug("Using listing of S3 bucket from %s ago.", format_timespan(age))
+                return local_copy['archives']
+
+    def read_local_copy(self, etag_required=True):
+        """
+        Read the local copy of the cache index.
+
+        :param etag_required: :data:`False` to also accept a listing of the
+                              bucket (which doesn't have an ETag).
+        :returns: A dictionary with the keys ``archives``, ``etag`` and
+                  ``listed`` or :data:`None` when there's no (valid) local
+                  copy of the cache index of the configured bucket.
+        """
+        try:
+            with open(self.local_copy) as handle:
+                document = json.load(handle)
+            if document.get('location') == self.location and (document.get('etag') or not etag_required):
+                return document
+        except Exception as e:
+            logger.debug("Failed to read local copy of S3 cache index: %s", e)
+
+    def write_local_copy(self, entries, etag):
+        """
+        Write the local copy of the cache index.
+
+        :param entries: A dictionary like :attr:`entries`.
+        :param etag: The ETag of the index (a string) or :data:`None` when
+                     `entries` is a listing of the bucket.
+        """
+        try:
+            with S3CacheIndex.local_copy_lock:
+                makedirs(os.path.dirname(self.local_copy))
+                with AtomicReplace(self.local_copy) as temporary_file:
+                    with open(temporary_file, 'w') as handle:
+                        json.dump(dict(archives=entries, etag=etag, listed=int(time.time()),
+                                       location=self.location), handle)
+        except Exception as e:
+            logger.debug("Failed to write local copy of S3 cache index: %s", e)
+
+
 class PatchedBotoConfig(PatchedAttribute):
 
     """
@@ -349,8 +1185,17 @@ class PatchedBotoConfig(PatchedAttribute):
 
     Without this monkey patch it is impossible to configure the number of
     retries on Python 3 which makes the pip-accel test suite horribly slow.
+
+    Because build leases (see :class:`S3Lease`) are renewed from a separate
+    thread the monkey patch can be active in several threads at the same time.
+    The first thread to enter the context applies the patch and the last
+    thread to leave the context restores the original method.
     """
 
+    lock = threading.Lock()
+    owner = None
+    users = 0
+
     def __init__(self):
         """Initialize a :class:`PatchedBotoConfig` object."""
         from boto import config
@@ -364,6 +1209,22 @@ class PatchedBotoConfig(PatchedAttribute):
             enabled=PY3,
         )
 
+    def __enter__(self):
+        """Apply the monkey patch (unless another thread already did so)."""
+        with PatchedBotoConfig.lock:
+            if PatchedBotoConfig.users == 0:
+                super(PatchedBotoConfig, self).__enter__()
+                PatchedBotoConfig.owner = self
+            PatchedBotoConfig.users += 1
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Restore the original method (when no other threads are using the monkey patch)."""
+        with PatchedBotoConfig.lock:
+            PatchedBotoConfig.users -= 1
+            if PatchedBotoConfig.users == 0:
+                super(PatchedBotoConfig, PatchedBotoConfig.owner).__exit__(exc_type, exc_value, traceback)
+                PatchedBotoConfig.owner = None
+
     def get(self, section, name, default=None, **kw):
         """Replacement for :func:`boto.pyami.config.Config.get()`."""
         try:
@@ -0,0 +1,331 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Background uploads to remote cache backends.
+
+Uploading a newly built binary distribution to a remote cache backend (like
+the Amazon S3 cache backend) can take longer than building it, but there's no
+reason for the installation to wait for the upload. When
+:attr:`.Config.async_uploads` is enabled the :class:`.CacheManager` hands the
+uploads of cache backends whose :attr:`~.AbstractCacheBackend.REMOTE`
+attribute is :data:`True` to an :class:`UploadQueue`, which works as follows:
+
+1. The distribution archive is copied to the upload spool (a directory in
+   :attr:`.Config.data_directory`) together with a small JSON document that
+   records the name of the cache backend and the filename of the archive.
+
+2. A background thread uploads the spooled archives in the order they were
+   submitted (using its own instances of the cache backends) and removes them
+   from the spool once they've been uploaded.
+
+3. When the process exits the queue is drained, but pip-accel waits at most
+   :attr:`.Config.upload_deadline` seconds for this.
+
+Uploads that failed or didn't finish before the deadline stay in the spool
+and the next pip-accel run submits them before any new uploads. Uploads that
+failed :data:`MAX_ATTEMPTS` times are removed from the spool.
+"""
+
+# Standard library modules.
+import atexit
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# External dependencies.
+from humanfriendly import Timer, pluralize
+
+# Modules included in our package.
+from pip_accel.archives import get_archive_suffix
+from pip_accel.compat import queue
+from pip_accel.exceptions import CacheBackendDisabledError
+from pip_accel.utils import AtomicReplace, makedirs
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+"""The number of failed uploads after which a spooled upload is given up (an integer)."""
+
+
+class UploadQueue(object):
+
+    """Upload distribution archives to remote cache backends in the background."""
+
+    def __init__(self, config, backends):
+        """
+        Initialize an :class:`UploadQueue` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config`
+                       object).
+        :param backends: The list of available cache backends (shared with
+                         the :class:`.CacheManager` so that spooled uploads
+                         aren't attempted for cache backends that have been
+                         disabled).
+        """
+        self.config = config
+        self.backends = backends
+        self.condition = threading.Condition()
+        self.failed = set()
+        self.pending = 0
+        self.queue = queue.Queue()
+        self.thread = None
+        self.uploaders = {}
+
+    @property
+    def directory(self):
+        """The pathname of the upload spool (a string)."""
+        return os.path.join(self.config.data_directory, 'upload-spool')
+
+    def submit(self, backend, filename, handle, lock=None):
+        """
+        Upload a distribution archive to a remote cache backend.
+
+        :param backend: An :class:`.AbstractCacheBackend` object.
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        :param lock: The :class:`.CacheLock` of the distribution archive or
+                     :data:`None`.
+
+        When :attr:`.Config.async_uploads` is enabled the distribution
+        archive is spooled and uploaded in the background (and the lock is
+        held until the upload has finished), otherwise it's uploaded right
+        away (and only spooled when the upload fails).
+        """
+        name = backend.__class__.__name__
+        if self.config.async_uploads:
+            entry = self.spool(name, filename, handle)
+            if lock is not None:
+                lock.hold()
+            self.enqueue(entry, lock)
+        elif self.attempt(name, filename, handle) is not True:
+            handle.seek(0)
+            self.spool(name, filename, handle, attempts=1)
+
+    def recover(self):
+        """
+        Submit the uploads that previous runs left in the spool.
+
+        This is called by the :class:`.CacheManager` when it's initialized,
+        so that spooled uploads are handled before any new uploads.
+        """
+        names = set(b.__class__.__name__ for b in self.backends)
+        entries = [e for e, m in self.find_entries() if m['backend'] in names]
+        if entries:
+            logger.info("Retrying %s left behind by previous runs ..", pluralize(len(entries), "spooled upload"))
+            for entry in entries:
+                if self.config.async_uploads:
+                    self.enqueue(entry)
+                else:
+                    self.process(entry)
+
+    def drain(self):
+        """
+        Wait for the background uploads to finish.
+
+        Waits at most :attr:`.Config.upload_deadline` seconds. Uploads that
+        haven't finished by then stay in the spool to be retried by the next
+        run. This is registered with :func:`atexit.register()` when the
+        background thread is started.
+        """
+        with self.condition:
+            if self.pending:
+                timer = Timer()
+                logger.info("Waiting for %s to finish ..", pluralize(self.pending, "background upload"))
+                deadline = time.time() + self.config.upload_deadline
+                while self.pending and time.time() < deadline:
+                    self.condition.wait(deadline - time.time())
+                if self.pending:
+                    logger.warning("Stopped waiting for %s after %s, the next run will retry them.",
+                                   pluralize(self.pending, "background upload"), timer)
+                else:
+                    logger.info("Finished background uploads in %s.", timer)
+
+    def enqueue(self, entry, lock=None):
+        """
+        Upload a spooled distribution archive in the background.
+
+        :param entry: The name of the spool entry (a string).
+        :param lock: A :class:`.CacheLock` object whose :func:`~.CacheLock.unhold()`
+                     method is called when the upload has finished (optional).
+        """
+        with self.condition:
+            self.pending += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='pip-accel-uploads')
+                self.thread.daemon = True
+                self.thread.start()
+                atexit.register(self.drain)
+        self.queue.put((entry, lock))
+
+    def run(self):
+        """Upload spooled distribution archives (runs in the background thread)."""
+        while True:
+            entry, lock = self.queue.get()
+            try:
+                self.process(entry)
+            except Exception as e:
+                logger.exception("Failed to process spooled upload %s: %s", entry, e)
+            finally:
+                if lock is not None:
+                    lock.unhold()
+                with self.condition:
+                    self.pending -= 1
+                    self.condition.notify_all()
+
+    def process(self, entry):
+        """
+        Upload a spooled distribution archive and update the spool.
+
+        :param entry: The name of the spool entry (a string).
+        """
+        metadata = self.load_entry(entry)
+        if metadata is None or metadata['backend'] in self.failed:
+            return
+        try:
+            handle = open(os.path.join(self.directory, metadata['archive']), 'rb')
+        except IOError:
+            # Another pip-accel process finished the upload.
+            return
+        with handle:
+            result = self.attempt(metadata['backend'], metadata['filename'], handle)
+        if result is True:
+            self.remove_entry(entry)
+        elif result is False:
+            metadata['attempts'] += 1
+            if metadata['attempts'] >= MAX_ATTEMPTS:
+                logger.warning("Giving up on uploading %s to %s after %s.",
+                               metadata['filename'], metadata['backend'],
+                               pluralize(metadata['attempts'], "failed attempt"))
+                self.remove_entry(entry)
+            else:
+                self.save_entry(entry, metadata)
+
+    def attempt(self, name, filename, handle):
+        """
+        Try to upload a distribution archive to a remote cache backend.
+
+        :param name: The class name of the cache backend (a string).
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        :returns: :data:`True` when the upload succeeded, :data:`False` when
+                  it failed and :data:`None` when the cache backend isn't
+                  available.
+
+        After a cache backend fails no further uploads to it are attempted
+        by this process.
+        """
+        if name in self.failed:
+            return None
+        try:
+            uploader = self.uploaders.get(name)
+            if uploader is None:
+                backend = next((b for b in self.backends if b.__class__.__name__ == name), None)
+                if backend is None:
+                    return None
+                uploader = backend.__class__(self.config)
+                self.uploaders[name] = uploader
+            uploader.put(filename, handle)
+            return True
+        except CacheBackendDisabledError as e:
+            logger.debug("Not uploading to %s because it requires configuration: %s", name, e)
+            self.failed.add(name)
+            return None
+        except Exception as e:
+            logger.warning("Failed to upload %s to %s, spooled for retry: %s", filename, name, e)
+            self.failed.add(name)
+            return False
+
+    def spool(self, name, filename, handle, attempts=0):
+        """
+        Store a distribution archive in the upload spool.
+
+        :param name: The class name of the cache backend (a string).
+        :param filename: The filename of the distribution archive (a string).
+        :param handle: A file-like object that provides access to the
+                       distribution archive.
+        :param attempts: The number of failed uploads so far (an integer).
+        :returns: The name of the spool entry (a string).
+        """
+        makedirs(self.directory)
+        entry = uuid.uuid4().hex
+        archive = entry + get_archive_suffix(self.config.cache_format_revision)
+        with open(os.path.join(self.directory, archive), 'wb') as spool_handle:
+            shutil.copyfileobj(handle, spool_handle)
+        # The metadata is written last so that incomplete archives are never
+        # picked up by other pip-accel processes.
+        self.save_entry(entry, dict(archive=archive,
+                                    attempts=attempts,
+                                    backend=name,
+                                    filename=filename,
+                                    submitted=time.time()))
+        return entry
+
+    def find_entries(self):
+        """
+        Find the entries in the upload spool.
+
+        :returns: A list of tuples with two values each: The name of a spool
+                  entry (a string) and its metadata (a dictionary), ordered
+                  by the time they were submitted.
+        """
+        entries = []
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json'):
+                    entry = filename[:-len('.json')]
+                    metadata = self.load_entry(entry)
+                    if metadata is not None:
+                        entries.append((entry, metadata))
+        return sorted(entries, key=lambda e: e[1]['submitted'])
+
+    def load_entry(self, entry):
+        """
+        Load the metadata of a spool entry.
+
+        :param entry: The name of the spool entry (a string).
+        :returns: A dictionary or :data:`None` when the entry no longer exists
+                  or can't be loaded.
+        """
+        try:
+            with open(os.path.join(self.directory, entry + '.json')) as handle:
+                return json.load(handle)
+        except Exception as e:
+            logger.debug("Failed to load spooled upload %s: %s", entry, e)
+
+    def save_entry(self, entry, metadata):
+        """
+        Save the metadata of a spool entry.
+
+        :param entry: The name of the spool entry (a string).
+        :param metadata: A dictionary with the metadata of the entry.
+        """
+        with AtomicReplace(os.path.join(self.directory, entry + '.json')) as temporary_file:
+            with open(temporary_file, 'w') as handle:
+                json.dump(metadata, handle)
+
+    def remove_entry(self, entry):
+        """
+        Remove an entry from the upload spool.
+
+        :param entry: The name of the spool entry (a string).
+        """
+        metadata = self.load_entry(entry)
+        filenames = [entry + '.json']
+        if metadata is not None:
+            filenames.append(metadata['archive'])
+        for filename in filenames:
+            try:
+                os.unlink(os.path.join(self.directory, filename))
+            except OSError:
+                pass
@@ -1,7 +1,7 @@
 # Accelerator for pip, the Python package manager.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: November 14, 2015
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """Command line interface for the ``pip-accel`` program."""
@@ -15,7 +15,9 @@ import textwrap
 # Modules included in our package.
 from pip_accel import PipAccelerator
 from pip_accel.config import Config
+from pip_accel.digests import DigestCache
 from pip_accel.exceptions import NothingToDoError
+from pip_accel.fingerprint import InstallFingerprints
 from pip_accel.utils import match_option
 
 # External dependencies.
@@ -32,13 +34,22 @@ def main():
     if not arguments:
         usage()
         sys.exit(0)
+    # The repack-cache and install-lockfile subcommands are specific to pip-accel.
+    repack = (arguments[0] == 'repack-cache')
+    lockfile = (arguments[0] == 'install-lockfile')
     # If no install subcommand is given we pass the command line straight
     # to pip without any changes and exit immediately afterwards.
-    if 'install' not in arguments:
+    if not (repack or lockfile) and 'install' not in arguments:
         # This will not return.
         os.execvp('pip', ['pip'] + arguments)
     else:
-        arguments = [arg for arg in arguments if arg != 'install']
+        arguments = [arg for arg in arguments if arg not in ('install', 'repack-cache', 'install-lockfile')]
+    # The install-lockfile subcommand expects the pathname of a lockfile.
+    if lockfile:
+        filenames = [arg for arg in arguments if not arg.startswith('-')]
+        if len(filenames) != 1:
+            usage()
+            sys.exit(1)
     config = Config()
     # Initialize logging output.
     coloredlogs.install(
@@ -53,8 +64,15 @@ def main():
             coloredlogs.decrease_verbosity()
     # Perform the requested action(s).
     try:
-        accelerator = PipAccelerator(config)
-        accelerator.install_from_arguments(arguments)
+        if repack:
+            from pip_accel.caches.local import LocalCacheBackend
+            LocalCacheBackend(config).repack()
+        elif lockfile:
+            accelerator = PipAccelerator(config)
+            accelerator.install_from_lockfile(filenames[0])
+        elif not is_satisfied(config, arguments):
+            accelerator = PipAccelerator(config)
+            accelerator.install_from_arguments(arguments)
     except NothingToDoError as e:
         # Don't print a traceback for this (it's not very user friendly) and
         # exit with status zero to stay compatible with pip. For more details
@@ -66,10 +84,33 @@ def main():
         sys.exit(1)
 
 
+def is_satisfied(config, arguments):
+    """
+    Check whether an installation is known to be satisfied (see :mod:`pip_accel.fingerprint`).
+
+    :param config: The pip-accel configuration (a :class:`.Config` object).
+    :param arguments: The command line arguments to ``pip install ...`` (a
+                      list of strings).
+    :returns: :data:`True` if there's nothing to do, :data:`False` otherwise.
+
+    This is checked before the :class:`.PipAccelerator` is initialized
+    because that imports pip, which takes longer than the check itself.
+    """
+    if config.fingerprint_installs and not config.lockfile:
+        fingerprints = InstallFingerprints(config, DigestCache(config))
+        key = fingerprints.get_key(arguments)
+        if key and fingerprints.is_satisfied(key):
+            logger.info("Nothing to do! (requirements and installed distributions unchanged)")
+            return True
+    return False
+
+
 def usage():
     """Print a usage message to the terminal."""
     print(textwrap.dedent("""
         Usage: pip-accel [PIP_ARGS]
+               pip-accel repack-cache
+               pip-accel install-lockfile FILENAME
 
         The pip-accel program is a wrapper for pip, the Python package manager. It
         accelerates the usage of pip to initialize Python virtual environments given
@@ -77,6 +118,16 @@ def usage():
         and options supported by pip, however the only added value is in the "pip
         install" subcommand.
 
+        The "pip-accel repack-cache" command migrates the binary distribution
+        archives in an older (revision 7) local binary cache to the current
+        cache format (archives that are used are also migrated automatically),
+        removes the old archives and reports the disk space saved.
+
+        The "pip-accel install-lockfile" command installs the requirements
+        recorded in a lockfile (written by "pip-accel install" when
+        $PIP_ACCEL_LOCKFILE is set) from the binary cache, using pip only
+        for the requirements that are missing from the cache.
+
         For more information please refer to the GitHub project page
         at https://github.com/paylogic/pip-accel
     """).strip())
@@ -16,6 +16,7 @@ __all__ = (
     'StringIO',
     'configparser',
     'pathname2url',
+    'queue',
     'urljoin',
     'urlparse',
 )
@@ -28,6 +29,7 @@ try:
     # Python 2.
     basestring = basestring
     import ConfigParser as configparser
+    import Queue as queue
     from StringIO import StringIO
     from urllib import pathname2url
     from urlparse import urljoin, urlparse
@@ -36,6 +38,7 @@ except (ImportError, NameError):
     # Python 3.
     basestring = str
     import configparser
+    import queue
     from io import StringIO
     from urllib.parse import urljoin, urlparse
     from urllib.request import pathname2url
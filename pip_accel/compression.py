@@ -0,0 +1,362 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Pluggable compression of cached binary distributions.
+
+The files in the local binary cache (see :class:`.BlobStore`) and the members
+of indexed archives (see :func:`.write_indexed_archive()`) are compressed
+using a configurable codec:
+
+=========  ==================================================================
+Codec      Description
+=========  ==================================================================
+``zlib``   The default, always available and readable by every pip-accel
+           release that supports the current cache format revision.
+``zstd``   Much faster decompression, requires the zstandard_ package.
+``lz4``    Even faster (but weaker) compression, requires the lz4_ package.
+``none``   No compression at all, for local caches on fast disks.
+=========  ==================================================================
+
+Codecs are configured using a string like ``zstd`` or ``zstd:10`` (the
+optional number after the colon is the compression level). When the module
+required by the configured codec isn't installed pip-accel falls back to
+``zlib``. The name of the codec is recorded in manifests and in the index of
+indexed archives so that readers detect the codec automatically (see
+:attr:`.Config.cache_codec` and :attr:`.Config.s3_cache_codec`).
+
+.. _zstandard: https://pypi.python.org/pypi/zstandard
+.. _lz4: https://pypi.python.org/pypi/lz4
+"""
+
+# Standard library modules.
+import logging
+import zlib
+
+# Modules included in our package.
+from pip_accel.exceptions import UnsupportedCodecError
+
+# The fast codecs are optional.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+DEFAULT_CODEC = 'zlib'
+"""The name of the codec that's used when no codec is configured (a string)."""
+
+
+class Codec(object):
+
+    """Base class for compression codecs."""
+
+    name = None
+    """The name of the codec (a string)."""
+
+    suffix = ''
+    """The filename extension of blobs compressed using the codec (a string)."""
+
+    default_level = None
+    """The compression level used when no level is configured (an integer)."""
+
+    available = True
+    """:data:`True` if the modules required by the codec are installed."""
+
+    def __init__(self, level=None):
+        """
+        Initialize a :class:`Codec` object.
+
+        :param level: The compression level (an integer, defaults to
+                      :attr:`default_level`).
+        """
+        self.level = self.default_level if level is None else level
+
+    def compress(self, data):
+        """
+        Compress a byte string.
+
+        :param data: The data to compress (a byte string).
+        :returns: The compressed data (a byte string).
+        """
+        raise NotImplementedError()
+
+    def decompress(self, data):
+        """
+        Decompress a byte string.
+
+        :param data: The compressed data (a byte string).
+        :returns: The original data (a byte string).
+        """
+        raise NotImplementedError()
+
+    def open_compressor(self):
+        """
+        Compress data incrementally.
+
+        :returns: An object with the same interface as the objects returned by
+                  :func:`zlib.compressobj()`: Its :func:`compress()` method
+                  accepts a chunk of data and returns the compressed data that
+                  is available so far, its :func:`flush()` method returns the
+                  remainder (both are byte strings). The concatenation of all
+                  compressed data can be read using :func:`open_reader()`.
+        """
+        raise NotImplementedError()
+
+    def open_reader(self, handle):
+        """
+        Decompress a file-like object incrementally.
+
+        :param handle: A file-like object that provides the compressed data.
+        :returns: A file-like object that provides the original data. Its
+                  :func:`read()` method accepts a size so that callers can
+                  decompress large files using a fixed amount of memory.
+                  Closing it closes `handle`.
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        """Generate a textual representation of the codec."""
+        return '%s:%s' % (self.name, self.level)
+
+
+class ZlibCodec(Codec):
+
+    """Compression using :mod:`zlib` (the default)."""
+
+    name = 'zlib'
+    default_level = 6
+
+    def compress(self, data):
+        """Compress a byte string using :func:`zlib.compress()`."""
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        """Decompress a byte string using :func:`zlib.decompress()`."""
+        return zlib.decompress(data)
+
+    def open_compressor(self):
+        """Compress data incrementally using :func:`zlib.compressobj()`."""
+        return zlib.compressobj(self.level)
+
+    def open_reader(self, handle):
+        """Decompress a file-like object using a :class:`ZlibReader`."""
+        return ZlibReader(handle)
+
+
+class ZstdCodec(Codec):
+
+    """Compression using the zstandard_ package."""
+
+    name = 'zstd'
+    suffix = '.zst'
+    default_level = 3
+    available = zstandard is not None
+
+    def compress(self, data):
+        """Compress a byte string using :class:`zstandard.ZstdCompressor`."""
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        """Decompress a byte string using :class:`zstandard.ZstdDecompressor`."""
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    def open_compressor(self):
+        """Compress data incrementally using :func:`zstandard.ZstdCompressor.compressobj()`."""
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def open_reader(self, handle):
+        """Decompress a file-like object using :func:`zstandard.ZstdDecompressor.stream_reader()`."""
+        return zstandard.ZstdDecompressor().stream_reader(handle)
+
+
+class Lz4Codec(Codec):
+
+    """Compression using the lz4_ package."""
+
+    name = 'lz4'
+    suffix = '.lz4'
+    default_level = 0
+    available = lz4_frame is not None
+
+    def compress(self, data):
+        """Compress a byte string using :func:`lz4.frame.compress()`."""
+        return lz4_frame.compress(data, compression_level=self.level)
+
+    def decompress(self, data):
+        """Decompress a byte string using :func:`lz4.frame.decompress()`."""
+        return lz4_frame.decompress(data)
+
+    def open_compressor(self):
+        """Compress data incrementally using an :class:`Lz4Compressor`."""
+        return Lz4Compressor(self.level)
+
+    def open_reader(self, handle):
+        """Decompress a file-like object using :class:`lz4.frame.LZ4FrameFile`."""
+        return lz4_frame.LZ4FrameFile(handle, mode='rb')
+
+
+class NullCodec(Codec):
+
+    """No compression at all."""
+
+    name = 'none'
+    suffix = '.raw'
+    default_level = 0
+
+    def compress(self, data):
+        """Return the byte string unchanged."""
+        return data
+
+    def decompress(self, data):
+        """Return the byte string unchanged."""
+        return data
+
+    def open_compressor(self):
+        """Return a :class:`NullCompressor`."""
+        return NullCompressor()
+
+    def open_reader(self, handle):
+        """Return the file-like object unchanged."""
+        return handle
+
+
+class Lz4Compressor(object):
+
+    """Adapter that gives :class:`lz4.frame.LZ4FrameCompressor` the interface of :func:`zlib.compressobj()`."""
+
+    def __init__(self, level):
+        """
+        Initialize an :class:`Lz4Compressor` object.
+
+        :param level: The compression level (an integer).
+        """
+        self.compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        """Compress a chunk of data (the first chunk is preceded by the frame header)."""
+        header, self.header = self.header, b''
+        return header + self.compressor.compress(data)
+
+    def flush(self):
+        """Finish the frame."""
+        header, self.header = self.header, b''
+        return header + self.compressor.flush()
+
+
+class NullCompressor(object):
+
+    """Object with the interface of :func:`zlib.compressobj()` that doesn't compress anything."""
+
+    def compress(self, data):
+        """Return the chunk of data unchanged."""
+        return data
+
+    def flush(self):
+        """Return an empty byte string."""
+        return b''
+
+
+class ZlibReader(object):
+
+    """
+    File-like object that decompresses a zlib stream incrementally.
+
+    The standard library doesn't provide a file-like interface to raw zlib
+    streams (:mod:`gzip` requires a gzip header) so this class uses
+    :func:`zlib.decompressobj()` with a maximum output length.
+    """
+
+    def __init__(self, handle, chunk_size=1024 * 64):
+        """
+        Initialize a :class:`ZlibReader` object.
+
+        :param handle: A file-like object that provides the compressed data.
+        :param chunk_size: The number of compressed bytes to read at once (an integer).
+        """
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj()
+
+    def read(self, size=-1):
+        """
+        Read decompressed data.
+
+        :param size: The maximum number of bytes to return (an integer, a
+                     negative number reads until the end of the stream).
+        :returns: A byte string (empty at the end of the stream).
+        """
+        if size < 0:
+            return b''.join(iter(lambda: self.read(self.chunk_size), b''))
+        while True:
+            compressed = self.decompressor.unconsumed_tail
+            if not compressed:
+                compressed = self.handle.read(self.chunk_size)
+                if not compressed:
+                    return self.decompressor.flush()
+            data = self.decompressor.decompress(compressed, size)
+            if data:
+                return data
+
+    def close(self):
+        """Close the underlying file-like object."""
+        self.handle.close()
+
+
+CODECS = dict((c.name, c) for c in (ZlibCodec, ZstdCodec, Lz4Codec, NullCodec))
+"""A dictionary that maps codec names to :class:`Codec` subclasses."""
+
+
+def parse_codec(value):
+    """
+    Parse a configured codec.
+
+    :param value: A string like ``zstd`` or ``zstd:10`` (the optional number
+                  after the colon is the compression level).
+    :returns: A :class:`Codec` object.
+
+    Unknown and unavailable codecs and invalid compression levels are
+    reported using a warning, after which the default codec (or level) is
+    used instead.
+    """
+    name, _, level = (value or DEFAULT_CODEC).strip().lower().partition(':')
+    codec_class = CODECS.get(name)
+    if codec_class is None:
+        logger.warning("Unknown compression codec %r, falling back to %s!", name, DEFAULT_CODEC)
+        return CODECS[DEFAULT_CODEC]()
+    if not codec_class.available:
+        logger.warning("Compression codec %r isn't available (the required module"
+                       " isn't installed), falling back to %s!", name, DEFAULT_CODEC)
+        return CODECS[DEFAULT_CODEC]()
+    try:
+        return codec_class(int(level) if level else None)
+    except ValueError:
+        logger.warning("Invalid compression level %r for codec %r, using default level!", level, name)
+        return codec_class()
+
+
+def get_codec(name):
+    """
+    Get the codec needed to read existing data.
+
+    :param name: The name of a codec (a string or :data:`None`, which refers
+                 to the codec used before codecs were configurable).
+    :returns: A :class:`Codec` object.
+    :raises: :exc:`.UnsupportedCodecError` when the codec is unknown or the
+             module it requires isn't installed.
+    """
+    codec_class = CODECS.get(name or DEFAULT_CODEC)
+    if codec_class is None or not codec_class.available:
+        raise UnsupportedCodecError("Compression codec {name!r} isn't supported (is the module it requires installed?)",
+                                    name=name)
+    return codec_class()
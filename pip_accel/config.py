@@ -81,7 +81,7 @@ from pip_accel.utils import is_root, expand_path
 # External dependencies.
 from coloredlogs import DEFAULT_LOG_FORMAT
 from cached_property import cached_property
-from humanfriendly import coerce_boolean, parse_path
+from humanfriendly import coerce_boolean, parse_path, parse_size
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -187,8 +187,19 @@ class Config(object):
         that multiple revisions can peacefully coexist. When pip-accel breaks
         backwards compatibility this number is bumped so that pip-accel starts
         using a new directory.
+
+        Revision 8 changed the local cache from one ``*.tar.gz`` archive per
+        binary distribution to manifests and content addressed blobs (see
+        :mod:`pip_accel.archives`). The archives of local revision 7 caches
+        are migrated when they're first used, or all at once (removing the
+        old archives) using ``pip-accel repack-cache``.
+
+        Revision 9 changed the format of the distribution archives stored by
+        other cache backends (e.g. Amazon S3) from ``*.tar.gz`` archives to
+        indexed archives. Archives of older revisions can still be read (see
+        :data:`.READABLE_REVISIONS`).
         """
-        return 7
+        return 9
 
     @cached_property
     def source_index(self):
@@ -222,6 +233,48 @@ class Config(object):
         return self.get(property_name='eggs_cache',
                         default=os.path.join(self.data_directory, 'eggs'))
 
+    @cached_property
+    def metadata_cache(self):
+        """
+        The absolute pathname of pip-accel's metadata cache directory (a string).
+
+        This is the ``metadata`` subdirectory of :data:`data_directory`. It
+        contains the ``*.egg-info`` directories generated by ``setup.py
+        egg_info`` (see :attr:`cache_metadata`).
+        """
+        return self.get(property_name='metadata_cache',
+                        default=os.path.join(self.data_directory, 'metadata'))
+
+    @cached_property
+    def seed_store(self):
+        """
+        The absolute pathname of pip-accel's seed store directory (a string).
+
+        This is the ``seed`` subdirectory of :data:`data_directory`. It
+        contains the unpacked, content addressed files of cached binary
+        distributions (see :attr:`link_installs`).
+        """
+        return self.get(property_name='seed_store',
+                        default=os.path.join(self.data_directory, 'seed'))
+
+    @cached_property
+    def cache_codec(self):
+        """
+        The compression codec of the local binary cache (a string).
+
+        A codec name like ``zlib``, ``zstd``, ``lz4`` or ``none``, optionally
+        followed by a colon and a compression level (e.g. ``zstd:10``). Refer
+        to :mod:`pip_accel.compression` for details.
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_CODEC``
+        - Configuration option: ``cache-codec``
+        - Default: ``zlib``
+        """
+        return self.get(property_name='cache_codec',
+                        environment_variable='PIP_ACCEL_CACHE_CODEC',
+                        configuration_option='cache-codec',
+                        default='zlib')
+
     @cached_property
     def data_directory(self):
         """
@@ -338,6 +391,125 @@ class Config(object):
         except:
             return 3
 
+    @cached_property
+    def build_jobs(self):
+        """
+        The maximum number of binary distributions to build concurrently (an integer).
+
+        When this is greater than one, the binary distributions missing from
+        the cache are built in parallel before installation starts (see
+        :func:`~pip_accel.PipAccelerator.execute_build_plan()`). When
+        :attr:`pipeline` is enabled this is the number of builder threads.
+
+        - Environment variable: ``$PIP_ACCEL_BUILD_JOBS``
+        - Configuration option: ``build-jobs``
+        - Default: ``1`` (binary distributions are built one at a time)
+        """
+        value = self.get(property_name='build_jobs',
+                         environment_variable='PIP_ACCEL_BUILD_JOBS',
+                         configuration_option='build-jobs')
+        try:
+            n = int(value)
+            if n >= 1:
+                return n
+        except:
+            pass
+        return 1
+
+    @cached_property
+    def install_jobs(self):
+        """
+        The number of threads used to write the files of a binary distribution (an integer).
+
+        When this is greater than one the files of cached binary distributions
+        are written concurrently (see
+        :func:`~pip_accel.bdist.BinaryDistributionManager.install_binary_dist()`),
+        which helps for packages with thousands of files on file systems where
+        every file creation incurs latency (e.g. network file systems).
+
+        - Environment variable: ``$PIP_ACCEL_INSTALL_JOBS``
+        - Configuration option: ``install-jobs``
+        - Default: ``1`` (files are written one at a time)
+        """
+        value = self.get(property_name='install_jobs',
+                         environment_variable='PIP_ACCEL_INSTALL_JOBS',
+                         configuration_option='install-jobs')
+        try:
+            n = int(value)
+            if n >= 1:
+                return n
+        except:
+            pass
+        return 1
+
+    @cached_property
+    def install_memory(self):
+        """
+        The (approximate) peak memory used to write the files of a binary distribution (an integer).
+
+        Files are copied from cached binary distributions in chunks instead of
+        being loaded into memory as a whole. This option limits the memory
+        used for those chunks by all threads together (see
+        :attr:`install_jobs`). The value is a number of bytes or a size like
+        ``16 MB`` (see :func:`humanfriendly.parse_size()`). Each thread uses
+        at least 4 KiB.
+
+        - Environment variable: ``$PIP_ACCEL_INSTALL_MEMORY``
+        - Configuration option: ``install-memory``
+        - Default: ``8 MB``
+        """
+        value = self.get(property_name='install_memory',
+                         environment_variable='PIP_ACCEL_INSTALL_MEMORY',
+                         configuration_option='install-memory',
+                         default='8 MB')
+        try:
+            n = parse_size(str(value))
+            if n >= 1:
+                return n
+        except:
+            pass
+        return parse_size('8 MB')
+
+    @cached_property
+    def pipeline(self):
+        """
+        Whether to download, build and install requirements in a streaming pipeline.
+
+        When this is :data:`True` each requirement moves on to be built and
+        installed as soon as pip has unpacked it, instead of waiting for pip to
+        finish downloading and unpacking the whole requirement set (see
+        :mod:`pip_accel.pipeline`).
+
+        - Environment variable: ``$PIP_ACCEL_PIPELINE``
+        - Configuration option: ``pipeline``
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='pipeline',
+                                       environment_variable='PIP_ACCEL_PIPELINE',
+                                       configuration_option='pipeline',
+                                       default=False))
+
+    @cached_property
+    def link_installs(self):
+        """
+        Whether to install binary distributions by linking files from the seed store.
+
+        When this is :data:`True` cached binary distributions are unpacked
+        into the :attr:`seed_store` once and installed by creating hard links
+        (or copy-on-write clones where the file system supports them) instead
+        of extracting every file again (see :mod:`pip_accel.seed`). Files
+        linked from the seed store are read only, because changing them would
+        change every environment that shares them.
+
+        - Environment variable: ``$PIP_ACCEL_LINK_INSTALLS``
+        - Configuration option: ``link-installs``
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='link_installs',
+                                       environment_variable='PIP_ACCEL_LINK_INSTALLS',
+                                       configuration_option='link-installs',
+                                       default=False))
+
     @cached_property
     def trust_mod_times(self):
         """
@@ -357,6 +529,176 @@ class Config(object):
                                        configuration_option='trust-mod-times',
                                        default=(not on_appveyor)))
 
+    @cached_property
+    def cache_resolutions(self):
+        """
+        Whether to remember how requirement sets were resolved.
+
+        When this is :data:`True` pip-accel remembers the names, versions and
+        archives of resolved requirement sets, so that installing the same
+        requirements again doesn't need pip to resolve and unpack the
+        requirement set (see :mod:`pip_accel.resolution`).
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_RESOLUTIONS``
+        - Configuration option: ``cache-resolutions``
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='cache_resolutions',
+                                       environment_variable='PIP_ACCEL_CACHE_RESOLUTIONS',
+                                       configuration_option='cache-resolutions',
+                                       default=True))
+
+    @cached_property
+    def lazy_unpacking(self):
+        """
+        Whether to avoid unpacking source distributions whose binary distribution is cached.
+
+        When this is :data:`True` pip-accel reads the metadata of source
+        distributions whose binary distribution is already cached straight
+        from their archives, instead of having pip unpack the archives and
+        run ``setup.py egg_info`` (see :mod:`pip_accel.metadata`).
+
+        This is opt-in because the dependencies embedded in an archive were
+        generated on the packager's machine. Archives whose ``setup.py``
+        script looks like it depends on the Python version, the platform or
+        the environment are still unpacked.
+
+        - Environment variable: ``$PIP_ACCEL_LAZY_UNPACKING``
+        - Configuration option: ``lazy-unpacking``
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='lazy_unpacking',
+                                       environment_variable='PIP_ACCEL_LAZY_UNPACKING',
+                                       configuration_option='lazy-unpacking',
+                                       default=False))
+
+    @cached_property
+    def cache_metadata(self):
+        """
+        Whether to remember the metadata generated by ``setup.py egg_info``.
+
+        When this is :data:`True` the ``*.egg-info`` directories generated
+        for source distributions are stored in the :attr:`metadata_cache`, so
+        that ``setup.py egg_info`` only runs once for each source distribution
+        archive and Python version (see :mod:`pip_accel.metadata`).
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_METADATA``
+        - Configuration option: ``cache-metadata``
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='cache_metadata',
+                                       environment_variable='PIP_ACCEL_CACHE_METADATA',
+                                       configuration_option='cache-metadata',
+                                       default=True))
+
+    @cached_property
+    def fingerprint_installs(self):
+        """
+        Whether to skip installations that are known to be satisfied already.
+
+        When this is :data:`True` pip-accel records fingerprints of the inputs
+        of successful installations and of the installed distributions, so
+        that repeating an installation that didn't change either of them
+        doesn't run pip at all (see :mod:`pip_accel.fingerprint`).
+
+        This is opt-in because a skipped installation doesn't check the
+        package index for newer releases that satisfy unpinned requirements.
+
+        - Environment variable: ``$PIP_ACCEL_FINGERPRINT_INSTALLS``
+        - Configuration option: ``fingerprint-installs``
+        - Default: :data:`False`
+        """
+        return coerce_boolean(self.get(property_name='fingerprint_installs',
+                                       environment_variable='PIP_ACCEL_FINGERPRINT_INSTALLS',
+                                       configuration_option='fingerprint-installs',
+                                       default=False))
+
+    @cached_property
+    def lockfile(self):
+        """
+        The pathname of the lockfile to write after a successful installation (a string or :data:`None`).
+
+        When this is set :func:`.PipAccelerator.install_from_arguments()`
+        records the names, versions, archives, checksums and binary cache keys
+        of the installed requirements in the given file, so that they can be
+        installed again using ``pip-accel install-lockfile FILENAME`` (see
+        :mod:`pip_accel.lockfile`).
+
+        - Environment variable: ``$PIP_ACCEL_LOCKFILE``
+        - Configuration option: ``lockfile``
+        - Default: :data:`None`
+        """
+        value = self.get(property_name='lockfile',
+                         environment_variable='PIP_ACCEL_LOCKFILE',
+                         configuration_option='lockfile')
+        return expand_path(value) if value else None
+
+    @cached_property
+    def async_uploads(self):
+        """
+        Whether to upload to remote cache backends in the background.
+
+        When this is :data:`True` newly built binary distributions are
+        uploaded to remote cache backends (like the Amazon S3 cache backend)
+        by a background thread, so installation doesn't wait for the uploads
+        (see :mod:`pip_accel.caches.uploads`).
+
+        - Environment variable: ``$PIP_ACCEL_ASYNC_UPLOADS``
+        - Configuration option: ``async-uploads``
+        - Default: :data:`True`
+        """
+        return coerce_boolean(self.get(property_name='async_uploads',
+                                       environment_variable='PIP_ACCEL_ASYNC_UPLOADS',
+                                       configuration_option='async-uploads',
+                                       default=True))
+
+    @cached_property
+    def upload_deadline(self):
+        """
+        The number of seconds to wait for background uploads at exit (an integer).
+
+        Uploads that haven't finished when the deadline expires are retried
+        by the next run of pip-accel (see :mod:`pip_accel.caches.uploads`).
+
+        - Environment variable: ``$PIP_ACCEL_UPLOAD_DEADLINE``
+        - Configuration option: ``upload-deadline``
+        - Default: ``60``
+        """
+        value = self.get(property_name='upload_deadline',
+                         environment_variable='PIP_ACCEL_UPLOAD_DEADLINE',
+                         configuration_option='upload-deadline')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 60
+
+    @cached_property
+    def cache_miss_ttl(self):
+        """
+        The number of seconds to remember misses of remote cache backends (an integer).
+
+        Distribution archives that were missing from a remote cache backend
+        (like the Amazon S3 cache backend) less than this many seconds ago
+        aren't looked up again (see :mod:`pip_accel.caches.misses`).
+
+        - Environment variable: ``$PIP_ACCEL_CACHE_MISS_TTL``
+        - Configuration option: ``cache-miss-ttl``
+        - Default: ``3600`` (``0`` disables the negative lookup cache)
+        """
+        value = self.get(property_name='cache_miss_ttl',
+                         environment_variable='PIP_ACCEL_CACHE_MISS_TTL',
+                         configuration_option='cache-miss-ttl')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 3600
+
     @cached_property
     def s3_cache_url(self):
         """
@@ -492,3 +834,205 @@ class Config(object):
                 return n
         except:
             return 5
+
+    @cached_property
+    def s3_cache_lease_ttl(self):
+        """
+        The lifetime in seconds of build leases in the Amazon S3 bucket (an integer).
+
+        When this is greater than zero, pip-accel processes that miss the same
+        binary distribution in the Amazon S3 bucket coordinate using a lease
+        object in the bucket: The first process builds the binary distribution
+        while the others wait for it to be uploaded. The holder of a lease
+        renews it while the build is running, so the lifetime only determines
+        how long it takes for the lease of a crashed build to expire. This
+        requires the clocks of the participating hosts to be synchronized.
+
+        - Environment variable: ``$PIP_ACCEL_S3_LEASE_TTL``
+        - Configuration option: ``s3-lease-ttl``
+        - Default: ``0`` (leases are disabled)
+
+        For details please refer to the :mod:`pip_accel.caches.s3` module.
+        """
+        value = self.get(property_name='s3_cache_lease_ttl',
+                         environment_variable='PIP_ACCEL_S3_LEASE_TTL',
+                         configuration_option='s3-lease-ttl')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 0
+
+    @cached_property
+    def s3_cache_index(self):
+        """
+        Whether to answer Amazon S3 cache lookups using an index object.
+
+        When this is :data:`True` the Amazon S3 cache backend maintains an
+        index of the distribution archives in the bucket. The index is fetched
+        once per run, so cache lookups don't need a request per archive.
+
+        - Environment variable: ``$PIP_ACCEL_S3_INDEX``
+        - Configuration option: ``s3-index``
+        - Default: :data:`True`
+
+        For details please refer to the :mod:`pip_accel.caches.s3` module.
+        """
+        return coerce_boolean(self.get(property_name='s3_cache_index',
+                                       environment_variable='PIP_ACCEL_S3_INDEX',
+                                       configuration_option='s3-index',
+                                       default=True))
+
+    @cached_property
+    def s3_cache_listing_ttl(self):
+        """
+        The number of seconds to reuse a listing of the Amazon S3 bucket (an integer).
+
+        When the Amazon S3 bucket doesn't contain an index object (see
+        :attr:`s3_cache_index`) and pip-accel can't create it (because
+        :attr:`s3_cache_readonly` is set) the distribution archives in the
+        bucket are listed instead. The listing is kept in
+        :attr:`data_directory` and reused for this many seconds, so that not
+        every run needs to list the whole bucket.
+
+        - Environment variable: ``$PIP_ACCEL_S3_LISTING_TTL``
+        - Configuration option: ``s3-listing-ttl``
+        - Default: ``3600`` (``0`` lists the bucket on every run)
+
+        For details please refer to the :mod:`pip_accel.caches.s3` module.
+        """
+        value = self.get(property_name='s3_cache_listing_ttl',
+                         environment_variable='PIP_ACCEL_S3_LISTING_TTL',
+                         configuration_option='s3-listing-ttl')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except Exception:
+            pass
+        return 3600
+
+    @cached_property
+    def s3_cache_prefetch_threads(self):
+        """
+        The maximum number of concurrent downloads when prefetching from Amazon S3 (an integer).
+
+        Before installation starts the binary distributions that are missing
+        from the local cache are downloaded from the Amazon S3 bucket using
+        this many threads (each with its own connection).
+
+        - Environment variable: ``$PIP_ACCEL_S3_PREFETCH_THREADS``
+        - Configuration option: ``s3-prefetch-threads``
+        - Default: ``8`` (``0`` disables prefetching)
+
+        For details please refer to the :mod:`pip_accel.caches.s3` module.
+        """
+        value = self.get(property_name='s3_cache_prefetch_threads',
+                         environment_variable='PIP_ACCEL_S3_PREFETCH_THREADS',
+                         configuration_option='s3-prefetch-threads')
+        try:
+            n = int(value)
+            if n >= 0:
+                return n
+        except:
+            pass
+        return 8
+
+    @cached_property
+    def s3_cache_multipart_threshold(self):
+        """
+        The minimum size of distribution archives that are transferred to and from Amazon S3 in parts (an integer).
+
+        Distribution archives of at least this many bytes are uploaded using
+        the S3 multipart upload API and downloaded using concurrent ranged
+        requests (see :attr:`s3_cache_part_size` and
+        :attr:`s3_cache_transfer_threads`). The value is a number of bytes or
+        a size like ``64 MB`` (see :func:`humanfriendly.parse_size()`).
+
+        - Environment variable: ``$PIP_ACCEL_S3_MULTIPART_THRESHOLD``
+        - Configuration option: ``s3-multipart-threshold``
+        - Default: ``64 MB`` (``0`` disables transfers in parts)
+
+        For details please refer to the :mod:`pip_accel.caches.s3` module.
+        """
+        value = self.get(property_name='s3_cache_multipart_threshold',
+                         environment_variable='PIP_ACCEL_S3_MULTIPART_THRESHOLD',
+                         configuration_option='s3-multipart-threshold',
+                         default='64 MB')
+        try:
+            n = parse_size(str(value))
+            if n >= 0:
+                return n
+        except:
+            pass
+        return parse_size('64 MB')
+
+    @cached_property
+    def s3_cache_part_size(self):
+        """
+        The size of the parts of large distribution archives transferred to and from Amazon S3 (an integer).
+
+        The value is a number of bytes or a size like ``16 MB`` (see
+        :func:`humanfriendly.parse_size()`). Amazon S3 requires the parts of
+        multipart uploads to be at least 5 MiB so smaller values are raised to
+        5 MiB.
+
+        - Environment variable: ``$PIP_ACCEL_S3_PART_SIZE``
+        - Configuration option: ``s3-part-size``
+        - Default: ``16 MB``
+        """
+        value = self.get(property_name='s3_cache_part_size',
+                         environment_variable='PIP_ACCEL_S3_PART_SIZE',
+                         configuration_option='s3-part-size',
+                         default='16 MB')
+        try:
+            n = parse_size(str(value))
+        except:
+            n = parse_size('16 MB')
+        return max(n, parse_size('5 MiB'))
+
+    @cached_property
+    def s3_cache_transfer_threads(self):
+        """
+        The number of parts of a large distribution archive that are transferred concurrently (an integer).
+
+        Each thread uses its own connection to Amazon S3 (see
+        :attr:`s3_cache_multipart_threshold`).
+
+        - Environment variable: ``$PIP_ACCEL_S3_TRANSFER_THREADS``
+        - Configuration option: ``s3-transfer-threads``
+        - Default: ``4``
+        """
+        value = self.get(property_name='s3_cache_transfer_threads',
+                         environment_variable='PIP_ACCEL_S3_TRANSFER_THREADS',
+                         configuration_option='s3-transfer-threads')
+        try:
+            n = int(value)
+            if n >= 1:
+                return n
+        except:
+            pass
+        return 4
+
+    @cached_property
+    def s3_cache_codec(self):
+        """
+        The compression codec of distribution archives uploaded to Amazon S3 (a string or :data:`None`).
+
+        This uses the same syntax as :attr:`cache_codec` and applies to the
+        distribution archives passed to all cache backends except the local
+        cache (which recompresses archives that use a different codec). This
+        makes it possible to use a strong codec for the (network bound) Amazon
+        S3 bucket and a fast codec for the local cache.
+
+        - Environment variable: ``$PIP_ACCEL_S3_CODEC``
+        - Configuration option: ``s3-codec``
+        - Default: :data:`None` (which means :attr:`cache_codec` is used)
+
+        For details please refer to the :mod:`pip_accel.caches.s3` module.
+        """
+        return self.get(property_name='s3_cache_codec',
+                        environment_variable='PIP_ACCEL_S3_CODEC',
+                        configuration_option='s3-codec')
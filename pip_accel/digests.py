@@ -0,0 +1,181 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Persistent memoization of file digests.
+
+pip-accel hashes local files in two places: The SHA1 checksum of the source
+distribution archive(s) of each requirement is used for cache invalidation
+(see :attr:`.Requirement.checksum`) and the MD5 digest of local archives given
+on the command line is added to their ``file://`` URLs (see
+:func:`.PipAccelerator.decorate_arguments()`). Both hash the same unchanged
+archives again on every run, which adds up for big source distributions.
+
+The :class:`DigestCache` class remembers the digests that were calculated,
+keyed by the device number, inode number, size and last modified time (in
+nanoseconds) of the files involved, so that a digest is only recalculated
+after a file has changed. The digests are stored as a small JSON document in
+the data directory (see :attr:`.Config.data_directory`) so they're shared
+between pip-accel processes. Concurrent writers merge their changes with the
+document on disk, and losing an update is harmless (the digest is simply
+calculated again).
+
+When :attr:`.Config.trust_mod_times` is :data:`False` the digests stored by
+previous runs aren't used, because an unchanged last modified time doesn't
+prove that a file is unchanged. Digests calculated by the current process are
+still remembered, so that every file is hashed at most once per run.
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+# Modules included in our package.
+from pip_accel.utils import AtomicReplace, get_mtime_ns, hash_files, makedirs
+
+# External dependencies.
+from cached_property import cached_property
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 10000
+"""The maximum number of digests remembered (an integer, the oldest digests are forgotten first)."""
+
+MAX_THREADS = 4
+"""The maximum number of threads used to hash files concurrently (an integer)."""
+
+
+class DigestCache(object):
+
+    """Persistent cache of file digests that's safe to use from multiple threads and processes."""
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`DigestCache` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        """
+        self.config = config
+        self.lock = threading.Lock()
+        self.calculated = {}
+
+    @cached_property
+    def filename(self):
+        """The pathname of the JSON document that stores the digests (a string)."""
+        return os.path.join(self.config.data_directory, 'digests.json')
+
+    @cached_property
+    def entries(self):
+        """A dictionary that maps keys (see :func:`get_key()`) to dictionaries with a digest and a timestamp."""
+        return self.load()
+
+    def get_digest(self, method, *files):
+        """
+        Get the digest of one or more files.
+
+        :param method: The hash method (a string, given to :func:`hashlib.new()`).
+        :param files: The pathname(s) of file(s) to hash (zero or more
+                      strings, their contents are hashed in the given order).
+        :returns: The hex digest (a string, the same as :func:`.hash_files()`).
+        """
+        return self.get_digests(method, [files])[0]
+
+    def get_digests(self, method, groups):
+        """
+        Get the digests of several groups of files.
+
+        :param method: The hash method (a string, given to :func:`hashlib.new()`).
+        :param groups: A list of lists with pathnames of files (refer to
+                       :func:`get_digest()`).
+        :returns: A list with a hex digest (a string) for each group.
+
+        Groups that need to be hashed are hashed concurrently (using up to
+        :data:`MAX_THREADS` threads) because reading files and hashing large
+        chunks of data both release the global interpreter lock.
+        """
+        keys = [self.get_key(method, files) for files in groups]
+        with self.lock:
+            known = self.entries if self.config.trust_mod_times else self.calculated
+            digests = [known[k]['digest'] if k in known else None for k in keys]
+        missing = [i for i, digest in enumerate(digests) if digest is None]
+        if missing:
+            jobs = min(MAX_THREADS, len(missing))
+            if jobs > 1:
+                pool = ThreadPool(jobs)
+                try:
+                    calculated = pool.map(lambda i: hash_files(method, *groups[i]), missing)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                calculated = [hash_files(method, *groups[i]) for i in missing]
+            now = time.time()
+            updates = {}
+            for i, digest in zip(missing, calculated):
+                digests[i] = digest
+                updates[keys[i]] = dict(digest=digest, time=now)
+            self.save(updates)
+        return digests
+
+    def get_key(self, method, files):
+        """
+        Get the key under which the digest of one or more files is stored.
+
+        :param method: The hash method (a string).
+        :param files: A list of pathnames (strings).
+        :returns: A string that changes when any of the files changes.
+        """
+        fingerprints = []
+        for filename in files:
+            info = os.stat(filename)
+            fingerprints.append('%i:%i:%i:%i' % (info.st_dev, info.st_ino, info.st_size, get_mtime_ns(info)))
+        return '%s:%s' % (method, ','.join(fingerprints))
+
+    def load(self):
+        """
+        Load the digests stored in the data directory.
+
+        :returns: A dictionary (empty when the digests can't be loaded).
+        """
+        try:
+            with open(self.filename) as handle:
+                entries = json.load(handle)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def save(self, updates):
+        """
+        Add digests to the cache and store the cache in the data directory.
+
+        :param updates: A dictionary with new entries (refer to :attr:`entries`).
+
+        The document on disk is loaded again before it's replaced, so that
+        digests stored by concurrent pip-accel processes aren't lost.
+        """
+        with self.lock:
+            self.calculated.update(updates)
+            self.entries.update(updates)
+            entries = self.load()
+            entries.update(self.entries)
+            if len(entries) > MAX_ENTRIES:
+                newest = sorted(entries, key=lambda k: entries[k].get('time', 0), reverse=True)
+                entries = dict((k, entries[k]) for k in newest[:MAX_ENTRIES])
+            self.entries = entries
+            try:
+                makedirs(os.path.dirname(self.filename))
+                with AtomicReplace(self.filename) as temporary_file:
+                    with open(temporary_file, 'w') as handle:
+                        json.dump(entries, handle)
+            except (IOError, OSError) as e:
+                logger.debug("Failed to save digests to %s! (%s)", self.filename, e)
@@ -1,7 +1,7 @@
 # Accelerator for pip, the Python package manager.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: October 31, 2015
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """
@@ -27,6 +27,7 @@ by pip-accel the following diagram may help by visualizing the hierarchy:
 
 .. inheritance-diagram:: EnvironmentMismatchError UnknownDistributionFormat InvalidSourceDistribution \
                          BuildFailed NoBuildOutput CacheBackendError CacheBackendDisabledError \
+                         UnsupportedCodecError CorruptArchiveError InvalidLockfile \
                          DependencyInstallationRefused DependencyInstallationFailed
    :parts: 1
 
@@ -127,6 +128,39 @@ class CacheBackendDisabledError(CacheBackendError):
     """Custom exception raised by cache backends when they require configuration."""
 
 
+class UnsupportedCodecError(PipAcceleratorError):
+
+    """
+    Custom exception raised when cached data uses an unsupported compression codec.
+
+    Raised by :func:`~pip_accel.compression.get_codec()` when a manifest or
+    archive was written using a codec that is unknown or whose module isn't
+    installed.
+    """
+
+
+class CorruptArchiveError(PipAcceleratorError):
+
+    """
+    Custom exception raised when a member of a cached archive is corrupt.
+
+    Raised by :func:`~pip_accel.archives.BlobStore.store_compressed()` when
+    the decompressed contents of a member don't match the digest recorded in
+    the archive (e.g. because the archive was truncated while it was being
+    downloaded).
+    """
+
+
+class InvalidLockfile(PipAcceleratorError):
+
+    """
+    Custom exception raised when a lockfile can't be used.
+
+    Raised by :func:`~pip_accel.lockfile.read_lockfile()` when a file isn't a
+    lockfile or was written using an unsupported revision of the format.
+    """
+
+
 class SystemDependencyError(PipAcceleratorError):
 
     """Base class for exceptions related to missing system packages."""
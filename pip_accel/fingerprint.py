@@ -0,0 +1,241 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Fast path for installations that are already satisfied.
+
+Redeploying an unchanged application is a common case: Every requirement is
+already installed, yet pip-accel still asks pip to parse the requirement files
+and resolve the requirement set, only to discover at the very end that all
+requirements are satisfied (see :func:`.PipAccelerator.transform_pip_requirement_set()`).
+
+After a successful installation the :class:`InstallFingerprints` class records
+two fingerprints:
+
+1. A key that covers the inputs of the installation: The command line
+   arguments, the contents of the local files and (recursively) the
+   requirement and constraint files they refer to, the contents of pip's
+   configuration files, the ``$PIP_*`` environment variables and the Python
+   interpreter.
+
+2. A fingerprint of the installed distributions, based on the names and last
+   modified times of the distribution metadata (``*.dist-info``,
+   ``*.egg-info``, ``*.egg``, ``*.egg-link`` and ``*.pth`` entries) in the
+   directories on :data:`sys.path`. These are the directories where pip looks
+   for installed distributions, so any installation, upgrade or removal of a
+   distribution changes the fingerprint.
+
+When both fingerprints match on the next run the ``pip-accel install`` command
+reports that there's nothing to do without running pip at all. The command
+line interface checks the fingerprints before pip is even imported, because
+importing pip takes longer than the check itself (callers of
+:func:`.PipAccelerator.install_from_arguments()` get the same check). Installations that can't be judged this way
+(because of ``--upgrade``, ``--ignore-installed``, ``--force-reinstall``,
+``--editable``, ``--target`` or ``--root``, or because the arguments refer to
+requirement files that aren't local files) always run pip. The fingerprints
+are stored as a small JSON document in the data directory (see
+:attr:`.Config.data_directory`).
+"""
+
+# Standard library modules.
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+# Modules included in our package.
+from pip_accel.inputs import IGNORED_VARIABLES, find_configuration_files, find_requirement_files
+from pip_accel.utils import AtomicReplace, get_mtime_ns, is_short_option, makedirs
+
+# External dependencies.
+from cached_property import cached_property
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 100
+"""The maximum number of fingerprints remembered (an integer, the oldest fingerprints are forgotten first)."""
+
+METADATA_SUFFIXES = ('.dist-info', '.egg-info', '.egg', '.egg-link', '.pth')
+"""Filename extensions of the entries that describe installed distributions (a tuple of strings)."""
+
+UNSUPPORTED_OPTIONS = (
+    ('-U', '--upgrade'),
+    ('-I', '--ignore-installed'),
+    ('', '--force-reinstall'),
+    ('-e', '--editable'),
+    ('-t', '--target'),
+    ('', '--root'),
+)
+"""Command line options that disable the fast path (a tuple of tuples with short and long options)."""
+
+SHORT_OPTIONS_WITH_VALUES = 'bcdefirt'
+"""The short options of ``pip install`` that take a value (a string with one character per option)."""
+
+
+class InstallFingerprints(object):
+
+    """Persistent record of installations that were already satisfied."""
+
+    def __init__(self, config, digest_cache):
+        """
+        Initialize an :class:`InstallFingerprints` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        :param digest_cache: The :class:`.DigestCache` used to hash local files
+                             and requirement files.
+        """
+        self.config = config
+        self.digest_cache = digest_cache
+
+    @cached_property
+    def filename(self):
+        """The pathname of the JSON document that stores the fingerprints (a string)."""
+        return os.path.join(self.config.data_directory, 'fingerprints.json')
+
+    def get_key(self, arguments):
+        """
+        Get the fingerprint of the inputs of an installation.
+
+        :param arguments: The command line arguments to ``pip install ...`` (a
+                          list of strings).
+        :returns: A hex digest (a string) or :data:`None` when the fast path
+                  doesn't apply to the given arguments (see above).
+        """
+        if any(is_unsupported_option(a) for a in arguments):
+            return None
+        requirement_files = find_requirement_files(arguments)
+        if requirement_files is None:
+            return None
+        local_files = [os.path.abspath(a) for a in arguments if os.path.isfile(a)]
+        environment = sorted((k, v) for k, v in os.environ.items()
+                             if k.startswith('PIP_') and k not in IGNORED_VARIABLES)
+        context = dict(
+            arguments=arguments,
+            configuration_files=self.get_digests(find_configuration_files()),
+            environment=environment,
+            executable=self.config.python_executable,
+            local_files=self.get_digests(local_files),
+            python_version=sys.version,
+            requirement_files=self.get_digests(requirement_files),
+        )
+        return hashlib.sha1(json.dumps(context, sort_keys=True).encode('UTF-8')).hexdigest()
+
+    def get_digests(self, filenames):
+        """
+        Get the digests of local files.
+
+        :param filenames: A list of pathnames (strings).
+        :returns: A list of tuples with two strings each (a pathname and its digest).
+        """
+        return [(fn, self.digest_cache.get_digest('sha1', fn)) for fn in filenames]
+
+    def get_fingerprint(self):
+        """
+        Get the fingerprint of the installed distributions.
+
+        :returns: A hex digest (a string).
+        """
+        context = []
+        for directory in sys.path:
+            directory = os.path.abspath(directory or os.curdir)
+            try:
+                entries = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.lower().endswith(METADATA_SUFFIXES):
+                    try:
+                        mtime = get_mtime_ns(os.stat(os.path.join(directory, entry)))
+                    except OSError:
+                        continue
+                    context.append((directory, entry, mtime))
+        return hashlib.sha1(json.dumps(context).encode('UTF-8')).hexdigest()
+
+    def is_satisfied(self, key):
+        """
+        Check whether an installation was already satisfied by the installed distributions.
+
+        :param key: The result of :func:`get_key()` (a string).
+        :returns: :data:`True` if the installation with the given key
+                  succeeded before and the installed distributions haven't
+                  changed since, :data:`False` otherwise.
+        """
+        entry = self.load().get(key)
+        return bool(entry) and entry.get('fingerprint') == self.get_fingerprint()
+
+    def put(self, key):
+        """
+        Remember that an installation succeeded with the current installed distributions.
+
+        :param key: The result of :func:`get_key()` (a string).
+        """
+        self.save(key, dict(fingerprint=self.get_fingerprint(), time=time.time()))
+
+    def load(self):
+        """
+        Load the fingerprints stored in the data directory.
+
+        :returns: A dictionary that maps keys (see :func:`get_key()`) to
+                  dictionaries with a fingerprint and a timestamp (empty when
+                  the fingerprints can't be loaded).
+        """
+        try:
+            with open(self.filename) as handle:
+                entries = json.load(handle)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def save(self, key, value):
+        """
+        Add a fingerprint to the record and store the record in the data directory.
+
+        :param key: The key of the installation (a string).
+        :param value: A dictionary with a fingerprint and a timestamp.
+        """
+        entries = self.load()
+        entries[key] = value
+        if len(entries) > MAX_ENTRIES:
+            newest = sorted(entries, key=lambda k: entries[k].get('time', 0), reverse=True)
+            entries = dict((k, entries[k]) for k in newest[:MAX_ENTRIES])
+        try:
+            makedirs(os.path.dirname(self.filename))
+            with AtomicReplace(self.filename) as temporary_file:
+                with open(temporary_file, 'w') as handle:
+                    json.dump(entries, handle)
+        except (IOError, OSError) as e:
+            logger.debug("Failed to save fingerprints to %s! (%s)", self.filename, e)
+
+
+def is_unsupported_option(argument):
+    """
+    Check whether a command line argument disables the fast path.
+
+    :param argument: A command line argument to ``pip install ...`` (a string).
+    :returns: :data:`True` if the argument is one of the
+              :data:`UNSUPPORTED_OPTIONS`, :data:`False` otherwise.
+
+    Clusters of short options (e.g. ``-qU``) are parsed like pip's option
+    parser parses them: Every character is an option until the first option
+    that takes a value (the rest of the cluster is that value). Long options
+    may be abbreviated (e.g. ``--upgr``) and followed by ``=value``.
+    """
+    if argument.startswith('--'):
+        name = argument.partition('=')[0]
+        return len(name) > 2 and any(long_option.startswith(name) for _, long_option in UNSUPPORTED_OPTIONS)
+    if is_short_option(argument):
+        short_options = [short_option for short_option, _ in UNSUPPORTED_OPTIONS if short_option]
+        for character in argument[1:]:
+            if '-' + character in short_options:
+                return True
+            if character in SHORT_OPTIONS_WITH_VALUES:
+                break
+    return False
@@ -0,0 +1,110 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Discovery of the local files that influence ``pip install`` commands.
+
+The keys of the :class:`.ResolutionCache` and the :class:`.InstallFingerprints`
+cover the contents of the requirement files and pip's configuration files.
+The functions in this module find those files without importing pip, because
+importing pip takes longer than the fast path of :mod:`pip_accel.fingerprint`
+is supposed to take.
+"""
+
+# Standard library modules.
+import os
+import sys
+
+# Modules included in our package.
+from pip_accel.compat import WINDOWS
+from pip_accel.utils import match_option
+
+IGNORED_VARIABLES = ('PIP_EXISTS_ACTION',)
+"""Environment variables that don't influence resolution (pip-accel sets these itself)."""
+
+
+def find_configuration_files():
+    """
+    Find the existing configuration files that pip will read.
+
+    :returns: A list of pathnames (strings).
+
+    This checks the locations that pip's ``ConfigOptionParser`` reads (site
+    wide, per user, per virtual environment and ``$PIP_CONFIG_FILE``) on all
+    platforms. A file that's found here but ignored by pip (e.g. because of
+    ``--isolated``) only makes the keys that include it more specific.
+    """
+    config_file = os.environ.get('PIP_CONFIG_FILE')
+    if config_file == os.devnull:
+        return []
+    basename = 'pip.ini' if WINDOWS else 'pip.conf'
+    home = os.path.expanduser('~')
+    candidates = []
+    if WINDOWS:
+        for variable in 'ALLUSERSPROFILE', 'PROGRAMDATA', 'APPDATA', 'LOCALAPPDATA':
+            if os.environ.get(variable):
+                candidates.append(os.path.join(os.environ[variable], 'pip', basename))
+        candidates.append(os.path.join(home, 'pip', basename))
+    elif sys.platform == 'darwin':
+        candidates.append(os.path.join('/Library/Application Support/pip', basename))
+        candidates.append(os.path.join(home, 'Library/Application Support/pip', basename))
+    else:
+        xdg_config_dirs = os.environ.get('XDG_CONFIG_DIRS') or '/etc/xdg'
+        candidates.extend(os.path.join(os.path.expanduser(d), 'pip', basename)
+                          for d in xdg_config_dirs.split(os.pathsep) if d)
+        candidates.append(os.path.join('/etc', basename))
+        xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config')
+        candidates.append(os.path.join(xdg_config_home, 'pip', basename))
+    candidates.append(os.path.join(home, '.pip', basename))
+    if config_file:
+        candidates.append(config_file)
+    candidates.append(os.path.join(sys.prefix, basename))
+    found = []
+    for filename in candidates:
+        filename = os.path.abspath(filename)
+        if filename not in found and os.path.isfile(filename):
+            found.append(filename)
+    return found
+
+
+def find_requirement_files(arguments):
+    """
+    Find the requirement and constraint files referenced by command line arguments.
+
+    :param arguments: The command line arguments to ``pip install ...`` (a
+                      list of strings).
+    :returns: A list of pathnames (strings) including the files referenced by
+              ``-r`` and ``-c`` lines in requirement files, or :data:`None`
+              when a referenced file isn't a local file (e.g. a URL).
+    """
+    pending = []
+    for i, value in enumerate(arguments):
+        for option in ('--requirement', '--constraint'):
+            if value.startswith(option + '='):
+                pending.append(value[len(option) + 1:])
+        if i >= 1 and (match_option(arguments[i - 1], '-r', '--requirement') or
+                       match_option(arguments[i - 1], '-c', '--constraint')):
+            pending.append(value)
+        elif value[:2] in ('-r', '-c') and len(value) > 2:
+            pending.append(value[2:])
+    found = []
+    while pending:
+        filename = os.path.abspath(pending.pop(0))
+        if filename in found:
+            continue
+        if not os.path.isfile(filename):
+            return None
+        found.append(filename)
+        with open(filename) as handle:
+            for line in handle:
+                tokens = line.split()
+                if len(tokens) == 2 and tokens[0] in ('-r', '--requirement', '-c', '--constraint'):
+                    pending.append(os.path.join(os.path.dirname(filename), tokens[1]))
+                elif tokens and tokens[0][:2] in ('-r', '-c') and len(tokens[0]) > 2:
+                    pending.append(os.path.join(os.path.dirname(filename), tokens[0][2:].lstrip('=')))
+                elif tokens and tokens[0].startswith(('--requirement=', '--constraint=')):
+                    pending.append(os.path.join(os.path.dirname(filename), tokens[0].partition('=')[2]))
+    return found
@@ -0,0 +1,137 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Lockfiles that pin a resolved requirement set to cached binary distributions.
+
+When :attr:`.Config.lockfile` is set pip-accel writes a lockfile after each
+successful installation (see :func:`.PipAccelerator.create_lockfile()`). The
+lockfile is a small JSON document that records for every requirement that was
+installed:
+
+- The name and version of the package.
+- The filename of its distribution archive.
+- The SHA1 checksum of its source distribution archive(s) (see
+  :attr:`.Requirement.checksum`).
+- The filename of its binary distribution in the cache (see
+  :func:`.CacheManager.generate_filename()`, wheels aren't cached so their
+  cache key is :data:`None`).
+
+Installing from a lockfile (see :func:`.PipAccelerator.install_from_lockfile()`
+or ``pip-accel install-lockfile FILENAME``) skips requirement parsing and
+resolution altogether: The binary distributions are fetched through
+:func:`.CacheManager.get()` and installed directly. pip is only used for the
+requirements whose binary distribution is missing from all caches (or was
+built from a different source distribution) and for wheels.
+
+Requirements that were already installed aren't reported by pip, which means
+they're also missing from the lockfile. To get a complete lockfile install
+into a clean environment or use pip's ``--ignore-installed`` option. Editable
+requirements can't be locked and are left out (with a warning).
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+
+# Modules included in our package.
+from pip_accel.exceptions import InvalidLockfile
+from pip_accel.req import Requirement
+from pip_accel.utils import AtomicReplace, get_python_version, makedirs
+
+# External dependencies.
+from pip.req import InstallRequirement
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+LOCKFILE_REVISION = 1
+"""The revision of the lockfile format (an integer)."""
+
+
+class LockedRequirement(Requirement):
+
+    """Requirement whose name, version and checksum are given by a lockfile."""
+
+    def __init__(self, config, entry, digest_cache=None, source_index=None):
+        """
+        Initialize a :class:`LockedRequirement` object.
+
+        :param config: A :class:`~pip_accel.config.Config` object.
+        :param entry: A dictionary with the properties of the requirement (as
+                      stored in the lockfile).
+        :param digest_cache: Refer to :class:`.Requirement`.
+        :param source_index: Refer to :class:`.Requirement`.
+        """
+        pip_requirement = InstallRequirement('%s==%s' % (entry['name'], entry['version']), None)
+        super(LockedRequirement, self).__init__(config, pip_requirement, digest_cache, source_index)
+        self.entry = entry
+        self.version = entry['version']
+        self.is_wheel = entry['is_wheel']
+        self.checksum = entry['checksum']
+
+
+def create_entry(requirement, cache_key):
+    """
+    Get the properties of a requirement that are stored in a lockfile.
+
+    :param requirement: A :class:`.Requirement` object.
+    :param cache_key: The filename of the binary distribution in the cache (a
+                      string or :data:`None`).
+    :returns: A dictionary with the properties of the requirement.
+    """
+    archive = getattr(requirement, 'archive', None)
+    if not archive and requirement.pip_requirement.link:
+        archive = requirement.pip_requirement.link.filename
+    return dict(
+        archive=os.path.basename(archive) if archive else None,
+        cache_key=cache_key,
+        checksum=requirement.checksum,
+        is_wheel=requirement.is_wheel,
+        name=requirement.name,
+        version=requirement.version,
+    )
+
+
+def write_lockfile(filename, entries):
+    """
+    Write a lockfile.
+
+    :param filename: The pathname of the lockfile (a string).
+    :param entries: A list of dictionaries created by :func:`create_entry()`.
+    """
+    document = dict(python_version=get_python_version(),
+                    requirements=entries,
+                    revision=LOCKFILE_REVISION)
+    directory = os.path.dirname(os.path.abspath(filename))
+    makedirs(directory)
+    with AtomicReplace(filename) as temporary_file:
+        with open(temporary_file, 'w') as handle:
+            json.dump(document, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+
+
+def read_lockfile(filename):
+    """
+    Read a lockfile.
+
+    :param filename: The pathname of the lockfile (a string).
+    :returns: A list of dictionaries created by :func:`create_entry()`.
+    :raises: :exc:`.InvalidLockfile` when the file isn't a lockfile or was
+             written using an unsupported revision of the format.
+    """
+    with open(filename) as handle:
+        try:
+            document = json.load(handle)
+        except ValueError:
+            document = None
+    if not (isinstance(document, dict) and document.get('revision') == LOCKFILE_REVISION):
+        raise InvalidLockfile("{filename} isn't a lockfile or uses an unsupported format!", filename=filename)
+    if document.get('python_version') != get_python_version():
+        logger.warning("Lockfile %s was created for %s but this is %s, expecting cache misses.",
+                       filename, document.get('python_version'), get_python_version())
+    return document['requirements']
@@ -0,0 +1,500 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Discovery of source distribution metadata without running ``setup.py``.
+
+To resolve a requirement set pip unpacks every source distribution archive
+into the build directory and runs ``python setup.py egg_info`` to find the
+name, version and dependencies of each requirement. That's one Python
+interpreter per requirement, even when pip-accel already has the binary
+distribution of the requirement in its cache and will never look at the
+unpacked source distribution again.
+
+Most source distributions created by setuptools include the ``*.egg-info``
+directory generated by ``setup.py egg_info`` (it contains the ``PKG-INFO``
+and ``requires.txt`` files that pip reads after running ``setup.py
+egg_info``). When :attr:`.Config.lazy_unpacking` is enabled the
+:class:`LazyUnpackPatch` context manager changes pip's preparation of source
+distributions that are available in the local source index (see
+:attr:`.Config.source_index`) and whose binary distribution is already
+cached: Instead of unpacking the archive and running ``setup.py egg_info``
+the embedded ``*.egg-info`` directory is read straight from the archive (see
+:func:`read_embedded_metadata()`) and given to pip. Such requirements are
+reported as :class:`.ResolvedRequirement` objects, so their archives are
+only unpacked when they are needed after all.
+
+The embedded ``*.egg-info`` directory was generated on the packager's
+machine, so it's wrong for ``setup.py`` scripts that compute their
+dependencies from the Python version, the platform or the environment. The
+embedded metadata of archives whose ``setup.py`` script refers to any of
+:data:`DYNAMIC_SETUP_PATTERN` (or that don't contain a ``setup.py`` script)
+isn't used, those archives are unpacked as usual.
+
+Source distributions that do need to be unpacked (because their binary
+distribution isn't cached yet) still don't need ``setup.py egg_info`` to run
+more than once: The :class:`MetadataCache` class remembers the ``*.egg-info``
+directories generated by ``setup.py egg_info``, keyed by the SHA1 checksum of
+the archive (the same checksum that's used to invalidate binary
+distributions, see :attr:`.Requirement.checksum`) and the Python version.
+Cached metadata is also used to avoid unpacking source distributions that
+don't embed an ``*.egg-info`` directory.
+"""
+
+# Standard library modules.
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import closing
+from email.parser import Parser
+
+# Modules included in our package.
+from pip_accel.req import ResolvedRequirement
+from pip_accel.utils import get_python_version, makedirs, same_directories
+
+# External dependencies.
+from pip.download import url_to_path
+from pip.req import InstallRequirement
+from pip.req import req_set as pip_req_set_module
+
+# The following package(s) are usually bundled with pip but may be unbundled
+# by redistributors and pip-accel should handle this gracefully.
+try:
+    from pip._vendor.pkg_resources import Requirement as SetuptoolsRequirement
+except ImportError:
+    from pkg_resources import Requirement as SetuptoolsRequirement
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+DYNAMIC_SETUP_PATTERN = re.compile(br'''
+    \b(?: sys\.(?:version|hexversion|platform|implementation)
+       | version_info
+       | python_version
+       | python_implementation
+       | platform\.\w+
+       | os\.(?:name|environ|getenv|uname)
+       )\b
+''', re.VERBOSE)
+"""
+Regular expression that matches ``setup.py`` scripts whose metadata may depend on the machine they run on.
+
+Such scripts may compute ``install_requires`` differently on the packager's
+machine, so the ``*.egg-info`` directory embedded in their archive can't be
+trusted (see :func:`read_embedded_metadata()`).
+"""
+
+
+class LazyUnpackPatch(object):
+
+    """
+    Monkey patch to avoid unpacking source distributions and running ``setup.py egg_info``.
+
+    This context manager monkey patches ``unpack_url()`` and
+    ``make_abstract_dist()`` in the :mod:`pip.req.req_set` module. Source
+    distributions that aren't unpacked get a source directory that only
+    contains the ``pip-egg-info`` directory that pip expects to find after
+    running ``setup.py egg_info``. The pathnames of these source directories
+    are recorded in :attr:`.PipAccelerator.deferred_archives`. Source
+    distributions that are unpacked get their ``pip-egg-info`` directory
+    from the :class:`MetadataCache` when possible.
+    """
+
+    def __init__(self, accelerator, enabled=True):
+        """
+        Initialize a :class:`LazyUnpackPatch` object.
+
+        :param accelerator: A :class:`.PipAccelerator` object.
+        :param enabled: :data:`True` to patch pip, :data:`False` to do nothing
+                        instead (see :attr:`.Config.lazy_unpacking` and
+                        :attr:`.Config.cache_metadata`).
+        """
+        self.accelerator = accelerator
+        self.config = accelerator.config
+        self.enabled = enabled
+        self.metadata_cache = MetadataCache(accelerator.config, accelerator.digest_cache)
+        self.patches = []
+
+    def __enter__(self):
+        """Enable lazy unpacking (by patching pip)."""
+        # Imported here to avoid a circular import.
+        from pip_accel import PatchedAttribute
+        if not self.enabled:
+            return
+        original_unpack_url = pip_req_set_module.unpack_url
+        original_make_abstract_dist = pip_req_set_module.make_abstract_dist
+        deferred_archives = self.accelerator.deferred_archives
+
+        def unpack_url_wrapper(link, location, *args, **kw):
+            deferred = self.defer_unpacking(link, location) if self.config.lazy_unpacking else None
+            if deferred:
+                deferred_archives[location] = deferred
+            else:
+                return original_unpack_url(link, location, *args, **kw)
+
+        def make_abstract_dist_wrapper(req_to_install):
+            if not req_to_install.editable:
+                deferred = deferred_archives.get(req_to_install.source_dir)
+                if deferred:
+                    return DeferredDist(req_to_install, deferred[1])
+                archive = find_archive(req_to_install.link, self.config.source_index)
+                if archive and self.config.cache_metadata:
+                    return self.prepare_metadata(req_to_install, archive, original_make_abstract_dist)
+            return original_make_abstract_dist(req_to_install)
+
+        self.patches = [PatchedAttribute(pip_req_set_module, 'unpack_url', unpack_url_wrapper),
+                        PatchedAttribute(pip_req_set_module, 'make_abstract_dist', make_abstract_dist_wrapper)]
+        for patch in self.patches:
+            patch.__enter__()
+
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        """Undo the changes that enable lazy unpacking."""
+        while self.patches:
+            self.patches.pop().__exit__(exc_type, exc_value, traceback)
+
+    def defer_unpacking(self, link, location):
+        """
+        Prepare a source distribution without unpacking it (when possible).
+
+        :param link: The :class:`pip.index.Link` that pip wants to unpack.
+        :param location: The directory where pip wants to unpack the archive (a string).
+        :returns: A tuple with the pathname of the archive and the version of
+                  the package (when unpacking was deferred) or :data:`None`
+                  (when pip should unpack the archive).
+        """
+        archive = find_archive(link, self.config.source_index)
+        if not archive:
+            return None
+        try:
+            metadata = ((self.config.cache_metadata and self.metadata_cache.get(archive)) or
+                        read_embedded_metadata(archive))
+            if not metadata:
+                return None
+            requirement = ResolvedRequirement(config=self.config,
+                                              requirement=InstallRequirement('%s==%s' % (metadata.name,
+                                                                                         metadata.version), None),
+                                              archive=archive,
+                                              version=metadata.version,
+                                              is_wheel=False,
+                                              build_directory=self.accelerator.build_directory,
+                                              digest_cache=self.accelerator.digest_cache,
+                                              source_index=self.accelerator.source_index)
+        except Exception as e:
+            logger.debug("Failed to read metadata of %s! (%s)", archive, e)
+            return None
+        if not self.accelerator.bdists.get_cached_binary_dist(requirement):
+            return None
+        logger.debug("Binary distribution of %s is cached, not unpacking %s.", requirement, archive)
+        metadata.write(os.path.join(location, 'pip-egg-info'))
+        return archive, metadata.version
+
+    def prepare_metadata(self, req_to_install, archive, make_abstract_dist):
+        """
+        Use cached metadata instead of running ``setup.py egg_info`` (when possible).
+
+        :param req_to_install: A :class:`pip.req.InstallRequirement` object
+                               whose archive pip just unpacked.
+        :param archive: The pathname of the archive (a string).
+        :param make_abstract_dist: pip's original ``make_abstract_dist()`` function.
+        :returns: A :class:`DeferredDist` object when the metadata is cached,
+                  otherwise pip's abstract distribution object changed to
+                  remember the metadata after ``setup.py egg_info`` has run.
+        """
+        # Imported here to avoid a circular import.
+        from pip_accel import SetupRequiresPatch
+        metadata = self.metadata_cache.get(archive)
+        if metadata:
+            logger.debug("Using cached metadata of %s.", archive)
+            metadata.write(os.path.join(req_to_install.source_dir, 'pip-egg-info'))
+            # Enable caching of setup requirements for the build.
+            SetupRequiresPatch(self.config, self.accelerator.eggs_links).create_link(req_to_install.source_dir)
+            return DeferredDist(req_to_install, metadata.version)
+        abstract_dist = make_abstract_dist(req_to_install)
+        original_prep_for_dist = abstract_dist.prep_for_dist
+
+        def prep_for_dist_wrapper():
+            original_prep_for_dist()
+            self.metadata_cache.put(archive, req_to_install.egg_info_path('').rstrip('/'))
+
+        abstract_dist.prep_for_dist = prep_for_dist_wrapper
+        return abstract_dist
+
+
+class DeferredDist(object):
+
+    """
+    Replacement for pip's ``IsSDist`` class for source distributions whose metadata is known.
+
+    pip's ``IsSDist.prep_for_dist()`` method runs ``setup.py egg_info``, this
+    class skips that step because the ``pip-egg-info`` directory was already
+    created by :class:`LazyUnpackPatch`.
+    """
+
+    def __init__(self, req_to_install, version):
+        """
+        Initialize a :class:`DeferredDist` object.
+
+        :param req_to_install: A :class:`pip.req.InstallRequirement` object.
+        :param version: The version of the package (a string).
+        """
+        self.req_to_install = req_to_install
+        self.version = version
+
+    def prep_for_dist(self):
+        """Make sure the requirement is named (like ``setup.py egg_info`` would)."""
+        if not self.req_to_install.req:
+            self.req_to_install.req = SetuptoolsRequirement.parse('%s==%s' % (self.req_to_install.pkg_info()['Name'],
+                                                                              self.version))
+
+    def dist(self, finder):
+        """Get the distribution (a :class:`pkg_resources.Distribution` object) of the ``pip-egg-info`` directory."""
+        return self.req_to_install.get_dist()
+
+
+class MetadataCache(object):
+
+    """Persistent cache of the ``*.egg-info`` directories generated by ``setup.py egg_info``."""
+
+    def __init__(self, config, digest_cache):
+        """
+        Initialize a :class:`MetadataCache` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        :param digest_cache: The :class:`.DigestCache` used to calculate the
+                             checksums of archives.
+        """
+        self.config = config
+        self.digest_cache = digest_cache
+
+    def get(self, archive):
+        """
+        Get the cached metadata of a source distribution.
+
+        :param archive: The pathname of the archive (a string).
+        :returns: An :class:`EggInfo` object or :data:`None`.
+        """
+        directory = self.get_directory(archive)
+        try:
+            for entry in os.listdir(directory):
+                if entry.endswith('.egg-info'):
+                    return load_egg_info(os.path.join(directory, entry))
+        except (IOError, OSError):
+            pass
+        return None
+
+    def put(self, archive, egg_info):
+        """
+        Add the metadata of a source distribution to the cache.
+
+        :param archive: The pathname of the archive (a string).
+        :param egg_info: The pathname of the ``*.egg-info`` directory
+                         generated by ``setup.py egg_info`` (a string).
+
+        The files are copied to a temporary directory that's renamed into
+        place, so concurrent pip-accel processes never see partial metadata.
+        """
+        directory = self.get_directory(archive)
+        if os.path.isdir(directory):
+            return
+        temporary_directory = None
+        try:
+            makedirs(self.config.metadata_cache)
+            temporary_directory = tempfile.mkdtemp(prefix='.tmp-', dir=self.config.metadata_cache)
+            load_egg_info(egg_info).write(temporary_directory)
+            os.rename(temporary_directory, directory)
+            logger.debug("Cached metadata of %s in %s.", archive, directory)
+        except (IOError, OSError) as e:
+            logger.debug("Failed to cache metadata of %s! (%s)", archive, e)
+            if temporary_directory and os.path.isdir(temporary_directory):
+                shutil.rmtree(temporary_directory)
+
+    def get_directory(self, archive):
+        """
+        Get the directory that stores the metadata of a source distribution.
+
+        :param archive: The pathname of the archive (a string).
+        :returns: The pathname of a directory in :attr:`.Config.metadata_cache` (a string).
+        """
+        return os.path.join(self.config.metadata_cache, '%s-%s' % (self.digest_cache.get_digest('sha1', archive),
+                                                                   get_python_version()))
+
+
+class EggInfo(object):
+
+    """The contents of an ``*.egg-info`` directory."""
+
+    def __init__(self, directory, files):
+        """
+        Initialize an :class:`EggInfo` object.
+
+        :param directory: The name of the ``*.egg-info`` directory (a string).
+        :param files: A dictionary that maps filenames to their contents (byte strings).
+        """
+        self.directory = directory
+        self.files = files
+        self.pkg_info = Parser().parsestr(files['PKG-INFO'].decode('UTF-8', 'replace'))
+
+    @property
+    def name(self):
+        """The name of the package (a string)."""
+        return self.pkg_info['Name']
+
+    @property
+    def version(self):
+        """The version of the package (a string)."""
+        return self.pkg_info['Version']
+
+    def write(self, directory):
+        """
+        Create the ``*.egg-info`` directory.
+
+        :param directory: The directory in which the ``*.egg-info`` directory
+                          is created (a string).
+        """
+        pathname = os.path.join(directory, self.directory)
+        os.makedirs(pathname)
+        for filename, contents in self.files.items():
+            with open(os.path.join(pathname, filename), 'wb') as handle:
+                handle.write(contents)
+
+
+def find_archive(link, source_index):
+    """
+    Find the source distribution archive in the source index that a link refers to.
+
+    :param link: A :class:`pip.index.Link` object (or :data:`None`).
+    :param source_index: The pathname of the source index (a string).
+    :returns: The pathname of the archive (a string) or :data:`None` when
+              the link doesn't refer to a source distribution archive in the
+              source index.
+
+    Remote archives are found in the source index once pip has downloaded
+    them (pip also uses these copies instead of downloading them again).
+    Local archives outside of the source index are ignored because the
+    source index may contain a different archive with the same filename
+    (see :func:`.PipAccelerator.decorate_arguments()`).
+    """
+    if link is None or link.is_wheel:
+        return None
+    if link.scheme == 'file':
+        archive = url_to_path(link.url_without_fragment)
+        if not same_directories(os.path.dirname(archive), source_index):
+            return None
+    else:
+        archive = os.path.join(source_index, link.filename)
+    return archive if os.path.isfile(archive) else None
+
+
+def load_egg_info(pathname):
+    """
+    Read an ``*.egg-info`` directory.
+
+    :param pathname: The pathname of the directory (a string).
+    :returns: An :class:`EggInfo` object.
+    :raises: :exc:`~exceptions.IOError` when the directory doesn't contain a
+             ``PKG-INFO`` file.
+    """
+    files = {}
+    for filename in os.listdir(pathname):
+        if os.path.isfile(os.path.join(pathname, filename)):
+            with open(os.path.join(pathname, filename), 'rb') as handle:
+                files[filename] = handle.read()
+    if 'PKG-INFO' not in files:
+        raise IOError("Missing PKG-INFO file in %s!" % pathname)
+    return EggInfo(os.path.basename(pathname), files)
+
+
+def read_embedded_metadata(archive):
+    """
+    Read the ``*.egg-info`` directory embedded in a source distribution archive.
+
+    :param archive: The pathname of a tar or zip archive (a string).
+    :returns: An :class:`EggInfo` object or :data:`None` when the
+              archive doesn't contain exactly one top level ``*.egg-info``
+              directory with a ``PKG-INFO`` file that defines the name and
+              version of the package, or when the metadata can't be trusted
+              (see :func:`is_dynamic_setup_script()`).
+
+    The ``*.egg-info`` directory closest to the root of the archive is used,
+    just like pip does after running ``setup.py egg_info``.
+    """
+    candidates = {}
+    setup_scripts = {}
+    if zipfile.is_zipfile(archive):
+        with closing(zipfile.ZipFile(archive)) as handle:
+            for name in handle.namelist():
+                if not name.endswith('/') and (is_metadata_file(name) or is_setup_script(name)):
+                    (candidates if is_metadata_file(name) else setup_scripts)[name] = handle.read(name)
+    else:
+        with closing(tarfile.open(archive)) as handle:
+            for member in handle:
+                if member.isfile() and (is_metadata_file(member.name) or is_setup_script(member.name)):
+                    contents = handle.extractfile(member).read()
+                    (candidates if is_metadata_file(member.name) else setup_scripts)[member.name] = contents
+    if not candidates:
+        return None
+    if not setup_scripts:
+        logger.debug("Not using embedded metadata of %s (no setup.py script found).", archive)
+        return None
+    setup_script = min(setup_scripts, key=lambda name: name.count('/'))
+    if is_dynamic_setup_script(setup_scripts[setup_script]):
+        logger.debug("Not using embedded metadata of %s (%s may compute its dependencies).",
+                     archive, setup_script)
+        return None
+    depth = min(name.count('/') for name in candidates)
+    directories = set(posixpath.dirname(name) for name in candidates if name.count('/') == depth)
+    if len(directories) != 1:
+        return None
+    directory = directories.pop()
+    files = dict((posixpath.basename(name), contents) for name, contents in candidates.items()
+                 if posixpath.dirname(name) == directory)
+    if 'PKG-INFO' not in files:
+        return None
+    metadata = EggInfo(posixpath.basename(directory), files)
+    if not (metadata.name and metadata.version):
+        return None
+    return metadata
+
+
+def is_setup_script(name):
+    """
+    Check whether an archive member is a ``setup.py`` script.
+
+    :param name: The name of the archive member (a string).
+    :returns: :data:`True` if the member is named ``setup.py``, :data:`False` otherwise.
+    """
+    return posixpath.basename(name) == 'setup.py'
+
+
+def is_dynamic_setup_script(contents):
+    """
+    Check whether the metadata of a ``setup.py`` script may depend on the machine it runs on.
+
+    :param contents: The contents of the ``setup.py`` script (a byte string).
+    :returns: :data:`True` if the script matches :data:`DYNAMIC_SETUP_PATTERN`,
+              :data:`False` otherwise.
+
+    This is a conservative check: It also matches scripts that only use
+    e.g. :data:`sys.version_info` to pick a different ``README`` file. Those
+    archives are simply unpacked as usual.
+    """
+    return DYNAMIC_SETUP_PATTERN.search(contents) is not None
+
+
+def is_metadata_file(name):
+    """
+    Check whether an archive member is a file in an ``*.egg-info`` directory.
+
+    :param name: The name of the archive member (a string).
+    :returns: :data:`True` if the parent directory of the member is named
+              ``*.egg-info``, :data:`False` otherwise.
+    """
+    return posixpath.dirname(name).endswith('.egg-info')
@@ -0,0 +1,252 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Streaming pipeline that overlaps downloading, building and installing.
+
+By default :func:`.PipAccelerator.install_from_arguments()` works in strictly
+separated phases: First pip downloads and unpacks the complete requirement
+set, then the missing binary distributions are built and finally everything
+is installed. This means the network sits idle while the CPU is building and
+vice versa.
+
+When :attr:`.Config.pipeline` is enabled a :class:`Pipeline` is used instead.
+It hooks into pip's requirement preparation so that each requirement is handed
+over to the next stage as soon as pip has unpacked it:
+
+1. The main thread runs pip, which downloads and unpacks requirements one at a
+   time and feeds them into the pipeline.
+2. One or more builder threads (see :attr:`.Config.build_jobs`) look up each
+   requirement in the binary cache and build the binary distribution when it
+   is missing.
+3. A single installer thread installs the resulting binary distributions, in
+   the order in which they become available.
+
+The stages are linked by bounded queues, so when a later stage falls behind
+the earlier stages block instead of piling up unpacked source distributions.
+Editable requirements and wheels are installed by pip itself and are deferred
+until pip has finished, because running two pip commands concurrently in one
+process isn't safe.
+
+The builder threads and the installer thread share the
+:class:`.BinaryDistributionManager` of the :class:`.PipAccelerator`. Its shared
+state is thread safe: The :class:`.CacheManager` guards its state with a lock,
+the Amazon S3 cache backend uses a connection per thread and the
+:class:`.MissCache`, :class:`.DigestCache` and :class:`.BuildTimes` guard
+their read-modify-write cycles with locks.
+"""
+
+# Standard library modules.
+import logging
+import threading
+
+# External dependencies.
+from humanfriendly import Timer, pluralize
+from pip.req import RequirementSet
+
+# Modules included in our package.
+from pip_accel.compat import queue
+from pip_accel.req import ResolvedRequirement
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+
+class Pipeline(object):
+
+    """Download, build and install a requirement set in overlapping stages."""
+
+    def __init__(self, accelerator, queue_size=None, **kw):
+        """
+        Initialize a :class:`Pipeline` object.
+
+        :param accelerator: A :class:`.PipAccelerator` object.
+        :param queue_size: The maximum number of requirements waiting between
+                           two stages (an integer, defaults to twice the
+                           number of builder threads).
+        :param kw: Any keyword arguments are passed on to
+                   :func:`.PipAccelerator.install_requirement()`.
+        """
+        self.accelerator = accelerator
+        self.config = accelerator.config
+        self.install_options = kw
+        self.queue_size = queue_size or 2 * self.config.build_jobs
+        self.prepared = queue.Queue(self.queue_size)
+        self.resolved = queue.Queue(self.queue_size)
+        self.threads = []
+        self.versions = {}
+        self.installed = []
+        self.deferred = []
+        self.error = None
+        self.aborted = False
+
+    def run(self, arguments):
+        """
+        Download, build and install the requirements given on the command line.
+
+        :param arguments: The command line arguments to ``pip install ..`` (a
+                          list of strings).
+        :returns: The number of packages that were installed (an integer).
+        """
+        # Imported here to avoid a circular import.
+        from pip_accel import PatchedAttribute
+        pipeline_timer = Timer()
+        use_wheels = self.accelerator.arguments_allow_wheels(arguments)
+        original_prepare_file = RequirementSet._prepare_file
+        original_clear_build_directory = self.accelerator.clear_build_directory
+
+        def prepare_file_wrapper(requirement_set, finder, req_to_install):
+            more_reqs = original_prepare_file(requirement_set, finder, req_to_install)
+            self.feed(req_to_install)
+            return more_reqs
+
+        def clear_build_directory_wrapper():
+            # Don't remove unpacked source distributions that are still being
+            # built (this happens when pip-accel falls back from the local
+            # source index to downloading distributions).
+            self.drain()
+            original_clear_build_directory()
+
+        self.start()
+        try:
+            with PatchedAttribute(RequirementSet, '_prepare_file', prepare_file_wrapper):
+                with PatchedAttribute(self.accelerator, 'clear_build_directory', clear_build_directory_wrapper):
+                    requirements = self.accelerator.get_requirements(arguments, use_wheels=use_wheels)
+            # Requirements from a cached resolution never pass through pip
+            # (see pip_accel.resolution) so they're submitted here.
+            for requirement in requirements:
+                if isinstance(requirement, ResolvedRequirement):
+                    self.submit(requirement)
+        except Exception:
+            self.stop(abort=True)
+            raise
+        self.stop()
+        if self.error is not None:
+            raise self.error
+        # Install the requirements that pip needs to install itself.
+        if any(r.is_wheel for r in self.deferred) and not self.accelerator.setuptools_supports_wheels():
+            logger.info("Preparing to upgrade to setuptools >= 0.8 to enable wheel support ..")
+            self.deferred[:0] = self.accelerator.get_requirements(['setuptools >= 0.8'])
+        for requirement in self.deferred:
+            self.accelerator.install_requirement(requirement, **self.install_options)
+            self.installed.append(requirement)
+        if self.installed:
+            logger.info("Finished installing %s in %s.",
+                        pluralize(len(self.installed), "requirement"),
+                        pipeline_timer)
+        elif not requirements:
+            logger.info("Nothing to do! (requirements already installed)")
+        return len(self.installed)
+
+    def start(self):
+        """Start the builder and installer threads."""
+        for i in range(self.config.build_jobs):
+            self.threads.append(self.spawn(self.build_stage, 'builder-%i' % (i + 1)))
+        self.installer = self.spawn(self.install_stage, 'installer')
+
+    def stop(self, abort=False):
+        """
+        Wait for the builder and installer threads to finish.
+
+        :param abort: :data:`True` to skip the requirements that are still
+                      queued (used when pip fails), :data:`False` to process
+                      them.
+        """
+        if abort:
+            self.aborted = True
+        for thread in self.threads:
+            self.prepared.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.resolved.put(None)
+        self.installer.join()
+
+    def drain(self):
+        """Wait until all requirements fed into the pipeline have been processed."""
+        self.prepared.join()
+        self.resolved.join()
+
+    def spawn(self, target, name):
+        """Start a daemon thread that runs one of the pipeline stages."""
+        thread = threading.Thread(target=target, name='pip-accel-%s' % name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def feed(self, pip_requirement):
+        """
+        Feed a requirement that pip just prepared into the pipeline.
+
+        :param pip_requirement: A :class:`pip.req.InstallRequirement` object.
+        :raises: The exception raised by one of the later stages (to stop pip
+                 as soon as possible when a build or installation failed).
+
+        Requirements that pip won't unpack are ignored, just like
+        :func:`.PipAccelerator.transform_pip_requirement_set()` does. So are
+        requirements whose name and version were already fed into the pipeline
+        (pip calls its preparation logic more than once for some requirements
+        and pip-accel may run pip more than once).
+        """
+        if self.error is not None:
+            raise self.error
+        if pip_requirement.satisfied_by or pip_requirement.constraint:
+            return
+        self.submit(self.accelerator.create_requirement(pip_requirement))
+
+    def submit(self, requirement):
+        """
+        Submit a requirement to the pipeline.
+
+        :param requirement: A :class:`.Requirement` object.
+        """
+        key = requirement.name.lower()
+        if self.versions.get(key) == requirement.version:
+            logger.debug("Skipping %s (already in pipeline).", requirement)
+            return
+        self.versions[key] = requirement.version
+        logger.debug("Feeding %s into pipeline ..", requirement)
+        self.prepared.put(requirement)
+
+    def build_stage(self):
+        """Make sure binary distributions are available in the cache (runs in a builder thread)."""
+        bdists = self.accelerator.bdists
+        while True:
+            requirement = self.prepared.get()
+            try:
+                if requirement is None:
+                    break
+                if self.error is None and not self.aborted:
+                    if not (requirement.is_editable or requirement.is_wheel):
+                        bdists.get_or_build_binary_dist(requirement, interactive=False)
+                    self.resolved.put(requirement)
+            except Exception as e:
+                self.fail(requirement, e)
+            finally:
+                self.prepared.task_done()
+
+    def install_stage(self):
+        """Install binary distributions as they become available (runs in the installer thread)."""
+        while True:
+            requirement = self.resolved.get()
+            try:
+                if requirement is None:
+                    break
+                if self.error is None and not self.aborted:
+                    if requirement.is_editable or requirement.is_wheel:
+                        self.deferred.append(requirement)
+                    else:
+                        self.accelerator.install_requirement(requirement, **self.install_options)
+                        self.installed.append(requirement)
+            except Exception as e:
+                self.fail(requirement, e)
+            finally:
+                self.resolved.task_done()
+
+    def fail(self, requirement, exception):
+        """Remember the first exception raised by a pipeline stage."""
+        logger.error("Pipeline failed on %s: %s", requirement, exception)
+        if self.error is None:
+            self.error = exception
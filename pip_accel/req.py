@@ -1,7 +1,7 @@
 # Accelerator for pip, the Python package manager.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: February 2, 2016
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """
@@ -27,19 +27,25 @@ basically undocumented AFAIK).
 """
 
 # Standard library modules.
+import ast
 import glob
 import logging
 import os
 import re
+import threading
 import time
 
 # Modules included in our package.
+from pip_accel.compat import basestring, configparser
+from pip_accel.digests import DigestCache
 from pip_accel.exceptions import UnknownDistributionFormat
-from pip_accel.utils import hash_files
+from pip_accel.utils import get_mtime_ns
 
 # External dependencies.
 from cached_property import cached_property
+from pip.index import PackageFinder
 from pip.req import InstallRequirement
+from pip.utils import unpack_file
 
 # The following package(s) are usually bundled with pip but may be unbundled
 # by redistributors and pip-accel should handle this gracefully.
@@ -58,14 +64,20 @@ class Requirement(object):
 
     """Simple wrapper for the requirement objects defined by pip and setuptools."""
 
-    def __init__(self, config, requirement):
+    def __init__(self, config, requirement, digest_cache=None, source_index=None):
         """
         Initialize a requirement object.
 
         :param config: A :class:`~pip_accel.config.Config` object.
         :param requirement: A :class:`pip.req.InstallRequirement` object.
+        :param digest_cache: The :class:`.DigestCache` used to calculate
+                             :attr:`checksum` (optional).
+        :param source_index: The :class:`SourceIndex` used to find
+                             :attr:`related_archives` (optional).
         """
         self.config = config
+        self.digest_cache = digest_cache or DigestCache(config)
+        self.source_index = source_index or SourceIndex(config)
         self.pip_requirement = requirement
         self.setuptools_requirement = requirement.req
 
@@ -103,23 +115,11 @@ class Requirement(object):
                   reported by this property are only used for cache
                   invalidation (see the :attr:`last_modified` and
                   :attr:`checksum` properties).
+
+        The archives are found using :attr:`source_index` (which is shared by
+        all requirements so the directory isn't scanned for every requirement).
         """
-        # Escape the requirement's name for use in a regular expression.
-        name_pattern = escape_name(self.name)
-        # Escape the requirement's version for in a regular expression.
-        version_pattern = re.escape(self.version)
-        # Create a regular expression that matches any of the known source
-        # distribution archive extensions.
-        extension_pattern = '|'.join(re.escape(ext) for ext in ARCHIVE_EXTENSIONS if ext != '.whl')
-        # Compose the regular expression pattern to match filenames of source
-        # distribution archives in the local source index directory.
-        pattern = '^%s-%s(%s)$' % (name_pattern, version_pattern, extension_pattern)
-        # Compile the regular expression for case insensitive matching.
-        compiled_pattern = re.compile(pattern, re.IGNORECASE)
-        # Find the matching source distribution archives.
-        return [os.path.join(self.config.source_index, fn)
-                for fn in os.listdir(self.config.source_index)
-                if compiled_pattern.match(fn)]
+        return self.source_index.find_archives(self.name, self.version)
 
     @cached_property
     def last_modified(self):
@@ -142,9 +142,11 @@ class Requirement(object):
 
         The value of this property is based on the :attr:`related_archives`
         property. If no related archives are found the SHA1 digest of the empty
-        string is reported.
+        string is reported. Checksums are looked up in the :class:`.DigestCache`
+        (which only remembers them between runs when
+        :attr:`.Config.trust_mod_times` is :data:`True`).
         """
-        return hash_files('sha1', *sorted(self.related_archives))
+        return self.digest_cache.get_digest('sha1', *sorted(self.related_archives))
 
     @cached_property
     def source_directory(self):
@@ -227,6 +229,33 @@ class Requirement(object):
         """
         return self.pip_requirement.editable
 
+    @cached_property
+    def setup_requires(self):
+        """
+        The setup requirements declared by the source distribution (a list of strings).
+
+        These are the requirements that have to be available before the
+        ``setup.py`` script can do its job. Because running ``setup.py``
+        just to find out is exactly the kind of thing pip-accel tries to
+        avoid, the setup requirements are found by static inspection of the
+        unpacked source distribution:
+
+        - The ``setup_requires`` option in the ``[options]`` section of
+          ``setup.cfg``.
+        - Literal ``setup_requires`` keyword arguments in ``setup.py``.
+
+        Setup scripts that compute their setup requirements at runtime are not
+        supported (their setup requirements will be missing from this list).
+        Wheels never have setup requirements.
+        """
+        if self.is_wheel:
+            return []
+        requirements = []
+        for expression in find_setup_requires(self.source_directory):
+            if expression not in requirements:
+                requirements.append(expression)
+        return requirements
+
     @cached_property
     def sdist_metadata(self):
         """Get the distribution metadata of an unpacked source distribution."""
@@ -249,6 +278,50 @@ class Requirement(object):
         return "%s (%s)" % (self.name, self.version)
 
 
+class ResolvedRequirement(Requirement):
+
+    """
+    Requirement whose name, version and archive are known without running pip.
+
+    These requirements are created from a cached resolution (see
+    :class:`.ResolutionCache`). Their archives are only unpacked when
+    :attr:`source_directory` is needed, for example to build a binary
+    distribution that isn't cached yet or to install a wheel.
+    """
+
+    def __init__(self, config, requirement, archive, version, is_wheel, build_directory,
+                 digest_cache=None, source_index=None):
+        """
+        Initialize a :class:`ResolvedRequirement` object.
+
+        :param config: A :class:`~pip_accel.config.Config` object.
+        :param requirement: A :class:`pip.req.InstallRequirement` object
+                            without a source directory.
+        :param archive: The pathname of the distribution archive (a string).
+        :param version: The version of the package (a string).
+        :param is_wheel: :data:`True` if the archive is a wheel,
+                         :data:`False` otherwise.
+        :param build_directory: The directory where the archive is unpacked
+                                when needed (a string).
+        :param digest_cache: Refer to :class:`Requirement`.
+        :param source_index: Refer to :class:`Requirement`.
+        """
+        super(ResolvedRequirement, self).__init__(config, requirement, digest_cache, source_index)
+        self.archive = archive
+        self.version = version
+        self.is_wheel = is_wheel
+        self.build_directory = build_directory
+
+    @cached_property
+    def source_directory(self):
+        """The pathname of the directory containing the unpacked archive (a string, unpacked on first use)."""
+        directory = self.pip_requirement.source_dir or os.path.join(self.build_directory, self.name)
+        logger.debug("Unpacking %s to %s ..", self.archive, directory)
+        unpack_file(self.archive, directory, None, None)
+        self.pip_requirement.source_dir = directory
+        return directory
+
+
 class TransactionalUpdate(object):
 
     """Context manager that enables transactional package upgrades."""
@@ -287,6 +360,190 @@ class TransactionalUpdate(object):
             self.in_transaction = False
 
 
+class SourceIndex(object):
+
+    """
+    In-memory index of the local source distribution index directory.
+
+    Finding the source distribution archives of a requirement used to scan
+    the complete directory (see :attr:`.Config.source_index`) for every
+    requirement, which is quadratic for big requirement sets and big source
+    indexes. This class scans the directory once and maps the normalized
+    names of archives (without their filename extension) to their
+    filenames. The directory is scanned again when its last modified time
+    changes (e.g. because pip downloaded an archive). Instances can be
+    shared between threads.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`SourceIndex` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        """
+        self.config = config
+        self.lock = threading.Lock()
+        self.filenames = None
+        self.entries = None
+        self.mtime = None
+        self.racy = False
+
+    def find_archives(self, name, version):
+        """
+        Find the source distribution archives of a package.
+
+        :param name: The name of the package (a string).
+        :param version: The version of the package (a string).
+        :returns: A list with the pathnames of matching archives (strings).
+
+        Dashes and underscores in the name are treated as equivalent and
+        matching is case insensitive (see :func:`escape_name()`).
+        """
+        # The index finds the candidates, the regular expression makes sure
+        # that only the name (not the version) is normalized.
+        pattern = re.compile('^%s-%s$' % (escape_name(name), re.escape(version)), re.IGNORECASE)
+        with self.lock:
+            self.refresh()
+            candidates = self.entries.get(normalize_archive_name('%s-%s' % (name, version)), [])
+        return [os.path.join(self.config.source_index, filename)
+                for stem, filename in candidates if pattern.match(stem)]
+
+    def get_filenames(self):
+        """
+        Get the filenames in the source index directory.
+
+        :returns: A list of filenames (strings).
+        """
+        with self.lock:
+            self.refresh()
+            return list(self.filenames)
+
+    def refresh(self):
+        """Scan the source index directory when it has changed since the last scan (the caller holds :attr:`lock`)."""
+        if self.entries is None or self.racy or self.get_mtime() != self.mtime:
+            self.scan()
+
+    def scan(self):
+        """Scan the source index directory (the caller holds :attr:`lock`)."""
+        started = time.time()
+        self.mtime = self.get_mtime()
+        # File systems with a resolution of a second (or worse) can change the
+        # directory within the second of its last modified time without
+        # changing that time, so such scans aren't trusted until the second
+        # has passed (the same trick is used by git).
+        self.racy = self.mtime is not None and self.mtime % 1000000000 == 0 and \
+            self.mtime // 1000000000 >= int(started)
+        try:
+            self.filenames = os.listdir(self.config.source_index)
+        except OSError:
+            self.filenames = []
+        extensions = [ext.lower() for ext in ARCHIVE_EXTENSIONS if ext != '.whl']
+        entries = {}
+        for filename in self.filenames:
+            lowercase_filename = filename.lower()
+            for ext in extensions:
+                if lowercase_filename.endswith(ext):
+                    stem = filename[:-len(ext)]
+                    entries.setdefault(normalize_archive_name(stem), []).append((stem, filename))
+        self.entries = entries
+        logger.debug("Scanned %i entries in source index in %.2f seconds.", len(self.filenames), time.time() - started)
+
+    def get_mtime(self):
+        """The last modified time of the source index directory (an integer number of nanoseconds or :data:`None`)."""
+        try:
+            return get_mtime_ns(os.stat(self.config.source_index))
+        except OSError:
+            return None
+
+
+class CustomPackageFinder(PackageFinder):
+
+    """
+    Custom :class:`pip.index.PackageFinder` to keep pip off the internet.
+
+    This class customizes :class:`pip.index.PackageFinder` to enforce what
+    the ``--no-index`` option does for the default package index but doesn't do
+    for package indexes registered with the ``--index=`` option in requirements
+    files. Judging by pip's documentation the fact that this has to be monkey
+    patched seems like a bug / oversight in pip (IMHO).
+    """
+
+    @property
+    def index_urls(self):
+        """Dummy list of index URLs that is always empty."""
+        return []
+
+    @index_urls.setter
+    def index_urls(self, value):
+        """Dummy setter for index URLs that ignores the value set."""
+        pass
+
+    @property
+    def dependency_links(self):
+        """Dummy list of dependency links that is always empty."""
+        return []
+
+    @dependency_links.setter
+    def dependency_links(self, value):
+        """Dummy setter for dependency links that ignores the value set."""
+        pass
+
+
+def normalize_archive_name(name):
+    """
+    Normalize the name of a source distribution archive for use in :class:`SourceIndex`.
+
+    :param name: The filename of an archive without extension (a string).
+    :returns: The lowercased name with underscores replaced by dashes (a string).
+    """
+    return name.lower().replace('_', '-')
+
+
+def find_setup_requires(directory):
+    """
+    Statically find the setup requirements of an unpacked source distribution.
+
+    :param directory: The pathname of the directory containing the unpacked
+                      source distribution (a string).
+    :returns: A generator of requirement expressions (strings).
+    """
+    config_file = os.path.join(directory, 'setup.cfg')
+    if os.path.isfile(config_file):
+        parser = configparser.RawConfigParser()
+        try:
+            parser.read(config_file)
+            if parser.has_option('options', 'setup_requires'):
+                for expression in re.split(r'[\n;]', parser.get('options', 'setup_requires')):
+                    if expression.strip():
+                        yield expression.strip()
+        except configparser.Error as e:
+            logger.debug("Failed to parse %s! (%s)", config_file, e)
+    setup_script = os.path.join(directory, 'setup.py')
+    if os.path.isfile(setup_script):
+        try:
+            with open(setup_script, 'rb') as handle:
+                tree = ast.parse(handle.read(), setup_script)
+        except (SyntaxError, TypeError, ValueError) as e:
+            # The setup script may target a different major version of Python
+            # or use an encoding that the ast module doesn't understand.
+            logger.debug("Failed to parse %s! (%s)", setup_script, e)
+            return
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                for keyword in node.keywords:
+                    if keyword.arg == 'setup_requires':
+                        try:
+                            value = ast.literal_eval(keyword.value)
+                        except ValueError:
+                            # Computed at runtime, we can't know.
+                            continue
+                        if isinstance(value, basestring):
+                            value = value.splitlines()
+                        for expression in value:
+                            if isinstance(expression, basestring) and expression.strip():
+                                yield expression.strip()
+
+
 def escape_name(requirement_name):
     """
     Escape a requirement's name for use in a regular expression.
@@ -0,0 +1,249 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Persistent memoization of requirement set resolution.
+
+Even when all binary distributions are cached pip-accel runs ``pip install
+--download --no-index`` to find out which distributions should be installed.
+This parses the requirement files, resolves the requirement set and unpacks
+every archive into a build directory just to learn the names and versions of
+the requirements, which takes tens of seconds for big requirement sets.
+
+The :class:`ResolutionCache` class remembers the outcome of resolution (the
+name, version and archive of each requirement) under a key that covers
+everything that can change the outcome:
+
+- The (decorated) command line arguments and the contents of the requirement
+  and constraint files they refer to (recursively).
+- The contents of pip's configuration files and the ``$PIP_*`` environment
+  variables.
+- The filenames in the local source index (see :attr:`.Config.source_index`).
+  Resolution only considers the archives in the source index, so adding an
+  archive (e.g. a newer version) changes the key.
+- The Python interpreter and the version of pip.
+
+When pip-accel finds a resolution under the same key it creates
+:class:`.ResolvedRequirement` objects without running pip at all. Their
+archives are only unpacked when needed (to build a binary distribution that
+isn't cached yet or to install a wheel). The cache is stored as a small JSON
+document in the data directory (see :attr:`.Config.data_directory`).
+
+Some resolutions aren't remembered because they can't be reproduced without
+pip: Resolutions involving editable requirements or archives outside of the
+source index and resolutions in which pip skipped requirements that were
+already installed (because pip doesn't resolve the dependencies of those
+requirements). Likewise a cached resolution isn't used when one of its
+requirements is already installed, in that case pip decides what to skip.
+"""
+
+# Standard library modules.
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+# Modules included in our package.
+from pip_accel.compat import basestring
+from pip_accel.inputs import IGNORED_VARIABLES, find_configuration_files, find_requirement_files
+from pip_accel.req import ResolvedRequirement
+from pip_accel.utils import AtomicReplace, makedirs, match_option
+
+# External dependencies.
+from cached_property import cached_property
+from pip import __version__ as pip_version
+from pip.exceptions import InstallationError
+from pip.req import InstallRequirement
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 100
+"""The maximum number of resolutions remembered (an integer, the oldest resolutions are forgotten first)."""
+
+
+class ResolutionCache(object):
+
+    """Persistent cache of resolved requirement sets."""
+
+    def __init__(self, config, digest_cache, source_index):
+        """
+        Initialize a :class:`ResolutionCache` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        :param digest_cache: The :class:`.DigestCache` used to hash requirement
+                             files and passed on to requirements.
+        :param source_index: The :class:`.SourceIndex` used to fingerprint the
+                             source index and passed on to requirements.
+        """
+        self.config = config
+        self.digest_cache = digest_cache
+        self.source_index = source_index
+
+    @cached_property
+    def filename(self):
+        """The pathname of the JSON document that stores the resolutions (a string)."""
+        return os.path.join(self.config.data_directory, 'resolutions.json')
+
+    def get(self, arguments, use_wheels, build_directory):
+        """
+        Get the cached resolution of a requirement set.
+
+        :param arguments: The (decorated) command line arguments to ``pip
+                          install ...`` (a list of strings).
+        :param use_wheels: Whether wheels are allowed (a boolean).
+        :param build_directory: The directory where archives are unpacked when
+                                needed (a string).
+        :returns: A list of :class:`.ResolvedRequirement` objects or
+                  :data:`None` when no usable resolution is cached.
+        """
+        key = self.get_key(arguments, use_wheels)
+        entry = self.load().get(key) if key else None
+        if not entry:
+            return None
+        ignore_installed = any(match_option(a, '-I', '--ignore-installed') for a in arguments)
+        requirements = []
+        for properties in entry['requirements']:
+            archive = os.path.join(self.config.source_index, properties['archive'])
+            if not os.path.isfile(archive):
+                return None
+            comes_from = properties['comes_from']
+            if properties['required_by']:
+                comes_from = InstallRequirement(properties['required_by'], None)
+            pip_requirement = InstallRequirement(properties['requirement'], comes_from)
+            for name, value in properties['options'].items():
+                setattr(pip_requirement, name, value)
+            if not ignore_installed:
+                try:
+                    pip_requirement.check_if_exists()
+                except InstallationError:
+                    return None
+                if pip_requirement.satisfied_by:
+                    logger.debug("Not using cached resolution because %s is already installed.", pip_requirement)
+                    return None
+            requirements.append(ResolvedRequirement(config=self.config,
+                                                    requirement=pip_requirement,
+                                                    archive=archive,
+                                                    version=properties['version'],
+                                                    is_wheel=properties['is_wheel'],
+                                                    build_directory=build_directory,
+                                                    digest_cache=self.digest_cache,
+                                                    source_index=self.source_index))
+        return requirements
+
+    def put(self, arguments, use_wheels, requirement_set, requirements):
+        """
+        Remember the resolution of a requirement set.
+
+        :param arguments: The (decorated) command line arguments to ``pip
+                          install ...`` (a list of strings).
+        :param use_wheels: Whether wheels are allowed (a boolean).
+        :param requirement_set: The :class:`pip.req.RequirementSet` object
+                                reported by pip.
+        :param requirements: The list of :class:`.Requirement` objects created
+                             from the requirement set.
+        :returns: :data:`True` if the resolution was stored, :data:`False` if
+                  it can't be reproduced from the cache (see above) or won't
+                  be used (because ``-U`` or ``--upgrade`` was given).
+        """
+        if any(match_option(a, '-U', '--upgrade') for a in arguments):
+            return False
+        if any(r.satisfied_by and not r.constraint for r in requirement_set.requirements.values()):
+            return False
+        entries = []
+        for requirement in requirements:
+            pip_requirement = requirement.pip_requirement
+            if requirement.is_editable or not pip_requirement.link:
+                return False
+            archive = pip_requirement.link.filename
+            if not os.path.isfile(os.path.join(self.config.source_index, archive)):
+                return False
+            comes_from = pip_requirement.comes_from
+            entries.append(dict(
+                archive=archive,
+                comes_from=comes_from if isinstance(comes_from, basestring) else None,
+                is_wheel=requirement.is_wheel,
+                options=dict(isolated=pip_requirement.isolated,
+                             pycompile=pip_requirement.pycompile,
+                             target_dir=pip_requirement.target_dir,
+                             use_user_site=pip_requirement.use_user_site),
+                requirement=str(pip_requirement.req),
+                required_by=(comes_from.name if isinstance(comes_from, InstallRequirement) else None),
+                version=requirement.version,
+            ))
+        key = self.get_key(arguments, use_wheels)
+        if not key:
+            return False
+        self.save(key, dict(requirements=entries, time=time.time()))
+        return True
+
+    def get_key(self, arguments, use_wheels):
+        """
+        Get the key under which the resolution of a requirement set is stored.
+
+        :param arguments: The (decorated) command line arguments to ``pip
+                          install ...`` (a list of strings).
+        :param use_wheels: Whether wheels are allowed (a boolean).
+        :returns: A hex digest (a string) or :data:`None` when the arguments
+                  refer to requirement files that aren't local files.
+        """
+        requirement_files = find_requirement_files(arguments)
+        if requirement_files is None:
+            return None
+        configuration_files = find_configuration_files()
+        environment = sorted((k, v) for k, v in os.environ.items()
+                             if k.startswith('PIP_') and k not in IGNORED_VARIABLES)
+        context = dict(
+            arguments=arguments,
+            configuration_files=[(fn, self.digest_cache.get_digest('sha1', fn)) for fn in configuration_files],
+            environment=environment,
+            executable=self.config.python_executable,
+            python_version=sys.version,
+            pip_version=pip_version,
+            requirement_files=[(fn, self.digest_cache.get_digest('sha1', fn)) for fn in requirement_files],
+            source_index=sorted(self.source_index.get_filenames()),
+            use_wheels=bool(use_wheels),
+        )
+        return hashlib.sha1(json.dumps(context, sort_keys=True).encode('UTF-8')).hexdigest()
+
+    def load(self):
+        """
+        Load the resolutions stored in the data directory.
+
+        :returns: A dictionary that maps keys (see :func:`get_key()`) to
+                  dictionaries with requirements and a timestamp (empty when
+                  the resolutions can't be loaded).
+        """
+        try:
+            with open(self.filename) as handle:
+                entries = json.load(handle)
+            if isinstance(entries, dict):
+                return entries
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def save(self, key, value):
+        """
+        Add a resolution to the cache and store the cache in the data directory.
+
+        :param key: The key of the resolution (a string).
+        :param value: A dictionary with requirements and a timestamp.
+        """
+        entries = self.load()
+        entries[key] = value
+        if len(entries) > MAX_ENTRIES:
+            newest = sorted(entries, key=lambda k: entries[k].get('time', 0), reverse=True)
+            entries = dict((k, entries[k]) for k in newest[:MAX_ENTRIES])
+        try:
+            makedirs(os.path.dirname(self.filename))
+            with AtomicReplace(self.filename) as temporary_file:
+                with open(temporary_file, 'w') as handle:
+                    json.dump(entries, handle)
+        except (IOError, OSError) as e:
+            logger.debug("Failed to save resolutions to %s! (%s)", self.filename, e)
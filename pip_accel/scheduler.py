@@ -0,0 +1,298 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Dependency aware scheduling of binary distribution builds.
+
+When pip-accel needs to build more than one binary distribution it can run
+the builds concurrently (see :attr:`.Config.build_jobs`). The order in which
+builds are started matters quite a bit for the total wall clock time: If the
+slowest build is started last, all other build slots sit idle while it runs.
+This module uses the requirement graph reported by pip to create a
+:class:`BuildPlan` that starts the builds that are expected to take the
+longest first, while holding back builds whose setup requirements are being
+built in the same run.
+
+Expected build times are based on the durations of previous builds (recorded
+by :class:`BuildTimes`) and fall back to the size of the source distribution
+archive(s) for packages that haven't been built before.
+"""
+
+# Standard library modules.
+import json
+import logging
+import os
+import threading
+
+# External dependencies.
+from cached_property import cached_property
+from pip.req import InstallRequirement
+
+# Modules included in our package.
+from pip_accel.utils import AtomicReplace, makedirs
+
+# The following package(s) are usually bundled with pip but may be unbundled
+# by redistributors and pip-accel should handle this gracefully.
+try:
+    from pip._vendor.pkg_resources import Requirement as SetuptoolsRequirement, safe_name
+except ImportError:
+    from pkg_resources import Requirement as SetuptoolsRequirement, safe_name
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECONDS_PER_BYTE = 1.0 / (100 * 1024)
+"""
+The build time estimate used for packages that have never been built.
+
+Expressed in seconds per byte of source distribution archive(s) and only used
+when :class:`BuildTimes` doesn't have any history to base a better estimate
+on. In that case all estimates are relative to each other anyway, so the exact
+value doesn't really matter.
+"""
+
+
+class BuildPlan(object):
+
+    """
+    Dependency graph of the binary distributions that need to be built.
+
+    Build plans are created by :func:`.PipAccelerator.create_build_plan()`
+    and executed by :func:`.PipAccelerator.execute_build_plan()`. In between
+    callers are free to inspect (and even modify) the plan using the following
+    attributes:
+
+    - :attr:`requirements` is the list of :class:`.Requirement` objects that
+      will be built.
+    - :attr:`dependencies` maps each requirement to the requirements in the
+      plan that it depends on at runtime (based on
+      :attr:`pip.req.InstallRequirement.comes_from`). These edges never hold
+      back a build because building a binary distribution doesn't require the
+      runtime dependencies to be installed.
+    - :attr:`build_dependencies` maps each requirement to the requirements in
+      the plan that must be built before it (based on
+      :attr:`.Requirement.setup_requires`).
+    - :attr:`expected_build_times` maps each requirement to the number of
+      seconds its build is expected to take.
+    - :attr:`order` is the list of requirements in the order in which builds
+      should be started (when their build dependencies allow it).
+    """
+
+    def __init__(self, requirements, build_times=None):
+        """
+        Initialize a :class:`BuildPlan` object.
+
+        :param requirements: A list of :class:`.Requirement` objects (source
+                             distributions that need to be built).
+        :param build_times: A :class:`BuildTimes` object (or any other object
+                            with an ``estimate()`` method) used to estimate
+                            build times. If this is :data:`None` all builds
+                            are expected to take equally long.
+        """
+        self.requirements = list(requirements)
+        self.dependencies = dict((r, []) for r in self.requirements)
+        self.build_dependencies = dict((r, []) for r in self.requirements)
+        by_key = dict((normalize_name(r.name), r) for r in self.requirements)
+        for requirement in self.requirements:
+            parent = requirement.pip_requirement.comes_from
+            if isinstance(parent, InstallRequirement) and parent.name:
+                dependent = by_key.get(normalize_name(parent.name))
+                if dependent is not None and dependent is not requirement:
+                    self.dependencies[dependent].append(requirement)
+            for expression in requirement.setup_requires:
+                try:
+                    key = SetuptoolsRequirement.parse(expression).key
+                except ValueError:
+                    logger.debug("Ignoring unparsable setup requirement of %s: %r", requirement, expression)
+                    continue
+                dependency = by_key.get(key)
+                if dependency is not None and dependency is not requirement \
+                        and dependency not in self.build_dependencies[requirement]:
+                    self.build_dependencies[requirement].append(dependency)
+        self.break_cycles()
+        self.expected_build_times = dict((r, build_times.estimate(r) if build_times else 0)
+                                         for r in self.requirements)
+
+    def __len__(self):
+        """The number of binary distributions in the plan (an integer)."""
+        return len(self.requirements)
+
+    def break_cycles(self):
+        """
+        Make sure the build dependencies don't contain any cycles.
+
+        Two packages that declare each other as setup requirements would
+        otherwise hold back each other's builds forever. When a cycle is
+        found the edge that closes it is dropped (which is what would have
+        happened without a build plan anyway).
+        """
+        state = {}
+        for requirement in self.requirements:
+            if requirement not in state:
+                self.visit(requirement, state)
+
+    def visit(self, requirement, state):
+        """Depth first search helper for :func:`break_cycles()`."""
+        state[requirement] = 'visiting'
+        for dependency in list(self.build_dependencies[requirement]):
+            if state.get(dependency) == 'visiting':
+                logger.warning("Ignoring circular setup requirement of %s on %s!", requirement, dependency)
+                self.build_dependencies[requirement].remove(dependency)
+            elif dependency not in state:
+                self.visit(dependency, state)
+        state[requirement] = 'visited'
+
+    @property
+    def priorities(self):
+        """
+        The scheduling priority of each requirement (a dictionary).
+
+        The priority of a requirement is its own expected build time plus the
+        highest priority of the requirements that are waiting for it to be
+        built (i.e. the length of the critical path starting at the
+        requirement). Without build dependencies this is simply the expected
+        build time, which results in a "longest build first" schedule.
+        """
+        dependents = dict((r, []) for r in self.requirements)
+        for requirement, dependencies in self.build_dependencies.items():
+            for dependency in dependencies:
+                dependents[dependency].append(requirement)
+        priorities = {}
+
+        def compute(requirement):
+            if requirement not in priorities:
+                priorities[requirement] = self.expected_build_times.get(requirement, 0) + \
+                    max([compute(r) for r in dependents[requirement]] or [0])
+            return priorities[requirement]
+
+        for requirement in self.requirements:
+            compute(requirement)
+        return priorities
+
+    @property
+    def order(self):
+        """The requirements in the order in which their builds should be started (a list)."""
+        priorities = self.priorities
+        return sorted(self.requirements, key=lambda r: (-priorities[r], r.name.lower()))
+
+    @property
+    def expected_duration(self):
+        """The sum of the expected build times (a number of seconds)."""
+        return sum(self.expected_build_times.values())
+
+    def is_ready(self, requirement, finished):
+        """
+        Check whether the build dependencies of a requirement have been built.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param finished: A collection of :class:`.Requirement` objects whose
+                         builds have finished.
+        :returns: :data:`True` if the build can be started, :data:`False`
+                  otherwise.
+        """
+        return all(d in finished for d in self.build_dependencies[requirement])
+
+
+class BuildTimes(object):
+
+    """
+    Persistent history of build durations.
+
+    The history is stored as a small JSON document in the data directory (see
+    :attr:`.Config.data_directory`) and is updated after every successful
+    build, so it's shared between all pip-accel processes using the same data
+    directory. Losing an update because of concurrent writers is harmless,
+    the history is only used to estimate build times.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`BuildTimes` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        """
+        self.config = config
+        self.lock = threading.Lock()
+
+    @cached_property
+    def filename(self):
+        """The pathname of the JSON document that stores the history (a string)."""
+        return os.path.join(self.config.data_directory, 'build-times.json')
+
+    @cached_property
+    def history(self):
+        """A dictionary that maps normalized package names to recorded build statistics."""
+        try:
+            with open(self.filename) as handle:
+                history = json.load(handle)
+            if isinstance(history, dict):
+                return history
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def estimate(self, requirement):
+        """
+        Estimate how long it will take to build a binary distribution.
+
+        :param requirement: A :class:`.Requirement` object.
+        :returns: The expected build time (a number of seconds).
+
+        When the package was built before its last build time is used.
+        Otherwise the size of the source distribution archive(s) is multiplied
+        by the median build rate of the packages in the history.
+        """
+        with self.lock:
+            entry = self.history.get(normalize_name(requirement.name))
+            if entry:
+                return entry['seconds']
+            rates = sorted(e['seconds'] / float(e['size']) for e in self.history.values() if e.get('size'))
+        rate = rates[len(rates) // 2] if rates else DEFAULT_SECONDS_PER_BYTE
+        return get_archive_size(requirement) * rate
+
+    def record(self, requirement, seconds):
+        """
+        Record the duration of a successful build.
+
+        :param requirement: A :class:`.Requirement` object.
+        :param seconds: The duration of the build (a number).
+        """
+        with self.lock:
+            self.history[normalize_name(requirement.name)] = dict(
+                seconds=seconds,
+                size=get_archive_size(requirement),
+            )
+            try:
+                makedirs(os.path.dirname(self.filename))
+                with AtomicReplace(self.filename) as temporary_file:
+                    with open(temporary_file, 'w') as handle:
+                        json.dump(self.history, handle, indent=2, sort_keys=True)
+            except (IOError, OSError) as e:
+                logger.debug("Failed to save build times to %s! (%s)", self.filename, e)
+
+
+def get_archive_size(requirement):
+    """
+    Get the size of the source distribution archive(s) of a requirement.
+
+    :param requirement: A :class:`.Requirement` object.
+    :returns: The combined size of :attr:`.Requirement.related_archives` (an
+              integer number of bytes).
+    """
+    try:
+        return sum(os.path.getsize(fn) for fn in requirement.related_archives)
+    except (IOError, OSError):
+        return 0
+
+
+def normalize_name(name):
+    """
+    Normalize a package name so it can be used as a dictionary key.
+
+    :param name: The name of a Python package (a string).
+    :returns: The normalized name (a string).
+    """
+    return safe_name(name).lower()
@@ -0,0 +1,332 @@
+# Accelerator for pip, the Python package manager.
+#
+# Author: Peter Odding <peter.odding@paylogic.com>
+# Last Change: October 16, 2026
+# URL: https://github.com/paylogic/pip-accel
+
+"""
+Installation of binary distributions by linking files from a seed store.
+
+Installing a binary distribution normally means decompressing the cached
+archive and writing every file in it to the target prefix. For big packages
+like Django that's a lot of work, and it's repeated for every new virtual
+environment. When :attr:`.Config.link_installs` is enabled pip-accel keeps a
+"seed store" under :attr:`.Config.seed_store` instead:
+
+- The ``objects`` directory contains every file of every cached binary
+  distribution, stored once under the SHA1 digest of its contents (with an
+  ``.x`` suffix for executable files because hard links share permissions).
+  Objects are read only because they are shared between environments.
+
+- The ``manifests`` directory contains a JSON document per cached binary
+  distribution that lists the relative pathnames, permissions and objects of
+  the files in the archive. Manifests are regenerated when the archive
+  changes.
+
+Installing a binary distribution then comes down to creating a copy-on-write
+clone of each object (where the file system supports this), falling back to
+a hard link and finally to a regular copy (e.g. when the seed store and the
+target prefix live on different file systems). Hard links share the
+permissions of the object, so they're only used for files whose permissions
+in the archive match those of the (read only) object. Scripts with a hashbang
+are always copied, because their hashbang may need to be rewritten.
+"""
+
+# Standard library modules.
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+from contextlib import closing
+
+# Modules included in our package.
+from pip_accel.archives import copy_contents, create_member, get_buffer_size, read_archive
+from pip_accel.utils import AtomicReplace, makedirs
+
+# Copy-on-write clones are only supported on Linux (by btrfs, XFS, etc).
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Initialize a logger for this module.
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409
+"""The Linux ``ioctl()`` request number to create a copy-on-write clone of a file."""
+
+
+class SeedStore(object):
+
+    """Unpacked, content addressed store of cached binary distributions."""
+
+    def __init__(self, config):
+        """
+        Initialize a :class:`SeedStore` object.
+
+        :param config: The pip-accel configuration (a :class:`.Config` object).
+        """
+        self.config = config
+        self.clone_support = {}
+        self.stats = dict(clone=0, link=0, copy=0)
+        self.stats_lock = threading.Lock()
+
+    def get_members(self, cache_file):
+        """
+        Get the members of a cached binary distribution from the seed store.
+
+        :param cache_file: The pathname of a cached binary distribution
+                           archive (a string).
+        :returns: An iterable of tuples with two values each: A
+                  :class:`.CachedMember` object and a :class:`SeedFile`
+                  object (this is the same interface as
+                  :func:`.BinaryDistributionManager.get_binary_dist()`).
+
+        The binary distribution is added to the seed store when this hasn't
+        happened yet.
+        """
+        manifest = self.get_manifest(cache_file)
+        for entry in manifest['members']:
+            object_path = self.get_object_path(entry['digest'], entry['mode'])
+            yield create_member(entry), SeedFile(object_path, entry['hashbang'])
+
+    def get_manifest(self, cache_file):
+        """
+        Get the manifest of a cached binary distribution.
+
+        :param cache_file: The pathname of a cached binary distribution
+                           archive (a string).
+        :returns: A dictionary with the manifest.
+        """
+        manifest_file = self.get_manifest_path(cache_file)
+        archive_info = self.get_archive_info(cache_file)
+        try:
+            with open(manifest_file) as handle:
+                manifest = json.load(handle)
+            if manifest['archive'] == archive_info and all(
+                    os.path.isfile(self.get_object_path(e['digest'], e['mode'])) for e in manifest['members']):
+                return manifest
+            logger.debug("Seed store manifest %s is outdated.", manifest_file)
+        except (IOError, OSError, ValueError, KeyError):
+            logger.debug("Seed store manifest %s doesn't exist yet.", manifest_file)
+        return self.populate(cache_file, manifest_file, archive_info)
+
+    def populate(self, cache_file, manifest_file, archive_info):
+        """
+        Add a cached binary distribution to the seed store.
+
+        :param cache_file: The pathname of a cached binary distribution
+                           archive (a string).
+        :param manifest_file: The pathname of the manifest to create (a string).
+        :param archive_info: The result of :func:`get_archive_info()`.
+        :returns: A dictionary with the manifest.
+        """
+        logger.debug("Adding %s to seed store ..", cache_file)
+        members = []
+        for member, handle in read_archive(cache_file, self.config):
+            with closing(handle):
+                digest, size, hashbang = self.store_object(handle, member.mode)
+            members.append(dict(
+                name=member.name,
+                mode=member.mode,
+                size=size,
+                digest=digest,
+                hashbang=hashbang,
+                install=getattr(member, 'install', None),
+            ))
+        manifest = dict(archive=archive_info, members=members)
+        makedirs(os.path.dirname(manifest_file))
+        with AtomicReplace(manifest_file) as temporary_file:
+            with open(temporary_file, 'w') as handle:
+                json.dump(manifest, handle)
+        return manifest
+
+    def store_object(self, handle, mode):
+        """
+        Store the contents of a file in the seed store (unless it's already there).
+
+        :param handle: A file-like object that provides the contents of the file.
+        :param mode: The permissions of the file (an integer).
+        :returns: A tuple with three values: The SHA1 digest of the contents
+                  (a string), the size of the contents (an integer) and
+                  :data:`True` if the contents start with a hashbang,
+                  :data:`False` otherwise.
+
+        The contents are copied in chunks (see :func:`.get_buffer_size()`) to
+        a temporary file which is moved into place once the digest is known.
+        """
+        directory = os.path.join(self.config.seed_store, 'objects')
+        makedirs(directory)
+        fd, temporary_file = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        object_path = None
+        try:
+            with os.fdopen(fd, 'wb') as to_handle:
+                digest, size, hashbang = copy_contents(handle, to_handle, get_buffer_size(self.config))
+            object_path = self.get_object_path(digest, mode)
+            if os.path.isfile(object_path):
+                os.unlink(temporary_file)
+            else:
+                makedirs(os.path.dirname(object_path))
+                os.chmod(temporary_file, 0o555 if mode & stat.S_IXUSR else 0o444)
+                os.rename(temporary_file, object_path)
+        except Exception:
+            if os.path.exists(temporary_file):
+                os.unlink(temporary_file)
+            # Concurrent pip-accel processes may store the same object (on
+            # Windows os.rename() fails when the target exists).
+            if object_path is None or not os.path.isfile(object_path):
+                raise
+        return digest, size, hashbang
+
+    def install_file(self, seed_file, pathname, mode):
+        """
+        Install a file from the seed store.
+
+        :param seed_file: A :class:`SeedFile` object.
+        :param pathname: The pathname of the file to create (a string).
+        :param mode: The permissions of the file (an integer). A hard link is
+                     only created when the object in the seed store has
+                     these permissions, because hard links share them.
+        """
+        if os.path.lexists(pathname):
+            # Never write through an existing file, it may be linked to the
+            # seed store (or to another environment).
+            os.unlink(pathname)
+        if self.clone_file(seed_file.pathname, pathname):
+            self.count('clone')
+            os.chmod(pathname, mode)
+            return
+        if stat.S_IMODE(os.stat(seed_file.pathname).st_mode) == stat.S_IMODE(mode):
+            try:
+                os.link(seed_file.pathname, pathname)
+                self.count('link')
+                return
+            except (AttributeError, OSError) as e:
+                # Hard links aren't possible across devices, may be forbidden by
+                # the operating system and don't exist on some platforms.
+                logger.debug("Failed to hard link %s, falling back to copying! (%s)", pathname, e)
+        shutil.copyfile(seed_file.pathname, pathname)
+        os.chmod(pathname, mode)
+        self.count('copy')
+
+    def count(self, method):
+        """
+        Count a file installed from the seed store.
+
+        :param method: One of the strings 'clone', 'link' or 'copy'.
+
+        The counts are available in :attr:`stats` (they're updated by
+        multiple threads when :attr:`.Config.install_jobs` is greater than
+        one) and reported by :func:`.BinaryDistributionManager.install_binary_dist()`.
+        """
+        with self.stats_lock:
+            self.stats[method] += 1
+
+    def clone_file(self, source, target):
+        """
+        Try to create a copy-on-write clone of a file.
+
+        :param source: The pathname of the existing file (a string).
+        :param target: The pathname of the file to create (a string).
+        :returns: :data:`True` if the clone was created, :data:`False` if the
+                  file system (or operating system) doesn't support cloning.
+        """
+        if fcntl is None or not sys.platform.startswith('linux'):
+            return False
+        device = os.stat(os.path.dirname(target)).st_dev
+        if self.clone_support.get(device) is False:
+            return False
+        with open(source, 'rb') as source_handle:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                fcntl.ioctl(fd, FICLONE, source_handle.fileno())
+                self.clone_support[device] = True
+                return True
+            except (IOError, OSError) as e:
+                os.close(fd)
+                fd = None
+                os.unlink(target)
+                if e.errno in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM):
+                    logger.debug("File system doesn't support copy-on-write clones (%s).", e)
+                    self.clone_support[device] = False
+                    return False
+                raise
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+    def get_object_path(self, digest, mode):
+        """
+        Get the pathname of an object in the seed store.
+
+        :param digest: The SHA1 digest of the contents (a string).
+        :param mode: The permissions of the file (an integer).
+        :returns: The pathname of the object (a string).
+        """
+        suffix = '.x' if mode & stat.S_IXUSR else ''
+        return os.path.join(self.config.seed_store, 'objects', digest[:2], digest[2:] + suffix)
+
+    def get_manifest_path(self, cache_file):
+        """
+        Get the pathname of the manifest of a cached binary distribution.
+
+        :param cache_file: The pathname of a cached binary distribution
+                           archive (a string).
+        :returns: The pathname of the manifest (a string).
+        """
+        relative_path = os.path.relpath(cache_file, self.config.binary_cache)
+        if relative_path.startswith(os.pardir):
+            relative_path = hashlib.sha1(cache_file.encode('UTF-8')).hexdigest()
+        return os.path.join(self.config.seed_store, 'manifests', '%s.json' % relative_path)
+
+    def get_archive_info(self, cache_file):
+        """
+        Get the properties of an archive that invalidate its manifest when they change.
+
+        :param cache_file: The pathname of a cached binary distribution
+                           archive (a string).
+        :returns: A dictionary with the size and last modified time of the archive.
+        """
+        info = os.stat(cache_file)
+        return dict(size=info.st_size, mtime=info.st_mtime)
+
+
+class SeedFile(object):
+
+    """File-like object that provides access to an object in the seed store."""
+
+    def __init__(self, pathname, hashbang):
+        """
+        Initialize a :class:`SeedFile` object.
+
+        :param pathname: The pathname of the object in the seed store (a string).
+        :param hashbang: :data:`True` if the file starts with a hashbang,
+                         :data:`False` otherwise.
+        """
+        self.pathname = pathname
+        self.hashbang = hashbang
+        self.handle = None
+
+    def read(self, size=-1):
+        """
+        Read (part of) the contents of the file.
+
+        :param size: The maximum number of bytes to return (an integer, a
+                     negative number reads the remaining contents).
+        :returns: A byte string (empty at the end of the file).
+        """
+        if self.handle is None:
+            self.handle = open(self.pathname, 'rb')
+        return self.handle.read(size)
+
+    def close(self):
+        """Close the file (it can be read again afterwards)."""
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
@@ -25,6 +25,7 @@ have to do so retroactively.
 # Standard library modules.
 import fnmatch
 import glob
+import hashlib
 import json
 import logging
 import operator
@@ -36,8 +37,12 @@ import shutil
 import stat
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
 import unittest
+from io import BytesIO
 
 # External dependencies.
 import coloredlogs
@@ -45,16 +50,49 @@ from cached_property import cached_property
 from humanfriendly import coerce_boolean, compact, concatenate, dedent
 from pip.commands.install import InstallCommand
 from pip.exceptions import DistributionNotFound
+from pip.req import InstallRequirement
 
 # Modules included in our package.
 from pip_accel import PatchedAttribute, PipAccelerator
-from pip_accel.cli import main
+from pip_accel.archives import (
+    INDEXED_ARCHIVE_MAGIC,
+    INDEXED_ARCHIVE_SUFFIX,
+    TARBALL_SUFFIX,
+    BlobStore,
+    MemberFile,
+    create_archive_writer,
+    iter_archive_members,
+    read_archive,
+    write_archive,
+    write_manifest,
+)
+from pip_accel.caches import FILENAME_PATTERN, CacheLock, CacheManager
+from pip_accel.compression import CODECS, get_codec, parse_codec
+from pip_accel.caches.local import LocalCacheBackend, fcntl
+from pip_accel.caches.s3 import S3CacheBackend
+from pip_accel.caches.uploads import UploadQueue
+from pip_accel.cli import is_satisfied, main
 from pip_accel.compat import WINDOWS, StringIO
 from pip_accel.config import Config
 from pip_accel.deps import DependencyInstallationRefused, SystemPackageManager
-from pip_accel.exceptions import EnvironmentMismatchError
-from pip_accel.req import escape_name
-from pip_accel.utils import create_file_url, makedirs, requirement_is_installed, uninstall
+from pip_accel import digests as digests_module
+from pip_accel.digests import DigestCache
+from pip_accel.exceptions import CorruptArchiveError, EnvironmentMismatchError, InvalidLockfile, UnsupportedCodecError
+from pip_accel.fingerprint import is_unsupported_option
+from pip_accel.inputs import find_requirement_files
+from pip_accel.lockfile import LockedRequirement, read_lockfile
+from pip_accel.metadata import MetadataCache, read_embedded_metadata
+from pip_accel.req import Requirement, ResolvedRequirement, SourceIndex, escape_name
+from pip_accel.scheduler import BuildPlan
+from pip_accel.seed import SeedFile, SeedStore
+from pip_accel.utils import (
+    create_file_url,
+    get_python_version,
+    hash_files,
+    makedirs,
+    requirement_is_installed,
+    uninstall,
+)
 
 # Test dependencies.
 from executor import CommandNotFound, execute, which
@@ -324,6 +362,1118 @@ class PipAccelTestCase(unittest.TestCase):
         assert find_installed_version('requests') == '2.2.1', \
             "pip-accel failed to (properly) downgrade requests to version 2.2.1!"
 
+    def test_parallel_builds(self):
+        """
+        Test concurrent building of binary distributions.
+
+        This tests the :func:`~pip_accel.bdist.BinaryDistributionManager.execute_build_plan()`
+        method by installing two source distributions with :attr:`~.Config.build_jobs` set to two
+        and by checking that a build whose cache lock is held by someone else doesn't hold back
+        the other build.
+        """
+        accelerator = self.initialize_pip_accel(build_jobs=2)
+        arguments = ['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2', 'naturalsort==1.5.1']
+        num_installed = accelerator.install_from_arguments(arguments)
+        assert num_installed == 2, "Expected pip-accel to install exactly two packages!"
+        # Make sure both binary distributions were added to the cache.
+        for pattern in '*pep8*.json', '*naturalsort*.json':
+            find_one_file(accelerator.config.binary_cache, pattern)
+        if fcntl is None:
+            return
+        # A contended cache lock doesn't keep other builds from starting.
+        shutil.rmtree(accelerator.config.binary_cache)
+        plan = accelerator.bdists.create_build_plan(accelerator.get_requirements(arguments))
+        blocked, other = plan.order
+        lock = LocalCacheBackend(accelerator.config).lock(accelerator.bdists.cache.generate_filename(blocked))
+        lock.acquire()
+        try:
+            thread = threading.Thread(target=accelerator.bdists.execute_build_plan, args=(plan,))
+            thread.start()
+            started = time.time()
+            while not glob.glob(os.path.join(accelerator.config.binary_cache, '*', '*%s*.json' % other.name)):
+                assert time.time() - started < 60, "Build was held back by another build's cache lock!"
+                time.sleep(0.1)
+            assert not glob.glob(os.path.join(accelerator.config.binary_cache, '*', '*%s*.json' % blocked.name))
+        finally:
+            lock.release()
+        thread.join(60)
+        find_one_file(accelerator.config.binary_cache, '*%s*.json' % blocked.name)
+
+    def test_pipeline(self):
+        """
+        Test the streaming pipeline that overlaps downloading, building and installing.
+
+        This tests the :class:`~pip_accel.pipeline.Pipeline` class by
+        installing two source distributions with :attr:`~.Config.pipeline`
+        enabled, once with an empty source index (so that pip-accel falls back
+        to downloading while the pipeline is running) and once with
+        everything available locally.
+        """
+        accelerator = self.initialize_pip_accel(pipeline=True, build_jobs=2)
+        for i in 1, 2:
+            num_installed = accelerator.install_from_arguments([
+                '--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2', 'naturalsort==1.5.1',
+            ])
+            assert num_installed == 2, "Expected pip-accel to install exactly two packages!"
+        for pattern in '*pep8*.json', '*naturalsort*.json':
+            find_one_file(accelerator.config.binary_cache, pattern)
+
+    def test_build_plan(self):
+        """
+        Test the dependency aware scheduling of builds.
+
+        This tests the :class:`~pip_accel.scheduler.BuildPlan` class and the
+        :attr:`~pip_accel.req.Requirement.setup_requires` property using a
+        couple of generated setup scripts.
+        """
+        accelerator = self.initialize_pip_accel()
+        root = create_temporary_directory(prefix='pip-accel-', suffix='-build-plan-test')
+        requirements = {}
+        for name, setup_requires, comes_from in (('slow', [], None),
+                                                 ('fast', [], 'slow'),
+                                                 ('provider', [], None),
+                                                 ('user', ['provider >= 1.0'], None)):
+            directory = os.path.join(root, name)
+            os.makedirs(directory)
+            with open(os.path.join(directory, 'setup.py'), 'w') as handle:
+                handle.write('from setuptools import setup\n')
+                handle.write('setup(name=%r, setup_requires=%r)\n' % (name, setup_requires))
+            pip_requirement = InstallRequirement.from_line(
+                name, comes_from=requirements[comes_from].pip_requirement if comes_from else None,
+            )
+            pip_requirement.source_dir = directory
+            requirements[name] = Requirement(accelerator.config, pip_requirement)
+        assert requirements['user'].setup_requires == ['provider >= 1.0']
+        plan = BuildPlan(requirements.values())
+        # Runtime dependencies are tracked but don't hold back builds.
+        assert plan.dependencies[requirements['slow']] == [requirements['fast']]
+        assert plan.is_ready(requirements['fast'], set())
+        # Setup requirements do hold back builds.
+        assert plan.build_dependencies[requirements['user']] == [requirements['provider']]
+        assert not plan.is_ready(requirements['user'], set())
+        assert plan.is_ready(requirements['user'], set([requirements['provider']]))
+        # Builds on the critical path are started first.
+        plan.expected_build_times.update({
+            requirements['slow']: 60,
+            requirements['fast']: 1,
+            requirements['provider']: 5,
+            requirements['user']: 10,
+        })
+        assert [r.name for r in plan.order] == ['slow', 'provider', 'user', 'fast']
+
+    def test_link_installs(self):
+        """
+        Test installation of binary distributions from the seed store.
+
+        This tests the :class:`~pip_accel.seed.SeedStore` class by installing
+        pep8 with :attr:`~.Config.link_installs` enabled and checking that the
+        module was installed from the seed store while the script (which has a
+        hashbang) was copied, that the permissions of the archive members were
+        applied and that objects are only hard linked when their permissions
+        match.
+        """
+        accelerator = self.initialize_pip_accel(link_installs=True)
+        for i in 1, 2:
+            num_installed = accelerator.install_from_arguments([
+                '--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2',
+            ])
+            assert num_installed == 1, "Expected pip-accel to install exactly one package!"
+        seed_store = accelerator.bdists.seed_store
+        assert sum(seed_store.stats.values()) > 0, "Expected files to be installed from seed store!"
+        cache_file = find_one_file(accelerator.config.binary_cache, '*pep8*.json')
+        manifest = seed_store.get_manifest(cache_file)
+        for entry in manifest['members']:
+            installed_file = os.path.join(accelerator.config.install_prefix, entry['name'])
+            assert stat.S_IMODE(os.stat(installed_file).st_mode) == stat.S_IMODE(entry['mode']), \
+                "Permissions of %s weren't applied!" % entry['name']
+            if entry['hashbang']:
+                assert not os.path.samefile(installed_file, seed_store.get_object_path(entry['digest'], entry['mode']))
+                with open(installed_file, 'rb') as handle:
+                    assert handle.readline().strip() == b'#!' + accelerator.config.python_executable.encode('ascii')
+            elif entry['name'].endswith('/pep8.py'):
+                with open(installed_file, 'rb') as handle:
+                    assert hashlib.sha1(handle.read()).hexdigest() == entry['digest']
+        # Objects are only hard linked when their permissions match.
+        digest, size, hashbang = seed_store.store_object(BytesIO(b'read only\n'), 0o444)
+        object_path = seed_store.get_object_path(digest, 0o444)
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-link-test')
+        for mode in 0o444, 0o644:
+            pathname = os.path.join(directory, 'file-%o' % mode)
+            seed_store.install_file(SeedFile(object_path, hashbang), pathname, mode)
+            assert stat.S_IMODE(os.stat(pathname).st_mode) == mode
+        assert not os.path.samefile(os.path.join(directory, 'file-644'), object_path)
+
+    def test_parallel_installs(self):
+        """
+        Test concurrent writing of the files of a binary distribution.
+
+        This tests :func:`~pip_accel.bdist.BinaryDistributionManager.install_files()`
+        by installing pep8 with :attr:`~.Config.install_jobs` set to four and
+        by checking that the first error in one of the threads is propagated.
+        """
+        accelerator = self.initialize_pip_accel(install_jobs=4)
+        config = accelerator.config
+        num_installed = accelerator.install_from_arguments(['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2'])
+        assert num_installed == 1, "Expected pip-accel to install exactly one package!"
+        for member, handle in read_archive(find_one_file(config.binary_cache, '*pep8*.json'), config):
+            assert os.path.isfile(os.path.join(config.install_prefix, member.name))
+        codec = parse_codec(None)
+        members = []
+        for i in range(10):
+            member = tarfile.TarInfo('lib/module%i.py' % i)
+            member.mode = 0o644
+            member.size = 1
+            members.append((member, MemberFile(
+                lambda: BytesIO(codec.compress(b'\n')), hashlib.sha1(b'\n').hexdigest(), False, codec)))
+
+        def broken_opener():
+            raise IOError("Simulated read error!")
+
+        members.insert(5, (tarfile.TarInfo('lib/broken.py'), MemberFile(broken_opener, '0' * 40, False, codec)))
+        prefix = create_temporary_directory(prefix='pip-accel-', suffix='-parallel-install-test')
+        try:
+            accelerator.bdists.install_binary_dist(members, prefix=prefix)
+            assert False, "Expected the simulated read error to be propagated!"
+        except IOError as e:
+            # The first error is reported (not a side effect of it).
+            assert str(e) == "Simulated read error!"
+
+    def test_streaming_installs(self):
+        """
+        Test that files are copied in chunks during installation.
+
+        This installs a large file and a script with Windows line endings
+        using a tiny :attr:`~.Config.install_memory` budget and checks that
+        the files were copied in chunks while only the hashbang of the script
+        was rewritten.
+        """
+        accelerator = self.initialize_pip_accel(install_memory=4096)
+        bdists = accelerator.bdists
+        assert bdists.buffer_size == 4096
+        codec = parse_codec('zlib')
+        large_file = os.urandom(1024 * 256)
+        script = b'#!/usr/bin/env python\r\nimport sys\r\nprint(sys.argv)\r\n'
+        read_sizes = []
+
+        class RecordingFile(MemberFile):
+            def read(self, size=-1):
+                read_sizes.append(size)
+                return super(RecordingFile, self).read(size)
+
+        members = []
+        for name, contents, mode in (('lib/large.bin', large_file, 0o644), ('bin/script', script, 0o755)):
+            member = tarfile.TarInfo(name)
+            member.mode = mode
+            member.size = len(contents)
+            compressed = codec.compress(contents)
+            members.append((member, RecordingFile(
+                lambda compressed=compressed: BytesIO(compressed),
+                hashlib.sha1(contents).hexdigest(), contents.startswith(b'#!/'), codec)))
+        prefix = create_temporary_directory(prefix='pip-accel-', suffix='-streaming-install-test')
+        bdists.install_binary_dist(members, prefix=prefix, python='/usr/bin/python')
+        assert read_sizes and all(0 < size <= 4096 for size in read_sizes)
+        with open(os.path.join(prefix, 'lib', 'large.bin'), 'rb') as handle:
+            assert handle.read() == large_file
+        with open(os.path.join(prefix, 'bin', 'script'), 'rb') as handle:
+            assert handle.read() == b'#!/usr/bin/python\nimport sys\r\nprint(sys.argv)\r\n'
+
+    def test_streaming_cache_writes(self):
+        """
+        Test that files are copied in chunks when binary distributions are cached.
+
+        This stores a large file in the local cache (while writing an indexed
+        archive and a ``*.tar.gz`` archive) and in the seed store using a tiny
+        :attr:`~.Config.install_memory` budget and checks that the file was
+        never read as a whole.
+        """
+        accelerator = self.initialize_pip_accel(install_memory=4096)
+        config = accelerator.config
+        large_file = os.urandom(1024 * 256)
+        read_sizes = []
+
+        class RecordingFile(BytesIO):
+            def read(self, size=-1):
+                read_sizes.append(size)
+                return super(RecordingFile, self).read(size)
+
+        def generate_members():
+            member = tarfile.TarInfo('lib/large.bin')
+            member.mode = 0o644
+            member.size = len(large_file)
+            return [(member, RecordingFile(large_file))]
+
+        for revision in 8, 9:
+            archive = BytesIO()
+            writer = create_archive_writer(archive, revision, buffer_size=4096)
+            write_manifest(os.path.join(config.binary_cache, 'streaming-test-%i.json' % revision),
+                           generate_members(), config, writer)
+            writer.close()
+            archive.seek(0)
+            assert [(m.name, h.read()) for m, h in iter_archive_members(archive)] == [('lib/large.bin', large_file)]
+        stored = SeedStore(config).store_object(RecordingFile(large_file), 0o644)
+        assert stored == (hashlib.sha1(large_file).hexdigest(), len(large_file), False)
+        assert read_sizes and all(0 < size <= 4096 for size in read_sizes)
+
+    def test_corrupt_blobs(self):
+        """
+        Test that members of cached archives are verified before they're shared.
+
+        This tests :func:`~pip_accel.archives.BlobStore.store_compressed()` by
+        storing members whose compressed contents don't match the digest they
+        claim and checking that no blob is committed for that digest.
+        """
+        config = self.initialize_pip_accel().config
+        blob_store = BlobStore(config)
+        contents = b'#!/usr/bin/python\nprint("hello world")\n'
+        digest = hashlib.sha1(contents).hexdigest()
+
+        def generate_members(compressed, hashbang):
+            member = tarfile.TarInfo('bin/hello')
+            member.mode = 0o755
+            member.size = len(contents)
+            return [(member, MemberFile(lambda: BytesIO(compressed), digest, hashbang, blob_store.codec))]
+
+        compressed = blob_store.codec.compress(contents)
+        for corrupt in (compressed[:len(compressed) // 2], blob_store.codec.compress(contents.upper())):
+            self.assertRaises(CorruptArchiveError, write_manifest,
+                              os.path.join(config.binary_cache, 'corrupt-test.json'),
+                              generate_members(corrupt, True), config)
+            assert not os.path.exists(blob_store.get_path(digest))
+            assert not glob.glob(os.path.join(blob_store.directory, '.tmp-*'))
+        # Verified contents are stored and the hashbang is taken from them.
+        manifest_file = os.path.join(config.binary_cache, 'verified-test.json')
+        write_manifest(manifest_file, generate_members(compressed, False), config)
+        assert os.path.isfile(blob_store.get_path(digest))
+        with open(manifest_file) as handle:
+            entry = json.load(handle)['members'][0]
+        assert (entry['digest'], entry['size'], entry['hashbang']) == (digest, len(contents), True)
+
+    def test_repack_cache(self):
+        """
+        Test the content addressed local cache and the migration of old caches.
+
+        This tests :func:`~pip_accel.caches.local.LocalCacheBackend.repack()`
+        by converting a cached binary distribution back into two revision 7
+        archives with identical contents and repacking them, then checks that
+        the files were stored only once (by the :class:`~pip_accel.archives.BlobStore`).
+        """
+        accelerator = self.initialize_pip_accel()
+        config = accelerator.config
+        accelerator.install_from_arguments(['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2'])
+        manifest_file = find_one_file(config.binary_cache, '*pep8*.json')
+        original = [(m, h.read()) for m, h in read_archive(manifest_file, config)]
+        blobs = set(find_files(BlobStore(config).directory, '*'))
+        for version in '1.6.1', '1.6.2':
+            filename = FILENAME_PATTERN % (7, 'pep8', version, 'py', TARBALL_SUFFIX)
+            archive_file = os.path.join(config.binary_cache, filename)
+            makedirs(os.path.dirname(archive_file))
+            archive = tarfile.open(archive_file, 'w:gz')
+            for member, contents in original:
+                archive.addfile(member, BytesIO(contents))
+            archive.close()
+        stats = LocalCacheBackend(config).repack()
+        assert stats['archives'] == 2, "Expected two archives to be repacked!"
+        assert stats['after'] < stats['before'], "Repacking didn't save any disk space!"
+        assert not glob.glob(os.path.join(config.binary_cache, 'v7', '*.tar.gz')), "Old archives weren't removed!"
+        assert set(find_files(BlobStore(config).directory, '*')) == blobs, "Identical files were stored twice!"
+        for version in '1.6.1', '1.6.2':
+            filename = FILENAME_PATTERN % (config.cache_format_revision, 'pep8', version, 'py', INDEXED_ARCHIVE_SUFFIX)
+            manifest_file = LocalCacheBackend(config).get(filename)
+            assert manifest_file, "Repacked archive is missing from the local cache!"
+            repacked = [(m.name, m.mode, h.read()) for m, h in read_archive(manifest_file, config)]
+            assert repacked == [(m.name, m.mode, c) for m, c in original], "Repacked archive differs from original!"
+
+    def test_legacy_local_cache(self):
+        """
+        Test that revision 7 archives in the local cache are used without repacking.
+
+        This converts a cached binary distribution back into a revision 7
+        archive, removes its manifest and installs the package again, checking
+        that :func:`~pip_accel.caches.local.LocalCacheBackend.get()` migrated
+        the archive instead of the package being rebuilt.
+        """
+        accelerator = self.initialize_pip_accel()
+        config = accelerator.config
+        arguments = ['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2']
+        accelerator.install_from_arguments(arguments)
+        manifest_file = find_one_file(config.binary_cache, '*pep8*.json')
+        original = [(m, h.read()) for m, h in read_archive(manifest_file, config)]
+        archive_file = os.path.join(config.binary_cache, 'v7', os.path.basename(manifest_file)[:-len('.json')] +
+                                    TARBALL_SUFFIX)
+        makedirs(os.path.dirname(archive_file))
+        archive = tarfile.open(archive_file, 'w:gz')
+        for member, contents in original:
+            archive.addfile(member, BytesIO(contents))
+        archive.close()
+        os.unlink(manifest_file)
+
+        def unexpected_build(*args, **kw):
+            raise AssertionError("pip-accel rebuilt a binary distribution that was cached by revision 7!")
+
+        with PatchedAttribute(accelerator.bdists, 'build_binary_dist', unexpected_build):
+            assert accelerator.install_from_arguments(arguments) == 1
+        assert find_one_file(config.binary_cache, '*pep8*.json') == manifest_file, "Archive wasn't migrated!"
+        assert os.path.getmtime(manifest_file) == os.path.getmtime(archive_file)
+        migrated = [(m.name, m.mode, h.read()) for m, h in read_archive(manifest_file, config)]
+        assert migrated == [(m.name, m.mode, c) for m, c in original], "Migrated archive differs from original!"
+
+    def test_install_facts(self):
+        """
+        Test that the facts needed to install a binary distribution are recorded when it's cached.
+
+        This checks the install facts in a manifest written by the local cache
+        and installs the binary distribution with :mod:`fnmatch` disabled to
+        make sure ``installed-files.txt`` is created from the manifest.
+        """
+        accelerator = self.initialize_pip_accel()
+        config = accelerator.config
+        files = [
+            ('include/demo/demo.h', b'#define DEMO 1\n'),
+            ('lib/python2.7/site-packages/demo/__init__.py', b'#!/not-a-script\n'),
+            ('lib/python2.7/site-packages/demo-1.0-py2.7.egg-info/PKG-INFO', b'Name: demo\n'),
+        ]
+        archive = BytesIO()
+        write_archive(archive, [(tarfile.TarInfo(n), BytesIO(c)) for n, c in files], 9)
+        archive.seek(0)
+        local_cache = LocalCacheBackend(config)
+        local_cache.put('v9/facts-test:1.0:py.pia', archive)
+        manifest_file = local_cache.get('v9/facts-test:1.0:py.pia')
+        with open(manifest_file) as handle:
+            facts = [e['install'] for e in json.load(handle)['members']]
+        assert [f['include'] for f in facts] == [True, False, False]
+        assert [f['site_packages'] for f in facts] == [None] + ['lib/python2.7/site-packages'] * 2
+        assert [f['pkg_info'] for f in facts] == [False, False, True]
+        prefix = create_temporary_directory(prefix='pip-accel-', suffix='-install-facts-test')
+        with PatchedAttribute(fnmatch, 'fnmatch', None):
+            accelerator.bdists.install_binary_dist(read_archive(manifest_file, config),
+                                                   prefix=prefix, track_installed_files=True)
+        assert os.path.isfile(os.path.join(prefix, 'include', 'site', 'demo', 'demo.h'))
+        egg_info = os.path.join(prefix, 'lib', 'python2.7', 'site-packages', 'demo-1.0-py2.7.egg-info')
+        with open(os.path.join(egg_info, 'installed-files.txt')) as handle:
+            assert len(handle.read().splitlines()) == len(files)
+
+    def test_archive_formats(self):
+        """
+        Test the indexed archive format and cache format revision negotiation.
+
+        This tests :func:`~pip_accel.archives.write_archive()` and
+        :func:`~pip_accel.archives.iter_archive_members()` using both archive
+        formats, checks that :func:`~pip_accel.caches.CacheManager.get()`
+        falls back to older cache format revisions and that
+        :func:`~pip_accel.bdist.BinaryDistributionManager.install_binary_dist()`
+        skips unchanged files.
+        """
+        accelerator = self.initialize_pip_accel()
+        config = accelerator.config
+        files = [('lib/module.py', 0o644, b'print(42)\n'), ('bin/program', 0o755, b'#!/usr/bin/python\nprint(42)\n')]
+
+        def generate_members():
+            for name, mode, contents in files:
+                member = tarfile.TarInfo(name)
+                member.mode = mode
+                member.size = len(contents)
+                yield member, BytesIO(contents)
+
+        archives = {}
+        for revision in 8, 9:
+            archives[revision] = BytesIO()
+            write_archive(archives[revision], generate_members(), revision)
+            archives[revision].seek(0)
+            assert [(m.name, m.mode, h.read()) for m, h in iter_archive_members(archives[revision])] == files
+        # Indexed archives start with an index that includes hashbang flags.
+        assert archives[9].getvalue().startswith(INDEXED_ARCHIVE_MAGIC)
+        archives[9].seek(0)
+        assert [h.hashbang for m, h in iter_archive_members(archives[9])] == [False, True]
+        # The cache manager falls back to older revisions.
+        requirement = Requirement(config, InstallRequirement.from_line('negotiation-test==1.0'))
+        requirement.version = '1.0'
+        cache = CacheManager(config)
+        local_cache = LocalCacheBackend(config)
+        for revision in 8, 9:
+            archives[revision].seek(0)
+            local_cache.put(cache.generate_filename(requirement, revision), archives[revision])
+            assert cache.get(requirement) == local_cache.get(cache.generate_filename(requirement, revision))
+        # Unchanged files are skipped, scripts are rewritten.
+        prefix = create_temporary_directory(prefix='pip-accel-', suffix='-archive-test')
+        accelerator.bdists.install_binary_dist(read_archive(cache.get(requirement), config), prefix=prefix)
+        for name, mode, contents in files:
+            os.utime(os.path.join(prefix, name), (0, 0))
+        members = list(read_archive(cache.get(requirement), config))
+        assert all(isinstance(h, MemberFile) for m, h in members)
+        accelerator.bdists.install_binary_dist(members, prefix=prefix)
+        assert os.path.getmtime(os.path.join(prefix, 'lib/module.py')) == 0, "Unchanged file was rewritten!"
+        assert os.path.getmtime(os.path.join(prefix, 'bin/program')) > 0, "Script wasn't rewritten!"
+
+    def test_single_pass_caching(self):
+        """
+        Test that new binary distributions are cached without an intermediate archive.
+
+        This tests :func:`.CacheManager.put_members()` by storing a binary
+        distribution in the local cache and a (fictional) remote cache backend
+        and checking that the remote backend received an archive of the cache
+        format revision in use with the same members.
+        """
+        accelerator = self.initialize_pip_accel()
+        config = accelerator.config
+        uploads = {}
+
+        class RemoteBackend(object):
+            def put(self, filename, handle):
+                uploads[filename] = handle.read()
+
+        cache = CacheManager(config)
+        cache.backends.append(RemoteBackend())
+        requirement = Requirement(config, InstallRequirement.from_line('single-pass-test==1.0'))
+        requirement.version = '1.0'
+        files = [('lib/module.py', b'print(42)\n'), ('bin/script', b'#!/usr/bin/python\nprint(42)\n')]
+        for revision, magic in ((9, INDEXED_ARCHIVE_MAGIC), (8, b'\x1f\x8b')):
+            config.cache_format_revision = revision
+            members = []
+            for name, contents in files:
+                member = tarfile.TarInfo(name)
+                member.mode = 0o644
+                member.size = len(contents)
+                members.append((member, BytesIO(contents)))
+            filename = cache.generate_filename(requirement)
+            manifest_file = cache.put_members(requirement, iter(members), parse_codec('zlib'))
+            assert manifest_file == LocalCacheBackend(config).get(filename)
+            assert [(m.name, h.read()) for m, h in read_archive(manifest_file, config)] == files
+            assert uploads[filename].startswith(magic)
+            assert [(m.name, h.read()) for m, h in iter_archive_members(BytesIO(uploads[filename]))] == files
+
+    def test_upload_queue(self):
+        """
+        Test the background uploads to remote cache backends.
+
+        This tests :class:`~pip_accel.caches.uploads.UploadQueue` using a
+        (fictional) remote cache backend: Uploads happen in the background
+        while the lock of the distribution archive is held, failed uploads
+        stay in the spool and the spool is flushed by the next run.
+        """
+        config = self.initialize_pip_accel(upload_deadline=30).config
+        uploads = {}
+        started = threading.Event()
+        proceed = threading.Event()
+
+        class RemoteBackend(object):
+            failing = False
+
+            def __init__(self, config):
+                pass
+
+            def put(self, filename, handle):
+                started.set()
+                proceed.wait(30)
+                if RemoteBackend.failing:
+                    raise Exception("Simulated upload failure")
+                uploads[filename] = handle.read()
+
+        class FakeLock(object):
+            released = False
+
+            def acquire(self, blocking=True):
+                return True
+
+            def release(self):
+                FakeLock.released = True
+
+        # Uploads happen in the background and keep holding the lock.
+        uploader = UploadQueue(config, [RemoteBackend(config)])
+        lock = CacheLock([FakeLock()])
+        lock.acquire()
+        uploader.submit(RemoteBackend(config), 'v9/upload-test:1.0:py.tar', BytesIO(b'archive'), lock=lock)
+        assert started.wait(30), "Background upload didn't start!"
+        lock.release()
+        assert not FakeLock.released, "Lock was released before the upload finished!"
+        proceed.set()
+        uploader.drain()
+        assert FakeLock.released, "Lock wasn't released after the upload finished!"
+        # Locks that were acquired are released when acquiring a later lock fails.
+
+        class BrokenLock(object):
+
+            def acquire(self, blocking=True):
+                raise Exception("Simulated lock failure")
+
+        FakeLock.released = False
+        self.assertRaises(Exception, CacheLock([FakeLock(), BrokenLock()]).acquire)
+        assert FakeLock.released, "Acquired lock wasn't released after a later lock failed!"
+        assert uploads == {'v9/upload-test:1.0:py.tar': b'archive'}
+        assert not uploader.find_entries(), "Upload wasn't removed from the spool!"
+        # Failed uploads stay in the spool.
+        RemoteBackend.failing = True
+        uploader = UploadQueue(config, [RemoteBackend(config)])
+        uploader.submit(RemoteBackend(config), 'v9/upload-test:2.0:py.tar', BytesIO(b'retry'))
+        uploader.drain()
+        entries = uploader.find_entries()
+        assert len(entries) == 1 and entries[0][1]['attempts'] == 1
+        # The next run flushes the spool.
+        RemoteBackend.failing = False
+        uploader = UploadQueue(config, [RemoteBackend(config)])
+        uploader.recover()
+        uploader.drain()
+        assert uploads['v9/upload-test:2.0:py.tar'] == b'retry'
+        assert not uploader.find_entries(), "Spool wasn't flushed!"
+
+    def test_cache_misses(self):
+        """
+        Test the negative lookup cache for remote cache backends.
+
+        This tests :class:`~pip_accel.caches.misses.MissCache` through
+        :func:`.CacheManager.get()` using a (fictional) remote cache backend:
+        Misses are remembered (across cache managers), forgotten when the
+        index of the backend lists the archive, the archive is uploaded or
+        the lock of the archive is acquired (after waiting for another
+        process to upload it) and ignored when they're older than
+        :attr:`.Config.cache_miss_ttl`.
+        """
+        config = self.initialize_pip_accel(async_uploads=False).config
+        lookups = []
+        indexed = set()
+        uploaded = set()
+
+        class RemoteBackend(object):
+            REMOTE = True
+
+            def __init__(self, config=None):
+                pass
+
+            def get(self, filename):
+                lookups.append(filename)
+                if filename in uploaded:
+                    return filename
+
+            def put(self, filename, handle):
+                pass
+
+            def is_indexed(self, filename):
+                return filename in indexed
+
+            def lock(self, filename):
+                return FakeLease(filename)
+
+        class FakeLease(object):
+            contended = True
+
+            def __init__(self, filename):
+                self.filename = filename
+
+            def acquire(self, blocking=True):
+                if FakeLease.contended:
+                    if not blocking:
+                        return False
+                    # Another process finishes the build while we wait.
+                    uploaded.add(self.filename)
+                return True
+
+            def release(self):
+                pass
+
+        def get_cache_manager():
+            cache = CacheManager(config)
+            cache.backends.append(RemoteBackend())
+            return cache
+
+        requirement = Requirement(config, InstallRequirement.from_line('cache-miss-test==1.0'))
+        requirement.version = '1.0'
+        cache = get_cache_manager()
+        filename = cache.generate_filename(requirement)
+        assert cache.get(requirement) is None
+        assert filename in lookups
+        # Misses are remembered, also by other cache managers.
+        del lookups[:]
+        assert get_cache_manager().get(requirement) is None
+        assert not lookups, "Known misses were looked up again!"
+        # The index of the backend overrides a recorded miss.
+        indexed.add(filename)
+        cache.get(requirement)
+        assert lookups == [filename]
+        indexed.clear()
+        del lookups[:]
+        cache.get(requirement)
+        assert not lookups, "Miss wasn't recorded again!"
+        # Uploading the archive forgets the miss.
+        cache.put_backend(cache.backends[-1], filename, BytesIO(b'archive'))
+        cache.get(requirement)
+        assert lookups == [filename]
+        # Acquiring an uncontended lock doesn't forget the miss.
+        del lookups[:]
+        assert cache.get(requirement) is None and not lookups
+        FakeLease.contended = False
+        with cache.lock(requirement) as lock:
+            assert not lock.waited
+            assert cache.get(requirement) is None
+            assert not lookups, "Uncontended lock forgot the miss!"
+        # Waiting for the lock forgets the miss, so the peer's upload is found.
+        FakeLease.contended = True
+        with cache.lock(requirement):
+            assert cache.get(requirement) == filename, "Archive uploaded during the lease wait wasn't found!"
+            assert filename in cache.held_locks
+        assert filename not in cache.held_locks, "Released lock wasn't forgotten!"
+        uploaded.clear()
+        # Misses expire.
+        del lookups[:]
+        config.cache_miss_ttl = 0
+        get_cache_manager().get(requirement)
+        assert filename in lookups and len(lookups) > 1
+
+    def test_compression_codecs(self):
+        """
+        Test the pluggable compression of cached binary distributions.
+
+        This tests the codecs in :mod:`pip_accel.compression` that are
+        available in the test environment and checks that an indexed archive
+        compressed using one codec is recompressed by the local cache when
+        :attr:`~.Config.cache_codec` names a different codec.
+        """
+        data = b'Accelerator for pip, the Python package manager.\n' * 100
+        for name, codec_class in CODECS.items():
+            if codec_class.available:
+                codec = parse_codec('%s:1' % name)
+                assert codec.level == 1
+                assert get_codec(name).decompress(codec.compress(data)) == data
+                reader = get_codec(name).open_reader(BytesIO(codec.compress(data)))
+                chunks = list(iter(lambda: reader.read(100), b''))
+                assert max(map(len, chunks)) <= 100
+                assert b''.join(chunks) == data
+                compressor = codec.open_compressor()
+                compressed = b''.join(compressor.compress(data[i:i + 100]) for i in range(0, len(data), 100))
+                compressed += compressor.flush()
+                assert get_codec(name).open_reader(BytesIO(compressed)).read() == data
+        assert parse_codec('bogus').name == 'zlib'
+        self.assertRaises(UnsupportedCodecError, get_codec, 'bogus')
+        accelerator = self.initialize_pip_accel(cache_codec='none', s3_cache_codec='zlib:9')
+        member = tarfile.TarInfo('lib/module.py')
+        member.mode = 0o644
+        member.size = len(data)
+        archive = BytesIO()
+        write_archive(archive, [(member, BytesIO(data))], 9, parse_codec(accelerator.config.s3_cache_codec))
+        archive.seek(0)
+        assert [h.codec.name for m, h in iter_archive_members(archive)] == ['zlib']
+        archive.seek(0)
+        local_cache = LocalCacheBackend(accelerator.config)
+        local_cache.put('v9/codec-test:1.0:py.pia', archive)
+        blob_store = BlobStore(accelerator.config)
+        with open(blob_store.get_path(hashlib.sha1(data).hexdigest()), 'rb') as handle:
+            assert handle.read() == data, "Local cache didn't recompress the archive!"
+        members = list(read_archive(local_cache.get('v9/codec-test:1.0:py.pia'), accelerator.config))
+        assert [(m.name, h.read()) for m, h in members] == [('lib/module.py', data)]
+
+    def test_source_index(self):
+        """
+        Test the in-memory index of the local source distribution index.
+
+        This tests :class:`~pip_accel.req.SourceIndex` by checking that
+        archives are found using the same rules as :func:`.escape_name()`,
+        that the directory is scanned once and that it's scanned again after
+        an archive has been added.
+        """
+        accelerator = self.initialize_pip_accel()
+        directory = accelerator.config.source_index
+        for filename in ('cached_property-1.0.tar.gz', 'Cached-Property-1.0.ZIP', 'cached-property-1.0.1.tar.gz',
+                         'cached-property-1.0-py2.py3-none-any.whl', 'cached.property-1.0.tar.gz'):
+            with open(os.path.join(directory, filename), 'w') as handle:
+                handle.write(filename)
+        # Make sure the scan isn't considered racy (see SourceIndex.scan()).
+        os.utime(directory, (time.time() - 60.5, time.time() - 60.5))
+        source_index = SourceIndex(accelerator.config)
+        scans = []
+        original_scan = source_index.scan
+
+        def counting_scan():
+            scans.append(True)
+            original_scan()
+
+        source_index.scan = counting_scan
+        for i in range(10):
+            assert sorted(map(os.path.basename, source_index.find_archives('Cached-Property', '1.0'))) == \
+                ['Cached-Property-1.0.ZIP', 'cached_property-1.0.tar.gz']
+        assert len(scans) == 1
+        with open(os.path.join(directory, 'cached_property-1.0.tar.bz2'), 'w') as handle:
+            handle.write('new')
+        os.utime(directory, (time.time() - 30.5, time.time() - 30.5))
+        assert len(source_index.find_archives('cached-property', '1.0')) == 3
+        assert len(scans) == 2
+
+    def test_digest_cache(self):
+        """
+        Test the persistent memoization of file digests.
+
+        This tests the :class:`~pip_accel.digests.DigestCache` class by
+        checking that remembered digests are used by a new instance (i.e. a
+        new process), that digests are recalculated after a file changes and
+        that concurrent instances don't lose each other's digests.
+        """
+        accelerator = self.initialize_pip_accel()
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-digest-test')
+        files = []
+        for i in range(5):
+            pathname = os.path.join(directory, 'archive-%i.tar.gz' % i)
+            with open(pathname, 'wb') as handle:
+                handle.write(os.urandom(1024 * 1024 + i))
+            files.append(pathname)
+        first_cache = DigestCache(accelerator.config)
+        expected = [hash_files('sha1', f) for f in files]
+        assert first_cache.get_digests('sha1', [[f] for f in files]) == expected
+        assert first_cache.get_digest('md5', *files) == hash_files('md5', *files)
+        decorated_arguments = accelerator.decorate_arguments([files[0]])
+        assert decorated_arguments[0].endswith('#md5=%s' % hash_files('md5', files[0]))
+
+        def unexpected_hashing(*args):
+            raise AssertionError("File hashed although its digest was remembered!")
+
+        with PatchedAttribute(digests_module, 'hash_files', unexpected_hashing):
+            second_cache = DigestCache(accelerator.config)
+            assert second_cache.get_digests('sha1', [[f] for f in files]) == expected
+            assert accelerator.decorate_arguments([files[0]]) == decorated_arguments
+        # A changed file is hashed again.
+        with open(files[0], 'ab') as handle:
+            handle.write(b'changed')
+        assert second_cache.get_digest('sha1', files[0]) == hash_files('sha1', files[0])
+        # Concurrent instances merge their digests.
+        third_cache = DigestCache(accelerator.config)
+        third_cache.get_digest('sha1', files[1], files[2])
+        first_cache.get_digest('sha1', files[3], files[4])
+        assert len(DigestCache(accelerator.config).entries) == len(files) + 5
+
+    def test_untrusted_digests(self):
+        """
+        Test that checksums are calculated once per run when mod times aren't trusted.
+
+        This tests that :attr:`.Requirement.checksum` uses the digests that
+        :func:`~pip_accel.PipAccelerator.transform_pip_requirement_set()`
+        calculated up front (instead of hashing the archives again) and that
+        digests remembered by previous runs aren't used when
+        :attr:`.Config.trust_mod_times` is :data:`False`.
+        """
+        accelerator = self.initialize_pip_accel(trust_mod_times=False)
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-untrusted-digest-test')
+        archives = []
+        for i in range(2):
+            pathname = os.path.join(directory, 'example-1.0.%s' % ('tar.gz', 'zip')[i])
+            with open(pathname, 'wb') as handle:
+                handle.write(os.urandom(1024 * 64))
+            archives.append(pathname)
+        hashed = []
+        original_hash_files = digests_module.hash_files
+
+        def counting_hash_files(method, *files):
+            hashed.append(files)
+            return original_hash_files(method, *files)
+
+        with PatchedAttribute(digests_module, 'hash_files', counting_hash_files):
+            for expected_calls in (1, 2):
+                digest_cache = DigestCache(accelerator.config)
+                requirement = Requirement(accelerator.config, InstallRequirement.from_line('example==1.0'),
+                                          digest_cache=digest_cache)
+                requirement.__dict__['related_archives'] = list(reversed(archives))
+                digest_cache.get_digests('sha1', [sorted(requirement.related_archives)])
+                assert requirement.checksum == hash_files('sha1', *sorted(archives))
+                # Pre-hashing and the checksum share a single hash calculation,
+                # and the second run doesn't trust the digest of the first run.
+                assert len(hashed) == expected_calls
+
+    def test_resolution_cache(self):
+        """
+        Test the persistent memoization of requirement set resolution.
+
+        This tests the :class:`~pip_accel.resolution.ResolutionCache` class by
+        checking that a second pip-accel instance installs the same
+        requirements without running pip or unpacking archives, and that
+        changes to requirement files or the source index invalidate the
+        cached resolution.
+        """
+        accelerator = self.initialize_pip_accel()
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-resolution-test')
+        nested_file = os.path.join(directory, 'nested.txt')
+        with open(nested_file, 'w') as handle:
+            handle.write('pep8==1.6.2\n')
+        requirements_file = os.path.join(directory, 'requirements.txt')
+        with open(requirements_file, 'w') as handle:
+            handle.write('-r nested.txt\n')
+        assert find_requirement_files(['--requirement=%s' % requirements_file]) == [requirements_file, nested_file]
+        arguments = ['--ignore-installed', '--no-binary=:all:', '-r', requirements_file]
+        assert accelerator.install_from_arguments(arguments) == 1
+        second = self.initialize_pip_accel(data_directory=accelerator.config.data_directory)
+
+        def unexpected_pip(*args, **kw):
+            raise AssertionError("pip was run although the resolution was cached!")
+
+        with PatchedAttribute(second, 'get_pip_requirement_set', unexpected_pip):
+            requirements = second.get_requirements(arguments)
+            assert [(r.name, r.version, r.is_wheel) for r in requirements] == [('pep8', '1.6.2', False)]
+            assert isinstance(requirements[0], ResolvedRequirement)
+            assert second.install_requirements(requirements) == 1
+            # The cached binary distribution was installed without unpacking the archive.
+            assert 'source_directory' not in requirements[0].__dict__
+        __import__('pep8')
+        # The archive is unpacked when it's needed after all.
+        assert os.path.isfile(os.path.join(requirements[0].source_directory, 'setup.py'))
+        # Changing a (nested) requirement file invalidates the resolution.
+        key = second.resolution_cache.get_key(arguments, False)
+        with open(nested_file, 'a') as handle:
+            handle.write('# changed\n')
+        assert second.resolution_cache.get_key(arguments, False) != key
+        assert second.resolution_cache.get(arguments, False, second.build_directory) is None
+        # So does adding an archive to the source index.
+        assert second.get_requirements(arguments)
+        assert second.resolution_cache.get(arguments, False, second.build_directory) is not None
+        with open(os.path.join(second.config.source_index, 'pep8-1.7.0.tar.gz'), 'wb') as handle:
+            handle.write(b'not really an archive')
+        assert second.resolution_cache.get(arguments, False, second.build_directory) is None
+
+    def test_lazy_unpacking(self):
+        """
+        Test that source distributions whose binary distribution is cached aren't unpacked.
+
+        This tests the :class:`~pip_accel.metadata.LazyUnpackPatch` class by
+        checking that pip doesn't run ``setup.py egg_info`` for a source
+        distribution whose binary distribution is cached, while the name,
+        version and dependencies of the requirement are still known.
+        """
+        accelerator = self.initialize_pip_accel(cache_resolutions=False, lazy_unpacking=True)
+        arguments = ['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2']
+        assert accelerator.install_from_arguments(arguments) == 1
+        archive = find_one_file(accelerator.config.source_index, '*pep8-1.6.2*')
+        metadata = read_embedded_metadata(archive)
+        assert (metadata.name, metadata.version) == ('pep8', '1.6.2')
+        assert metadata.directory == 'pep8.egg-info'
+
+        def unexpected_egg_info(*args, **kw):
+            raise AssertionError("setup.py egg_info was run although the binary distribution is cached!")
+
+        with PatchedAttribute(InstallRequirement, 'run_egg_info', unexpected_egg_info):
+            requirements = accelerator.get_requirements(arguments)
+            assert [(r.name, r.version, r.is_wheel) for r in requirements] == [('pep8', '1.6.2', False)]
+            assert isinstance(requirements[0], ResolvedRequirement)
+            assert not os.path.isfile(os.path.join(requirements[0].pip_requirement.source_dir, 'setup.py'))
+            assert accelerator.install_requirements(requirements) == 1
+        # The archive is unpacked when it's needed after all.
+        assert os.path.isfile(os.path.join(requirements[0].source_directory, 'setup.py'))
+        # Without a cached binary distribution pip unpacks the archive as usual.
+        shutil.rmtree(accelerator.config.binary_cache)
+        requirements = accelerator.get_requirements(arguments)
+        assert not isinstance(requirements[0], ResolvedRequirement)
+        assert os.path.isfile(os.path.join(requirements[0].source_directory, 'setup.py'))
+
+    def test_dynamic_setup_scripts(self):
+        """
+        Test that the embedded metadata of dynamic ``setup.py`` scripts isn't used.
+
+        This tests :func:`~pip_accel.metadata.read_embedded_metadata()` by
+        checking that archives whose ``setup.py`` script computes its
+        dependencies from the Python version (or that don't contain a
+        ``setup.py`` script at all) are unpacked as usual.
+        """
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-dynamic-setup-test')
+        pkg_info = b'Metadata-Version: 1.0\nName: example\nVersion: 1.0\n'
+
+        def create_archive(filename, setup_script):
+            members = [('example-1.0/example.egg-info/PKG-INFO', pkg_info)]
+            if setup_script is not None:
+                members.append(('example-1.0/setup.py', setup_script))
+            pathname = os.path.join(directory, filename)
+            archive = tarfile.open(pathname, 'w:gz')
+            for name, contents in members:
+                member = tarfile.TarInfo(name)
+                member.size = len(contents)
+                archive.addfile(member, BytesIO(contents))
+            archive.close()
+            return pathname
+
+        static = create_archive('static.tar.gz', b'from setuptools import setup\nsetup(name="example")\n')
+        metadata = read_embedded_metadata(static)
+        assert (metadata.name, metadata.version) == ('example', '1.0')
+        dynamic = create_archive('dynamic.tar.gz', b'\n'.join([
+            b'import sys',
+            b'from setuptools import setup',
+            b'requires = ["argparse"] if sys.version_info < (2, 7) else []',
+            b'setup(name="example", install_requires=requires)',
+        ]))
+        assert read_embedded_metadata(dynamic) is None
+        assert read_embedded_metadata(create_archive('missing.tar.gz', None)) is None
+
+    def test_metadata_cache(self):
+        """
+        Test that ``setup.py egg_info`` runs only once for any given source distribution.
+
+        This tests the :class:`~pip_accel.metadata.MetadataCache` class by
+        checking that the metadata generated by ``setup.py egg_info`` is
+        reused for an archive that pip needs to unpack (because its binary
+        distribution isn't cached) and that it's keyed by the archive's
+        checksum.
+        """
+        accelerator = self.initialize_pip_accel(cache_resolutions=False)
+        arguments = ['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2']
+        assert accelerator.install_from_arguments(arguments) == 1
+        archive = find_one_file(accelerator.config.source_index, '*pep8-1.6.2*')
+        metadata_cache = MetadataCache(accelerator.config, accelerator.digest_cache)
+        metadata = metadata_cache.get(archive)
+        assert (metadata.name, metadata.version) == ('pep8', '1.6.2')
+        # Make sure pip needs to unpack the archive again.
+        shutil.rmtree(accelerator.config.binary_cache)
+
+        def unexpected_egg_info(*args, **kw):
+            raise AssertionError("setup.py egg_info was run although the metadata is cached!")
+
+        with PatchedAttribute(InstallRequirement, 'run_egg_info', unexpected_egg_info):
+            requirements = accelerator.get_requirements(arguments)
+            assert [(r.name, r.version, r.is_wheel) for r in requirements] == [('pep8', '1.6.2', False)]
+            assert os.path.isfile(os.path.join(requirements[0].source_directory, 'setup.py'))
+            assert accelerator.install_requirements(requirements) == 1
+        # The metadata is keyed by the checksum of the archive.
+        directory = metadata_cache.get_directory(archive)
+        shutil.copy(archive, os.path.join(accelerator.config.source_index, 'copy-of-pep8.tar.gz'))
+        assert metadata_cache.get_directory(os.path.join(accelerator.config.source_index,
+                                                         'copy-of-pep8.tar.gz')) == directory
+        with open(archive, 'ab') as handle:
+            handle.write(b'\0' * 1024)
+        assert metadata_cache.get(archive) is None
+
+    def test_install_fingerprints(self):
+        """
+        Test that unchanged installations are skipped without running pip.
+
+        This tests the :class:`~pip_accel.fingerprint.InstallFingerprints`
+        class by checking that repeating a successful installation doesn't run
+        pip, while changes to the installed distributions or using
+        ``--upgrade`` do run pip.
+        """
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-fingerprint-test')
+        sys.path.append(directory)
+        try:
+            accelerator = self.initialize_pip_accel(fingerprint_installs=True)
+            arguments = ['--no-binary=:all:', 'pep8==1.6.2']
+            accelerator.install_from_arguments(arguments)
+            second = self.initialize_pip_accel(data_directory=accelerator.config.data_directory,
+                                               fingerprint_installs=True)
+
+            def unexpected_pip(*args, **kw):
+                raise AssertionError("pip was run although the installation is known to be satisfied!")
+
+            with PatchedAttribute(second, 'get_requirements', unexpected_pip):
+                assert second.install_from_arguments(arguments) == 0
+            assert is_satisfied(second.config, arguments)
+            __import__('pep8')
+            # Options that change what pip does disable the fast path.
+            assert second.install_fingerprints.get_key(['--upgrade'] + arguments) is None
+            assert second.install_fingerprints.get_key(['-I'] + arguments) is None
+            assert second.install_fingerprints.get_key(['-qU'] + arguments) is None
+            assert second.install_fingerprints.get_key(['-vI'] + arguments) is None
+            assert second.install_fingerprints.get_key(['--upgr'] + arguments) is None
+            assert not is_unsupported_option('-rrequirements.txt')
+            assert not is_unsupported_option('--user')
+            # Installing a distribution changes the fingerprint.
+            key = second.install_fingerprints.get_key(arguments)
+            assert second.install_fingerprints.is_satisfied(key)
+            with open(os.path.join(directory, 'example-1.0.egg-info'), 'w') as handle:
+                handle.write('Metadata-Version: 1.0\nName: example\nVersion: 1.0\n')
+            assert not second.install_fingerprints.is_satisfied(key)
+        finally:
+            sys.path.remove(directory)
+        # The command line interface checks the fingerprints before importing pip.
+        python = subprocess.Popen([sys.executable, '-c', ';'.join([
+            'import sys, pip_accel.cli',
+            'print(sorted(m for m in sys.modules if m == "pip" or m.startswith("pip.")))',
+        ])], stdout=subprocess.PIPE)
+        output, _ = python.communicate()
+        assert python.returncode == 0
+        if sys.version_info[:2] >= (3, 5):
+            assert output.decode('UTF-8').strip() == '[]'
+        # The package finder is still available from the top level module.
+        from pip_accel import CustomPackageFinder as imported_finder
+        from pip_accel.req import CustomPackageFinder
+        assert imported_finder is CustomPackageFinder
+
+    def test_lockfile(self):
+        """
+        Test lockfile generation and lockfile driven installation.
+
+        This tests :func:`~pip_accel.PipAccelerator.create_lockfile()` and
+        :func:`~pip_accel.PipAccelerator.install_from_lockfile()` by checking
+        that a lockfile is written after installation, that installing from
+        the lockfile doesn't run pip when the binary distribution is cached
+        and that pip is used when the binary distribution is missing.
+        """
+        directory = create_temporary_directory(prefix='pip-accel-', suffix='-lockfile-test')
+        lockfile = os.path.join(directory, 'requirements.lock')
+        accelerator = self.initialize_pip_accel(lockfile=lockfile)
+        assert accelerator.install_from_arguments(['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2']) == 1
+        entries = read_lockfile(lockfile)
+        assert [(e['name'], e['version'], e['is_wheel']) for e in entries] == [('pep8', '1.6.2', False)]
+        assert entries[0]['archive'].startswith('pep8-1.6.2')
+        assert entries[0]['cache_key'] == FILENAME_PATTERN % (accelerator.config.cache_format_revision, 'pep8', '1.6.2',
+                                                              get_python_version(), INDEXED_ARCHIVE_SUFFIX)
+        second = self.initialize_pip_accel(data_directory=accelerator.config.data_directory)
+
+        def unexpected_pip(*args, **kw):
+            raise AssertionError("pip was run although the binary distribution is cached!")
+
+        # Pretend that pep8 isn't installed (pkg_resources doesn't notice
+        # installations and removals made by the current process).
+        with PatchedAttribute(InstallRequirement, 'check_if_exists', lambda self: False):
+            with PatchedAttribute(second, 'get_requirements', unexpected_pip):
+                assert second.install_from_lockfile(lockfile) == 1
+            __import__('pep8')
+            # pip is used for requirements whose binary distribution is missing.
+            shutil.rmtree(second.config.binary_cache)
+            assert second.install_from_lockfile(lockfile) == 1
+            assert second.bdists.cache.get(LockedRequirement(second.config, entries[0]))
+        # Other files are refused.
+        with open(lockfile, 'w') as handle:
+            handle.write('pep8==1.6.2\n')
+        self.assertRaises(InvalidLockfile, second.install_from_lockfile, lockfile)
+        assert test_cli('pip-accel', 'install-lockfile') == 1
+
+    def test_cache_locking(self):
+        """
+        Test that concurrent builds of the same binary distribution are serialized.
+
+        This tests the :class:`~pip_accel.caches.local.FileLock` class by
+        acquiring the lock of the same (fictional) distribution archive from
+        two threads and by killing a process that holds the lock.
+        """
+        if fcntl is None:
+            return self.skipTest("advisory file locking not supported on this platform")
+        accelerator = self.initialize_pip_accel()
+        backend = LocalCacheBackend(accelerator.config)
+        filename = 'v7/locking-test:1.0:py.tar.gz'
+        events = []
+        first_lock = backend.lock(filename)
+        assert first_lock.acquire(blocking=False)
+        assert not backend.lock(filename).acquire(blocking=False), "Non-blocking acquire ignored the holder!"
+
+        def contender():
+            second_lock = backend.lock(filename)
+            second_lock.acquire()
+            events.append('acquired')
+            second_lock.release()
+
+        thread = threading.Thread(target=contender)
+        thread.start()
+        time.sleep(1)
+        events.append('released')
+        first_lock.release()
+        thread.join(30)
+        assert events == ['released', 'acquired'], "Lock didn't serialize concurrent builds!"
+        # Locks held by processes that die are released automatically.
+        lock_file = os.path.join(accelerator.config.binary_cache, '%s.lock' % filename)
+        holder = subprocess.Popen([sys.executable, '-c', ';'.join([
+            'import fcntl, sys, time',
+            'handle = open(%r, "a+")' % lock_file,
+            'fcntl.flock(handle.fileno(), fcntl.LOCK_EX)',
+            'sys.stdout.write("locked\\n")',
+            'sys.stdout.flush()',
+            'time.sleep(60)',
+        ])], stdout=subprocess.PIPE)
+        assert holder.stdout.readline().strip() == b'locked'
+        holder.kill()
+        holder.wait()
+        thread = threading.Thread(target=contender)
+        thread.start()
+        thread.join(30)
+        assert not thread.is_alive(), "Stale lock of dead process wasn't released!"
+
     def test_s3_backend(self):
         """
         Verify the successful usage of the S3 cache backend.
@@ -375,6 +1525,7 @@ class PipAccelTestCase(unittest.TestCase):
                         '--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2',
                     ])
                     assert num_installed == 1, "Expected pip-accel to install exactly one package!"
+                    accelerator.bdists.cache.uploads.drain()
                     # Check the state of the S3 cache backend.
                     if i < 3:
                         assert not accelerator.config.s3_cache_readonly, \
@@ -385,6 +1536,160 @@ class PipAccelTestCase(unittest.TestCase):
         except CommandNotFound:
             self.skipTest("Skipping S3 cache backend test because FakeS3 isn't installed.")
 
+    def test_s3_leases(self):
+        """
+        Verify the build lease protocol of the S3 cache backend.
+
+        This test uses two :class:`~pip_accel.caches.s3.S3Lease` objects for
+        the same (fictional) distribution archive to verify that the second
+        lease waits while the first lease is live, that waiting ends when the
+        archive is uploaded and that the lease of a crashed build expires. It
+        depends on FakeS3.
+        """
+        try:
+            with FakeS3Server() as fakes3:
+                accelerator = self.initialize_pip_accel(s3_cache_lease_ttl=2, **fakes3.client_options)
+                backend = S3CacheBackend(accelerator.config)
+                # Threads that share the backend don't share a Boto connection.
+                buckets = []
+                thread = threading.Thread(target=lambda: buckets.append(backend.s3_bucket))
+                thread.start()
+                thread.join()
+                assert buckets[0] is not backend.s3_bucket
+                assert backend.s3_bucket is backend.s3_bucket
+                filename = 'v7/lease-test:1.0:py.tar.gz'
+                first_lease = backend.lock(filename)
+                first_lease.acquire()
+                assert first_lease.read_lease()['token'] == first_lease.token
+                # The second lease waits until the archive is uploaded.
+                second_lease = backend.lock(filename)
+                thread = threading.Thread(target=second_lease.acquire)
+                thread.start()
+                time.sleep(3)
+                assert thread.is_alive(), "Second lease didn't wait for the first lease!"
+                backend.put(filename, BytesIO(b'distribution archive'))
+                thread.join(30)
+                assert not thread.is_alive(), "Second lease didn't notice the uploaded archive!"
+                assert second_lease.renewer is None, "Second lease shouldn't be held!"
+                first_lease.release()
+                assert first_lease.read_lease() is None, "Lease wasn't deleted on release!"
+                # The lease of a crashed build expires.
+                filename = 'v7/lease-test:2.0:py.tar.gz'
+                crashed_lease = backend.lock(filename)
+                crashed_lease.acquire()
+                crashed_lease.stopped.set()
+                second_lease = backend.lock(filename)
+                thread = threading.Thread(target=second_lease.acquire)
+                thread.start()
+                thread.join(30)
+                assert second_lease.read_lease()['token'] == second_lease.token, \
+                    "Second lease didn't take over the expired lease!"
+                second_lease.release()
+        except CommandNotFound:
+            self.skipTest("Skipping S3 build lease test because FakeS3 isn't installed.")
+
+    def test_s3_prefetch(self):
+        """
+        Verify that binary distributions are prefetched from the S3 cache backend.
+
+        This test uploads a binary distribution to FakeS3, wipes the local
+        binary cache and checks that
+        :func:`~pip_accel.caches.s3.S3CacheBackend.prefetch()` downloads the
+        archive to the local cache (and ignores archives that are missing from
+        the bucket). It depends on FakeS3.
+        """
+        try:
+            with FakeS3Server() as fakes3:
+                accelerator = self.initialize_pip_accel(**fakes3.client_options)
+                accelerator.install_from_arguments(['--ignore-installed', '--no-binary=:all:', 'pep8==1.6.2'])
+                accelerator.bdists.cache.uploads.drain()
+                wipe_directory(accelerator.config.binary_cache)
+                revision = accelerator.config.cache_format_revision
+                filenames = [FILENAME_PATTERN % (revision, name, '1.6.2', get_python_version(), INDEXED_ARCHIVE_SUFFIX)
+                             for name in ('pep8', 'missing')]
+                assert S3CacheBackend(accelerator.config).prefetch(filenames) == set(filenames[:1])
+                assert LocalCacheBackend(accelerator.config).get(filenames[0]), \
+                    "Prefetched archive is missing from the local cache!"
+        except CommandNotFound:
+            self.skipTest("Skipping S3 prefetch test because FakeS3 isn't installed.")
+
+    def test_s3_multipart(self):
+        """
+        Verify that large archives are transferred to and from the S3 cache backend in parts.
+
+        This test uploads an object that's larger than two parts using
+        :func:`~pip_accel.caches.s3.S3CacheBackend.upload()` and downloads it
+        again using :func:`~pip_accel.caches.s3.S3CacheBackend.download_to_file()`.
+        It depends on FakeS3.
+        """
+        try:
+            with FakeS3Server() as fakes3:
+                accelerator = self.initialize_pip_accel(s3_cache_multipart_threshold='1 MB',
+                                                        s3_cache_part_size='1 MB',
+                                                        **fakes3.client_options)
+                backend = S3CacheBackend(accelerator.config)
+                # Parts are at least 5 MiB because S3 requires it.
+                assert accelerator.config.s3_cache_part_size == 5 * 1024 * 1024
+                data = os.urandom(accelerator.config.s3_cache_part_size * 2 + 1024)
+                assert backend.use_parts(len(data)) and not backend.use_parts(1024)
+                raw_key = backend.get_cache_key('v7/multipart-test:1.0:py.tar.gz')
+                backend.upload(raw_key, BytesIO(data))
+                key = backend.s3_bucket.get_key(raw_key)
+                assert key.size == len(data)
+                filename = os.path.join(create_temporary_directory(), 'download')
+                backend.download_to_file(key, filename)
+                with open(filename, 'rb') as handle:
+                    assert handle.read() == data, "Parts were reassembled incorrectly!"
+        except CommandNotFound:
+            self.skipTest("Skipping S3 multipart test because FakeS3 isn't installed.")
+
+    def test_s3_index(self):
+        """
+        Verify that the S3 cache backend answers cache lookups using its cache index.
+
+        This test uploads a distribution archive using
+        :func:`~pip_accel.caches.s3.S3CacheBackend.put()`, checks that it's
+        listed in the cache index (see :class:`~pip_accel.caches.s3.S3CacheIndex`)
+        and that a new S3 cache backend finds it (and doesn't find a missing
+        archive) without checking for the existence of either. In read only
+        mode without an index object the listing of the bucket is reused and
+        unlisted archives are still found. It depends on FakeS3.
+        """
+        try:
+            with FakeS3Server() as fakes3:
+                accelerator = self.initialize_pip_accel(**fakes3.client_options)
+                filename = 'v9/index-test:1.0:py.tar'
+                data = b'distribution archive'
+                S3CacheBackend(accelerator.config).put(filename, BytesIO(data))
+                backend = S3CacheBackend(accelerator.config)
+                entry = backend.index.entries[filename]
+                assert entry['size'] == len(data)
+                assert entry['digest'] == hashlib.sha1(data).hexdigest()
+                with PatchedAttribute(backend.s3_bucket, 'get_key', None):
+                    assert backend.find_key(filename).size == len(data)
+                    assert backend.find_key('v9/missing:1.0:py.tar') is None
+                assert backend.get(filename), "Indexed archive wasn't downloaded!"
+                assert backend.index.complete
+                # Read only processes can't create a missing index object.
+                backend.s3_bucket.delete_key(backend.index.index_key)
+                accelerator.config.s3_cache_readonly = True
+                listing = S3CacheBackend(accelerator.config)
+                assert filename in listing.index.entries
+                assert not listing.index.complete
+                later = 'v9/index-test:2.0:py.tar'
+                from boto.s3.key import Key
+                key = Key(backend.s3_bucket, backend.get_cache_key(later))
+                key.set_contents_from_string(data)
+                # The listing is reused and archives that it doesn't list are looked up.
+                readonly = S3CacheBackend(accelerator.config)
+                with PatchedAttribute(readonly.index, 'list_archives', None):
+                    assert filename in readonly.index.entries, "Listing of S3 bucket wasn't reused!"
+                assert later not in readonly.index.entries
+                assert readonly.find_key(later) is not None, "Unlisted archive wasn't looked up!"
+                assert readonly.find_key('v9/missing:1.0:py.tar') is None
+        except CommandNotFound:
+            self.skipTest("Skipping S3 cache index test because FakeS3 isn't installed.")
+
     def test_wheel_install(self):
         """
         Test the installation of a package from a wheel distribution.
@@ -637,9 +1942,13 @@ class PipAccelTestCase(unittest.TestCase):
                 skipping setup requires caching test
                 (setuptools >= 7.0 isn't available)
             """)
-        # Initialize pip-accel with an isolated working tree.
+        # Initialize pip-accel with an isolated working tree (the second
+        # installation should run pip again and pip should run `setup.py
+        # egg_info' again, so resolutions and metadata aren't cached and
+        # archives are always unpacked).
         root = create_temporary_directory(prefix='pip-accel-', suffix='-setup-requires-test')
-        accelerator = self.initialize_pip_accel(data_directory=root)
+        accelerator = self.initialize_pip_accel(data_directory=root, cache_resolutions=False,
+                                                lazy_unpacking=False, cache_metadata=False)
         # In this test we'll generate the following two Python packages.
         setup_requires_provider = 'setup-requires-provider'
         setup_requires_user = 'setup-requires-user'
@@ -761,7 +2070,7 @@ class PipAccelTestCase(unittest.TestCase):
         accelerator.install_from_arguments(['--ignore-installed', create_source_dist(self.pycodestyle_git_repo)])
         # Find the modification time of the source and binary distributions.
         sdist_mtime_1 = os.path.getmtime(find_one_file(accelerator.config.source_index, '*pycodestyle*'))
-        bdist_mtime_1 = os.path.getmtime(find_one_file(accelerator.config.binary_cache, '*pycodestyle*.tar.gz'))
+        bdist_mtime_1 = os.path.getmtime(find_one_file(accelerator.config.binary_cache, '*pycodestyle*.json'))
         # Install the pycodestyle package for the second time, using a newly
         # created source distribution archive with different contents.
         with open(os.path.join(self.pycodestyle_git_repo, 'MANIFEST.in'), 'w') as handle:
@@ -769,7 +2078,7 @@ class PipAccelTestCase(unittest.TestCase):
         accelerator.install_from_arguments(['--ignore-installed', create_source_dist(self.pycodestyle_git_repo)])
         # Find the modification time of the source and binary distributions.
         sdist_mtime_2 = os.path.getmtime(find_one_file(accelerator.config.source_index, '*pycodestyle*'))
-        bdist_mtime_2 = os.path.getmtime(find_one_file(accelerator.config.binary_cache, '*pycodestyle*.tar.gz'))
+        bdist_mtime_2 = os.path.getmtime(find_one_file(accelerator.config.binary_cache, '*pycodestyle*.json'))
         # Check that the source distribution's modification time changed
         # (because we created it by running the `python setup.py sdist'
         # command a second time).
@@ -1,7 +1,7 @@
 # Utility functions for the pip accelerator.
 #
 # Author: Peter Odding <peter.odding@paylogic.com>
-# Last Change: January 17, 2016
+# Last Change: October 16, 2026
 # URL: https://github.com/paylogic/pip-accel
 
 """
@@ -25,14 +25,6 @@ from pip_accel.compat import pathname2url, urljoin, WINDOWS
 
 # External dependencies.
 from humanfriendly import parse_path
-from pip.commands.uninstall import UninstallCommand
-
-# The following package(s) are usually bundled with pip but may be unbundled
-# by redistributors and pip-accel should handle this gracefully.
-try:
-    from pip._vendor.pkg_resources import DistributionNotFound, WorkingSet, get_distribution, parse_requirements
-except ImportError:
-    from pkg_resources import DistributionNotFound, WorkingSet, get_distribution, parse_requirements
 
 # Initialize a logger for this module.
 logger = logging.getLogger(__name__)
@@ -188,18 +180,36 @@ def hash_files(method, *files):
     :param method: The hash method (a string, given to :func:`hashlib.new()`).
     :param files: The pathname(s) of file(s) to hash (zero or more strings).
     :returns: The calculated hex digest (a string).
+
+    Files are read in chunks of one megabyte (large chunks mean less
+    overhead per chunk and :mod:`hashlib` releases the global interpreter
+    lock while hashing them). See also :class:`.DigestCache`.
     """
     context = hashlib.new(method)
     for filename in files:
         with open(filename, 'rb') as handle:
             while True:
-                chunk = handle.read(4096)
+                chunk = handle.read(1024 * 1024)
                 if not chunk:
                     break
                 context.update(chunk)
     return context.hexdigest()
 
 
+def get_mtime_ns(info):
+    """
+    Get the last modified time of a file with nanosecond resolution.
+
+    :param info: The result of :func:`os.stat()`.
+    :returns: The last modified time in nanoseconds since the epoch (an integer).
+    """
+    mtime_ns = getattr(info, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # Python 2 doesn't provide nanosecond resolution time stamps.
+        mtime_ns = int(info.st_mtime * 1000000000)
+    return mtime_ns
+
+
 def replace_file(src, dst):
     """
     Overwrite a file (in an atomic fashion when possible).
@@ -260,6 +270,24 @@ class AtomicReplace(object):
             replace_file(self.temporary_file, self.filename)
 
 
+def import_pkg_resources():
+    """
+    Import the :mod:`pkg_resources` module bundled with pip.
+
+    :returns: The :mod:`pkg_resources` module.
+
+    The :mod:`pkg_resources` module is usually bundled with pip but may be
+    unbundled by redistributors and pip-accel should handle this gracefully.
+    It's imported on demand so that importing this module doesn't import pip
+    (see :mod:`pip_accel.fingerprint`).
+    """
+    try:
+        from pip._vendor import pkg_resources
+    except ImportError:
+        import pkg_resources
+    return pkg_resources
+
+
 def requirement_is_installed(expr):
     """
     Check whether a requirement is installed.
@@ -269,11 +297,12 @@ def requirement_is_installed(expr):
     :returns: :data:`True` if the requirement is available (installed),
               :data:`False` otherwise.
     """
-    required_dist = next(parse_requirements(expr))
+    pkg_resources = import_pkg_resources()
+    required_dist = next(pkg_resources.parse_requirements(expr))
     try:
-        installed_dist = get_distribution(required_dist.key)
+        installed_dist = pkg_resources.get_distribution(required_dist.key)
         return installed_dist in required_dist
-    except DistributionNotFound:
+    except pkg_resources.DistributionNotFound:
         return False
 
 
@@ -284,7 +313,8 @@ def is_installed(package_name):
     :param package_name: The name of the package (a string).
     :returns: :data:`True` if the package is installed, :data:`False` otherwise.
     """
-    return package_name.lower() in (d.key.lower() for d in WorkingSet())
+    pkg_resources = import_pkg_resources()
+    return package_name.lower() in (d.key.lower() for d in pkg_resources.WorkingSet())
 
 
 def uninstall(*package_names):
@@ -297,6 +327,8 @@ def uninstall(*package_names):
 
     :param package_names: The names of one or more Python packages (strings).
     """
+    # Imported here so that importing this module doesn't import pip.
+    from pip.commands.uninstall import UninstallCommand
     command = UninstallCommand()
     opts, args = command.parse_args(['--yes'] + list(package_names))
     command.run(opts, args)
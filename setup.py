@@ -70,7 +70,12 @@ setup(name='pip-accel',
               's3 = pip_accel.caches.s3 [s3]',
           ],
       },
-      extras_require={'s3': 'boto >= 2.32'},
+      extras_require={
+          's3': 'boto >= 2.32',
+          # Optional compression codecs (see pip_accel.compression).
+          'zstd': 'zstandard',
+          'lz4': 'lz4',
+      },
       package_data={'pip_accel.deps': ['*.ini']},
       install_requires=get_requirements('requirements.txt'),
       test_suite='pip_accel.tests',